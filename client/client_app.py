@@ -74,14 +74,24 @@ class APIClient:
         self.server_url = server_url
         self.client_id = client_id
         self.hardware_id = hardware_id
+        self.auth_token = None  # 服务器签发的短期授权令牌
     
     def _get_headers(self):
-        """获取请求头"""
-        return {
+        """获取请求头（持有令牌时带上 X-Auth-Token，服务器验签即可放行）"""
+        headers = {
             'Content-Type': 'application/json',
             'X-Client-ID': self.client_id,
             'X-Hardware-ID': self.hardware_id
         }
+        if self.auth_token:
+            headers['X-Auth-Token'] = self.auth_token
+        return headers
+    
+    def _remember_token(self, response):
+        """服务器查库放行后会在响应头下发新令牌"""
+        token = response.headers.get('X-Auth-Token')
+        if token:
+            self.auth_token = token
     
     def health_check(self):
         """健康检查"""
@@ -100,6 +110,7 @@ class APIClient:
                 json={'keyword': keyword, 'max_count': max_count},
                 timeout=60
             )
+            self._remember_token(response)
             return response.json()
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -113,9 +124,16 @@ class APIClient:
                 json={'products': products, 'discount_threshold': discount_threshold},
                 timeout=120
             )
+            self._remember_token(response)
             return response.json()
         except Exception as e:
             return {'success': False, 'error': str(e)}
+    
+    def active_rules(self):
+        """获取启用的规则列表"""
+        response = requests.get(f"{self.server_url}/api/rules/active", headers=self._get_headers(), timeout=15)
+        self._remember_token(response)
+        return response.json()
 
 # ==================== GUI 主界面 ====================
 
@@ -422,11 +440,7 @@ class PriceComparisonApp:
     def sync_rules(self):
         """从服务器同步规则列表"""
         try:
-            headers = {
-                'X-Client-ID': self.client_id,
-                'X-Hardware-ID': self.hardware_id
-            }
-            resp = requests.get(f"{self.server_url}/api/rules/active", headers=headers, timeout=15).json()
+            resp = self.api.active_rules()
             if resp.get('success'):
                 rules = resp.get('data', [])
                 self.rules_cache = rules
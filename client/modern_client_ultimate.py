@@ -23,6 +23,8 @@ import pandas as pd
 from PIL import Image
 from io import BytesIO
 import base64
+import gzip
+import atexit
 import webbrowser
 import logging
 import traceback
@@ -116,6 +118,12 @@ class Config:
     
     # 验证码输入超时
     CODE_INPUT_TIMEOUT = 60  # 验证码输入超时（秒）
+    
+    # 埋点批量上报
+    EVENT_BATCH_SIZE = 50  # 缓冲满多少条立即上报
+    EVENT_FLUSH_INTERVAL = 30  # 定时上报间隔（秒）
+    EVENT_BUFFER_MAX = 1000  # 本地最多缓冲条数（上报失败时丢弃最旧的）
+    EVENT_REQUEST_TIMEOUT = 10  # 上报请求超时（秒）
 
 # 仿微信配色
 class Theme:
@@ -216,6 +224,79 @@ def get_hardware_id() -> str:
         logger.error(f"生成硬件ID失败: {e}")
         return "HARDWARE_ERROR"
 
+class EventBuffer:
+    """埋点事件本地缓冲：按数量或时间批量上报到 /api/events/batch（gzip压缩），程序退出时补发"""
+    
+    def __init__(self, headers_provider):
+        self._headers_provider = headers_provider
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.close)
+    
+    def track(self, action: str, detail: Optional[Dict[str, Any]] = None, success: bool = True) -> None:
+        """记录一条事件（不发请求，只进缓冲）"""
+        with self._lock:
+            self._events.append({
+                'action': action,
+                'detail': detail or {},
+                'success': success,
+                'ts': time.time()
+            })
+            self._trim()
+            full = len(self._events) >= Config.EVENT_BATCH_SIZE
+        if full:
+            self._wakeup.set()
+    
+    def _trim(self) -> None:
+        overflow = len(self._events) - Config.EVENT_BUFFER_MAX
+        if overflow > 0:
+            del self._events[:overflow]
+    
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(Config.EVENT_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+    
+    def flush(self) -> bool:
+        """上报缓冲中的全部事件；失败时放回缓冲等待下次重试"""
+        with self._lock:
+            batch, self._events = self._events, []
+        if not batch:
+            return True
+        
+        try:
+            headers = dict(self._headers_provider())
+            headers.update({'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+            body = gzip.compress(json.dumps({'events': batch}, ensure_ascii=False).encode('utf-8'))
+            response = requests.post(
+                f"{SERVER_URL}/api/events/batch",
+                headers=headers,
+                data=body,
+                timeout=Config.EVENT_REQUEST_TIMEOUT
+            )
+            if response.ok:
+                return True
+            logger.warning(f"埋点上报失败: HTTP {response.status_code}")
+        except requests.RequestException as e:
+            logger.warning(f"埋点上报网络异常: {e}")
+        
+        with self._lock:
+            self._events[:0] = batch
+            self._trim()
+        return False
+    
+    def close(self) -> None:
+        """停止定时上报并发送剩余事件"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+
 # ==================== 主应用 ====================
 
 class UltimateApp(ctk.CTk):
@@ -234,10 +315,30 @@ class UltimateApp(ctk.CTk):
         self.trial_start_time = None
         self.douyin_logged_in = False  # 抖音登录状态
         self.rank_options = {}  # 动态获取的选项
+        self.auth_token = None  # 服务器签发的短期授权令牌（X-Auth-Token）
+        
+        # 埋点缓冲（批量上报）
+        self.events = EventBuffer(self._auth_headers)
         
         # 自动注册并初始化
         self.auto_register()
     
+    def _auth_headers(self) -> Dict[str, str]:
+        """业务请求的身份头；持有令牌时一并带上，服务器验签即可放行"""
+        headers = {
+            'X-Client-ID': self.client_id or '',
+            'X-Hardware-ID': self.hardware_id
+        }
+        if self.auth_token:
+            headers['X-Auth-Token'] = self.auth_token
+        return headers
+    
+    def _remember_token(self, response: requests.Response) -> None:
+        """服务器查库放行后会在响应头下发新令牌，替换本地令牌"""
+        token = response.headers.get('X-Auth-Token')
+        if token:
+            self.auth_token = token
+    
     def auto_register(self) -> None:
         """自动注册并初始化客户端"""
         config = load_config()
@@ -272,6 +373,7 @@ class UltimateApp(ctk.CTk):
                     if result.get('success'):
                         self.client_id = result['client_id']
                         self.is_active = result['is_active']
+                        self.auth_token = result.get('token')
                         
                         config['client_id'] = self.client_id
                         config['is_active'] = self.is_active
@@ -635,11 +737,8 @@ class UltimateApp(ctk.CTk):
         """登录线程"""
         try:
             logger.info(f"登录线程启动，email={email}")
-            headers = {
-                'X-Client-ID': self.client_id,
-                'X-Hardware-ID': self.hardware_id,
-                'Content-Type': 'application/json'
-            }
+            headers = self._auth_headers()
+            headers['Content-Type'] = 'application/json'
             
             logger.info(f"准备发送登录请求到 {SERVER_URL}/api/douyin-login-start")
             # 登录
@@ -649,6 +748,7 @@ class UltimateApp(ctk.CTk):
                 json={'email': email, 'password': password},
                 timeout=Config.LOGIN_TIMEOUT
             )
+            self._remember_token(response)
             
             logger.info(f"收到响应，状态码: {response.status_code}")
             if response.status_code == 403:
@@ -700,10 +800,11 @@ class UltimateApp(ctk.CTk):
                 
                 response = requests.post(
                     f"{SERVER_URL}/api/douyin-submit-code",
-                    headers=headers,
+                    headers=dict(headers, **self._auth_headers()),  # 登录响应可能刚下发了新令牌
                     json={'code': code},
                     timeout=30
                 )
+                self._remember_token(response)
                 
                 result = response.json()
                 if not result.get('success'):
@@ -722,6 +823,7 @@ class UltimateApp(ctk.CTk):
         """登录成功"""
         self.screenshot_polling = False
         self.douyin_logged_in = True
+        self.events.track('douyin_login')
         
         # 保存登录状态到配置文件
         config = load_config()
@@ -743,6 +845,7 @@ class UltimateApp(ctk.CTk):
     def _login_failed(self, error):
         """登录失败"""
         self.screenshot_polling = False
+        self.events.track('douyin_login', {'error': str(error)}, success=False)
         self.douyin_login_btn.configure(state="normal", text="🚀 重新登录")
         self.douyin_progress_label.configure(text="❌ 登录失败")
         self.douyin_status_label.configure(text="❌ 未登录", text_color=Theme.RED)
@@ -767,16 +870,14 @@ class UltimateApp(ctk.CTk):
                 if hasattr(self, 'screenshot_status'):
                     self.after(0, lambda: self.screenshot_status.configure(text="🔄 正在刷新..."))
                 
-                headers = {
-                    'X-Client-ID': self.client_id,
-                    'X-Hardware-ID': self.hardware_id,
-                }
+                headers = self._auth_headers()
                 
                 response = requests.post(
                     f"{SERVER_URL}/api/douyin-screenshot",
                     headers=headers,
                     timeout=Config.SCREENSHOT_REQUEST_TIMEOUT
                 )
+                self._remember_token(response)
                 
                 if response.status_code == 403:
                     logger.warning("截图请求被拒绝（403）")
@@ -1097,11 +1198,8 @@ class UltimateApp(ctk.CTk):
         """选品线程"""
         try:
             logger.info("开始智能选品")
-            headers = {
-                'X-Client-ID': self.client_id,
-                'X-Hardware-ID': self.hardware_id,
-                'Content-Type': 'application/json'
-            }
+            headers = self._auth_headers()
+            headers['Content-Type'] = 'application/json'
             
             data = {
                 'rank_type': self.rank_type_var.get(),
@@ -1121,6 +1219,7 @@ class UltimateApp(ctk.CTk):
                 json=data,
                 timeout=Config.SCRAPE_TIMEOUT
             )
+            self._remember_token(response)
             
             logger.info(f"选品响应状态: {response.status_code}")
             
@@ -1171,6 +1270,7 @@ class UltimateApp(ctk.CTk):
     
     def _selection_success(self, products, excel_file):
         """选品成功"""
+        self.events.track('smart_selection', {'count': len(products)})
         self.start_btn.configure(state="normal", text="🚀 开始智能选品")
         self.selection_progress.configure(text=f"✅ 成功获取 {len(products)} 个商品！")
         
@@ -1264,6 +1364,7 @@ class UltimateApp(ctk.CTk):
     
     def _selection_failed(self, error):
         """选品失败"""
+        self.events.track('smart_selection', {'error': str(error)}, success=False)
         self.start_btn.configure(state="normal", text="🚀 开始智能选品")
         self.selection_progress.configure(text="❌ 选品失败")
         messagebox.showerror("选品失败", error)
@@ -10,17 +10,27 @@ import numpy as np
 from PIL import Image
 from io import BytesIO
 import jieba
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.feature_extraction.text import HashingVectorizer
 import imagehash
-from typing import List, Dict, Tuple
+from typing import List, Dict, Sequence, Tuple
+
+# 原实现对每一对标题单独 fit 一个 TfidfVectorizer：两篇文档时，两边都有的词 idf=1，只在一边出现的词
+# idf=1+ln(3/2)。批量计算时保持同样的打分（阈值含义不变）
+_PAIR_IDF = 1 + np.log(1.5)
+
+# 词频向量化：哈希到固定维度，无需拟合词表（分词规则与 TfidfVectorizer 默认一致）
+_vectorizer = HashingVectorizer(n_features=2 ** 20, alternate_sign=False, norm=None)
+
+_UNSET = object()  # 尚未取过图片哈希
 
 class ProductMatcher:
     """商品智能匹配"""
     
-    def __init__(self):
+    def __init__(self, image_store=None):
         self.text_threshold = 0.6  # 文本相似度阈值
         self.image_threshold = 10   # 图片哈希距离阈值
+        # 图片缓存 + 感知哈希库（image_store.ImageStore）；不传时每次都下载图片、重新计算哈希
+        self.image_store = image_store
     
     def match_products(self, source_product: Dict, candidate_products: List[Dict]) -> List[Tuple[Dict, float]]:
         """
@@ -33,79 +43,117 @@ class ProductMatcher:
         Returns:
             匹配结果列表 [(商品, 综合相似度得分), ...]
         """
-        results = []
+        return self.match_many([source_product], candidate_products)[0]
+    
+    def match_many(self, source_products: Sequence[Dict], candidate_products: Sequence[Dict]) -> List[List[Tuple[Dict, float]]]:
+        """
+        批量匹配：多个源商品与同一组候选商品
+        所有标题只分词一次，文本相似度用稀疏矩阵乘法一次算出；图片只对文本相似度达标的配对计算
         
-        for candidate in candidate_products:
-            # 1. 文本相似度
-            text_sim = self._calculate_text_similarity(
-                source_product['title'],
-                candidate['title']
-            )
-            
-            # 2. 图片相似度
-            image_sim = self._calculate_image_similarity(
-                source_product.get('image_url'),
-                candidate.get('image_url')
-            )
-            
-            # 3. 综合得分（文本70% + 图片30%）
-            total_score = text_sim * 0.7 + image_sim * 0.3
-            
+        Returns:
+            与 source_products 对齐，每个源商品的匹配结果 [(商品, 综合相似度得分), ...]
+        """
+        text_sims = self.text_similarities(
+            [source['title'] for source in source_products],
+            [candidate['title'] for candidate in candidate_products]
+        )
+        
+        all_results = []
+        candidate_hashes = {}
+        for source_product, row in zip(source_products, text_sims):
+            results = []
+            source_hash = _UNSET
             # 过滤：文本相似度必须达标
-            if text_sim >= self.text_threshold:
-                results.append((candidate, total_score))
+            for j in np.flatnonzero(row >= self.text_threshold).tolist():
+                candidate = candidate_products[j]
+                text_sim = float(row[j])
+                
+                # 图片相似度（每张图只取一次哈希）
+                if source_hash is _UNSET:
+                    source_hash = self._image_hash(source_product.get('image_url'))
+                if j not in candidate_hashes:
+                    candidate_hashes[j] = self._image_hash(candidate.get('image_url'))
+                image_sim = self._hash_similarity(source_hash, candidate_hashes[j])
+                
+                # 综合得分（文本70% + 图片30%）
+                results.append((candidate, text_sim * 0.7 + image_sim * 0.3))
+            
+            # 按得分排序
+            results.sort(key=lambda x: x[1], reverse=True)
+            all_results.append(results)
+        return all_results
+    
+    def text_similarities(self, texts1: Sequence[str], texts2: Sequence[str]) -> np.ndarray:
+        """
+        文本相似度矩阵（m×n），与逐对 TF-IDF + 余弦相似度的结果一致
         
-        # 按得分排序
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results
+        逐对拟合时 idf 只取决于词是否两边都出现，所以加权后的点积和模长可以拆成词频矩阵的稀疏乘积：
+            分子          S·Cᵀ
+            源向量模长²   k²·|s|² - (k²-1)·(S∘S)·[C>0]ᵀ
+            候选向量模长² k²·|c|² - (k²-1)·[S>0]·(C∘C)ᵀ      （k = 1+ln(3/2)）
+        """
+        if not len(texts1) or not len(texts2):
+            return np.zeros((len(texts1), len(texts2)))
+        
+        # 分词（每个标题一次），再哈希成词频矩阵
+        counts = _vectorizer.transform([' '.join(jieba.cut(text or '')) for text in list(texts1) + list(texts2)])
+        S, C = counts[:len(texts1)], counts[len(texts1):]
+        S_squared, C_squared = S.multiply(S).tocsr(), C.multiply(C).tocsr()
+        S_present, C_present = (S > 0).astype(np.float64), (C > 0).astype(np.float64)
+        
+        k2 = _PAIR_IDF ** 2
+        dot = (S @ C.T).toarray()
+        source_norms = k2 * np.asarray(S_squared.sum(axis=1)) - (k2 - 1) * (S_squared @ C_present.T).toarray()
+        candidate_norms = k2 * np.asarray(C_squared.sum(axis=1)).T - (k2 - 1) * (S_present @ C_squared.T).toarray()
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = dot / np.sqrt(source_norms * candidate_norms)
+        # 没有可用词的标题（原实现 fit 失败）记为 0
+        return np.nan_to_num(similarity, nan=0.0, posinf=0.0, neginf=0.0)
     
     def _calculate_text_similarity(self, text1: str, text2: str) -> float:
         """计算文本相似度（基于TF-IDF + 余弦相似度）"""
         try:
-            # 分词
-            words1 = ' '.join(jieba.cut(text1))
-            words2 = ' '.join(jieba.cut(text2))
-            
-            # TF-IDF向量化
-            vectorizer = TfidfVectorizer()
-            tfidf = vectorizer.fit_transform([words1, words2])
-            
-            # 余弦相似度
-            similarity = cosine_similarity(tfidf[0:1], tfidf[1:2])[0][0]
-            return float(similarity)
+            return float(self.text_similarities([text1], [text2])[0, 0])
         except Exception as e:
             print(f"文本相似度计算失败: {e}")
             return 0.0
     
     def _calculate_image_similarity(self, url1: str, url2: str) -> float:
         """计算图片相似度（基于感知哈希）"""
+        if not url1 or not url2:
+            return 0.0
+        return self._hash_similarity(self._image_hash(url1), self._image_hash(url2))
+    
+    def _image_hash(self, url: str):
+        """图片的感知哈希（phash）；有图片库时走缓存，无法获取图片时返回 None"""
         try:
-            if not url1 or not url2:
-                return 0.0
+            if not url:
+                return None
+            if self.image_store is not None:
+                hashes = self.image_store.hashes(url)
+                return hashes[0] if hashes is not None else None
             
-            # 下载图片
-            img1 = self._download_image(url1)
-            img2 = self._download_image(url2)
-            
-            if img1 is None or img2 is None:
-                return 0.0
-            
-            # 计算感知哈希
-            hash1 = imagehash.phash(img1)
-            hash2 = imagehash.phash(img2)
-            
-            # 哈希距离（越小越相似）
-            distance = hash1 - hash2
-            
-            # 转换为相似度（0-1）
-            similarity = max(0, 1 - distance / 64)
-            return similarity
+            img = self._download_image(url)
+            if img is None:
+                return None
+            return imagehash.phash(img)
         except Exception as e:
-            print(f"图片相似度计算失败: {e}")
+            print(f"图片哈希计算失败: {e}")
+            return None
+    
+    @staticmethod
+    def _hash_similarity(hash1, hash2) -> float:
+        """哈希距离（越小越相似）转换为相似度（0-1）；任一图片缺失时为 0"""
+        if hash1 is None or hash2 is None:
             return 0.0
+        distance = hash1 - hash2
+        return max(0, 1 - distance / 64)
     
     def _download_image(self, url: str) -> Image.Image:
-        """下载图片"""
+        """下载图片（有图片库时走磁盘缓存）"""
+        if self.image_store is not None:
+            return self.image_store.image(url)
         try:
             response = requests.get(url, timeout=10)
             img = Image.open(BytesIO(response.content))
@@ -132,7 +180,13 @@ class ProductMatcher:
         sift = cv2.SIFT_create()
         kp1, des1 = sift.detectAndCompute(source_cv, None)
         
-        for candidate in candidate_products:
+        # 文本相似度（批量一次算出）
+        text_sims = self.text_similarities(
+            [source_product['title']],
+            [candidate['title'] for candidate in candidate_products]
+        )[0]
+        
+        for candidate, text_sim in zip(candidate_products, text_sims.tolist()):
             candidate_img = self._download_image(candidate.get('image_url'))
             if candidate_img is None:
                 continue
@@ -156,12 +210,6 @@ class ProductMatcher:
             # 计算匹配度
             match_score = len(good_matches) / max(len(kp1), len(kp2))
             
-            # 文本相似度
-            text_sim = self._calculate_text_similarity(
-                source_product['title'],
-                candidate['title']
-            )
-            
             # 综合得分
             total_score = text_sim * 0.6 + match_score * 0.4
             results.append((candidate, total_score))
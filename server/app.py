@@ -9,19 +9,42 @@
 5. 数据导出
 """
 
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, after_this_request
 from flask_cors import CORS
 from functools import wraps
 import inspect
 import hashlib
 import json
 import time
+import zlib
 from datetime import datetime, timedelta
-import sqlite3
 import os
 import ipaddress
 import logging
 
+from auth_cache import AuthCache
+import db
+from request_accounting import RequestAccounting
+from log_writer import LogWriter, utc_timestamp
+from ip_whitelist import IPWhitelist
+from backup import BackupManager
+from auth_token import HEADER as TOKEN_HEADER, TokenRevocations, TokenSigner
+from fanout import FanOut
+from search_cache import SearchCache
+from jobs import JobError, JobManager
+from single_flight import SingleFlight, make_key
+from catalog import Catalog, product_key
+from price_history import PriceHistory
+from warm_matcher import WarmMatcher
+from image_store import ImageStore
+import log_partitions
+import migrations
+import log_rollups
+import pagination
+import price_engine
+import search_index
+import streaming
+
 # 配置日志 - 使用轮转
 import logging.handlers
 log_formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
@@ -46,7 +69,7 @@ app = Flask(__name__)
 CORS(app)
 
 # 配置
-DB_PATH = 'authorization.db'
+DB_PATH = os.environ.get('DB_PATH', 'authorization.db')  # 相对路径按启动目录解析
 SECRET_KEY = 'your-secret-key-change-this'  # 修改为你的密钥
 # 管理员登录口令（可用环境变量 ADMIN_PASSWORD 覆盖）
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
@@ -56,15 +79,50 @@ def get_beijing_time():
     """返回北京时间字符串 (UTC+8)"""
     return (datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')
 
+def local_epoch(value):
+    """服务器本地时间字符串 -> Unix 秒；空值或格式不对返回 None"""
+    if not value:
+        return None
+    try:
+        return int(time.mktime(time.strptime(value.strip()[:19], '%Y-%m-%d %H:%M:%S')))
+    except ValueError:
+        try:
+            return int(time.mktime(time.strptime(value.strip()[:10], '%Y-%m-%d')))
+        except ValueError:
+            return None
+
+def local_time_str(epoch):
+    """Unix 秒 -> 服务器本地时间字符串（与 datetime.now() 写入的格式一致）"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(epoch))
+
 # 用于Flask会话
 app.secret_key = SECRET_KEY
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
+# ==================== 数据库连接 ====================
+
+def get_db():
+    """当前线程复用的数据库连接（WAL + busy_timeout，见 db.py），不要手动关闭"""
+    return db.get_conn(DB_PATH)
+
+def db_transaction():
+    """写事务上下文：with db_transaction() as c: ...（正常退出提交，异常回滚）"""
+    return db.transaction(DB_PATH)
+
+@app.teardown_request
+def release_db(exc=None):
+    """请求结束时回滚未提交的事务，连接留给本线程下一个请求复用"""
+    db.release(DB_PATH)
+
 # ==================== 数据库初始化 ====================
 
 def init_db():
-    """初始化数据库"""
-    conn = sqlite3.connect(DB_PATH)
+    """初始化数据库（独立连接，用完即关，避免 gunicorn --preload 时把连接带进子进程）"""
+    conn = db.connect(DB_PATH)
+    # 新库建表前设置 auto_vacuum=INCREMENTAL；老库的转换需要整库 VACUUM，不能放在每个 worker 的导入路径上
+    if not db.init_auto_vacuum(conn):
+        logger.warning("数据库未启用 auto_vacuum=INCREMENTAL，删除日志分区后不会回收空间；"
+                       "请停服后运行 python tools/enable_incremental_vacuum.py")
     c = conn.cursor()
     
     # 授权表（总开关）
@@ -99,31 +157,12 @@ def init_db():
         )
     ''')
 
-    # 请求日志表（保留）
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS request_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_id TEXT,
-            ip_address TEXT,
-            request_type TEXT,
-            success INTEGER,
-            error_msg TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # 事件埋点表（前端重要操作上报）
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS event_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_id TEXT,
-            hardware_id TEXT,
-            ip_address TEXT,
-            action TEXT,
-            detail_json TEXT,
-            success INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    # 请求日志 / 事件埋点：按天分区表 + 同名视图（见 log_partitions.py）
+    # 日志汇总表（按小时/天，统计页只读汇总表，见 log_rollups.py）
+    # 两者都是“检查后创建”并可能迁移/回填数据，多个 worker 同时启动时放在 BEGIN IMMEDIATE 写事务里串行执行
+    with db.transaction_on(conn) as lc:
+        log_partitions.init_partitions(lc)
+        log_rollups.init_rollups(lc)
     
     # IP 白名单表（一个客户端可配置多个网段/IP）
     c.execute('''
@@ -165,68 +204,275 @@ def init_db():
 
     # 索引
     c.execute('CREATE INDEX IF NOT EXISTS idx_auth_client_id ON authorizations(client_id)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_logs_client_time ON request_logs(client_id, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_auth_created ON authorizations(created_at)')  # 游标分页 (created_at, id)
     c.execute('CREATE INDEX IF NOT EXISTS idx_access_client_hw_ip ON client_access(client_id, hardware_id, ip_address)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_access_trial_expires ON client_access(trial_expires_at)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_event_client_time ON event_logs(client_id, created_at)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_ipwl_client ON ip_whitelist(client_id)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_rules_active ON selection_rules(is_active, updated_at)')
+
+    # 授权令牌吊销表（见 auth_token.py）
+    TokenRevocations.init_table(c)
+
+    # 平台搜索结果缓存（见 search_cache.py）
+    SearchCache.init_table(c)
+
+    # 后台任务及其结果（见 jobs.py）
+    JobManager.init_tables(c)
+
+    # 商品目录：爬取/搜索到的商品及关键词搜索结果（见 catalog.py）
+    Catalog.init_tables(c)
+
+    # 商品价格/销量/排名历史（见 price_history.py）
+    PriceHistory.init_tables(c)
+
+    # 商品图片感知哈希（见 image_store.py）
+    ImageStore.init_table(c)
+
+    # 客户端全文检索索引（FTS5，触发器同步，见 search_index.py）；可能替换旧触发器，放在写事务里
+    with db.transaction_on(conn) as fc:
+        search_index.init_client_index(fc)
     
     conn.commit()
+    # 版本化迁移（PRAGMA user_version，见 migrations.py）
+    migrations.migrate(conn)
     conn.close()
 
 init_db()
 
+# ==================== IP 白名单 ====================
+
+ip_whitelist = IPWhitelist()  # 当前生效的白名单快照（整体替换，读者无需加锁）
+_ip_whitelist_signature = None
+
+def refresh_ip_whitelist(force=False):
+    """白名单表有变化时重新编译并原子替换快照（定时任务 + 管理后台编辑后调用）"""
+    global ip_whitelist, _ip_whitelist_signature
+    conn = db.connect(DB_PATH)
+    try:
+        c = conn.cursor()
+        c.execute('SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(id), 0) FROM ip_whitelist')
+        signature = c.fetchone()
+        if not force and signature == _ip_whitelist_signature:
+            return
+        c.execute('SELECT client_id, ip_cidr FROM ip_whitelist')
+        ip_whitelist = IPWhitelist(c.fetchall())
+        _ip_whitelist_signature = signature
+    finally:
+        conn.close()
+
+refresh_ip_whitelist(force=True)
+
 # ==================== 授权验证装饰器 ====================
 
 TRIAL_SECONDS = 3600  # 后端统一控制：1小时
+# 授权判定缓存有效期（秒），管理后台改动会主动失效；多进程部署时以此为陈旧上限
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 60))
+auth_cache = AuthCache(ttl=AUTH_CACHE_TTL)
+# 请求计数写回周期（秒），即进程异常退出时可能丢失的计数窗口
+ACCOUNTING_FLUSH_SECONDS = int(os.environ.get('ACCOUNTING_FLUSH_SECONDS', 5))
+request_accounting = RequestAccounting(DB_PATH, flush_interval=ACCOUNTING_FLUSH_SECONDS)
+# 请求日志/埋点异步批量写入；队列满时的策略：drop / block / spill（默认溢出到本地文件）
+log_writer = LogWriter(
+    DB_PATH,
+    max_queue=int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+    policy=os.environ.get('LOG_QUEUE_POLICY', 'spill')
+)
+log_writer.start()
+
+# 数据库备份：在线备份 API 分步复制 + zstd/gzip 压缩 + 还原校验，按份数和天数保留
+backup_manager = BackupManager(
+    DB_PATH,
+    backup_dir=os.environ.get('BACKUP_DIR', 'backups'),
+    compression=os.environ.get('BACKUP_COMPRESSION') or None,
+    keep=int(os.environ.get('BACKUP_KEEP', 14)),
+    max_age_days=int(os.environ.get('BACKUP_MAX_AGE_DAYS', 30))
+)
+
+# 授权令牌：require_auth 验签即放行，到期或被吊销才回库判定；多进程部署时吊销最多延迟一个同步周期
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 300))
+token_signer = TokenSigner(os.environ.get('AUTH_TOKEN_SECRET', SECRET_KEY), ttl=AUTH_TOKEN_TTL)
+token_revocations = TokenRevocations(DB_PATH, ttl=AUTH_TOKEN_TTL)
+token_revocations.refresh(force=True)
+
+# 价格对比的跨平台搜索：每个平台的并发上限（进程内所有请求共用）和单次请求的截止时间
+fanout = FanOut({'pinduoduo': int(os.environ.get('PDD_SEARCH_CONCURRENCY', 8))})
+COMPARE_DEADLINE_SECONDS = float(os.environ.get('COMPARE_DEADLINE_SECONDS', 60))
+# 搜索结果缓存：按归一化关键词缓存，进程内 LRU + SQLite（多进程共享）；空结果用较短的 TTL
+search_cache = SearchCache(
+    DB_PATH,
+    ttl=int(os.environ.get('SEARCH_CACHE_TTL', 1800)),
+    negative_ttl=int(os.environ.get('SEARCH_CACHE_NEGATIVE_TTL', 300)),
+    max_entries=int(os.environ.get('SEARCH_CACHE_SIZE', 5000))
+)
+
+# 后台任务：智能选品、抖店爬取等长耗时操作在后台线程池执行，结果保留 JOB_RESULT_TTL 秒供客户端重连取回
+job_manager = JobManager(
+    DB_PATH,
+    workers=int(os.environ.get('JOB_WORKERS', 2)),
+    ttl=int(os.environ.get('JOB_RESULT_TTL', 86400)),
+    max_active_per_client=int(os.environ.get('JOB_MAX_ACTIVE_PER_CLIENT', 3))
+)
+
+# 相同参数的并发智能选品/抖店爬取只执行一次，完成后结果再保留 SINGLE_FLIGHT_GRACE 秒（见 single_flight.py）
+single_flight = SingleFlight(grace=float(os.environ.get('SINGLE_FLIGHT_GRACE', 10)))
+
+# 商品目录：关键词 CATALOG_FRESH 秒内搜索过就直接用本地商品，商品保留 CATALOG_RETENTION_DAYS 天（见 catalog.py）
+catalog = Catalog(
+    DB_PATH,
+    fresh=int(os.environ.get('CATALOG_FRESH', 21600)),
+    retention=int(os.environ.get('CATALOG_RETENTION_DAYS', 30)) * 86400,
+    min_candidates=int(os.environ.get('CATALOG_MIN_CANDIDATES', 5))  # 没搜过的关键词目录候选够这么多就不实时搜索，0 关闭
+)
+
+# 每次爬取追加价格/销量/排名采样点，用于计算 1/7/30 天增长率（见 price_history.py）
+price_history = PriceHistory(DB_PATH, retention_months=int(os.environ.get('PRICE_HISTORY_MONTHS', 13)))
+
+# 商品图片磁盘缓存（按 URL 哈希，超过 IMAGE_CACHE_MB 按 LRU 淘汰）+ 感知哈希表（见 image_store.py）
+# 下载失败的链接 IMAGE_FAILURE_TTL 秒内不重试，哈希记录保留 IMAGE_HASH_RETENTION_DAYS 天
+image_store = ImageStore(
+    DB_PATH,
+    directory=os.environ.get('IMAGE_CACHE_DIR', 'cache/images'),
+    max_bytes=int(os.environ.get('IMAGE_CACHE_MB', 1024)) * 1024 * 1024,
+    failure_ttl=float(os.environ.get('IMAGE_FAILURE_TTL', 300)),
+    retention_days=int(os.environ.get('IMAGE_HASH_RETENTION_DAYS', 90))
+)
+
+# 进程内共享的商品匹配器（jieba 词典缓存 + 电商自定义词典，见 warm_matcher.py）
+# gunicorn worker 启动后由 gunicorn.conf.py 的钩子后台预热；import app 本身不预热
+warm_matcher = WarmMatcher(
+    cache_file=os.environ.get('JIEBA_CACHE', 'cache/jieba.cache'),
+    user_dict=os.environ.get('JIEBA_USER_DICT', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             'dicts', 'ecommerce_userdict.txt')),
+    image_store=image_store
+)
+MATCHER_WARMUP_TIMEOUT = float(os.environ.get('MATCHER_WARMUP_TIMEOUT', 60))
+
+# authorizations 列顺序（与原 SELECT * 一致，模板和业务代码按下标取值）
+AUTH_COLUMNS = ('id', 'client_id', 'client_name', 'ip_address', 'hardware_id', 'is_active',
+                'created_at', 'expires_at', 'request_count', 'last_request_at')
+# 授权判定额外取整数到期时间（追加在末尾，不影响原有下标）
+AUTH_SELECT = ', '.join(AUTH_COLUMNS + ('expires_epoch',))
+AUTH_EXPIRES_EPOCH = len(AUTH_COLUMNS)
 
 def _grant_or_validate_trial(c, client_id: str, hardware_id: str, ip_address: str):
     """授予或校验试用资格：同一hardware每天仅发一次。返回(authorized, trial_remaining_seconds, reason)。"""
-    now = datetime.now()
-    today = now.strftime('%Y-%m-%d')
+    now = int(time.time())
+    today = time.strftime('%Y-%m-%d', time.localtime(now))
 
     # 查询指纹记录
-    c.execute('''SELECT id, trial_started_at, trial_expires_at, last_trial_granted_at, approved
+    c.execute('''SELECT id, trial_expires_epoch, last_trial_granted_at, approved
                  FROM client_access WHERE client_id=? AND hardware_id=? AND ip_address=? LIMIT 1''',
               (client_id, hardware_id, ip_address))
     row = c.fetchone()
 
     # 已显式批准
-    if row and row[4] == 1:
+    if row and row[3] == 1:
         return True, None, None
 
     # 试用有效
-    if row and row[2]:
-        try:
-            exp = datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S')
-            if now < exp:
-                return True, int((exp - now).total_seconds()), None
-        except Exception:
-            pass
+    if row and row[1] and now < row[1]:
+        return True, row[1] - now, None
 
     # 是否当天已发放
-    if row and row[3] == today:
+    if row and row[2] == today:
         return False, 0, 'daily_quota_exhausted'
 
     # 发放试用
-    start = now
-    exp = now + timedelta(seconds=TRIAL_SECONDS)
+    exp = now + TRIAL_SECONDS
     if row:
-        c.execute('''UPDATE client_access SET trial_started_at=?, trial_expires_at=?, last_seen_at=?, last_trial_granted_at=?
+        c.execute('''UPDATE client_access SET trial_started_at=?, trial_expires_at=?, trial_expires_epoch=?, last_seen_at=?, last_trial_granted_at=?
                      WHERE id=?''',
-                  (start.strftime('%Y-%m-%d %H:%M:%S'), exp.strftime('%Y-%m-%d %H:%M:%S'),
-                   get_beijing_time(), today, row[0]))
+                  (local_time_str(now), local_time_str(exp), exp, get_beijing_time(), today, row[0]))
     else:
-        c.execute('''INSERT INTO client_access (client_id, hardware_id, ip_address, trial_started_at, trial_expires_at, last_trial_granted_at)
-                     VALUES (?,?,?,?,?,?)''',
-                  (client_id, hardware_id, ip_address, start.strftime('%Y-%m-%d %H:%M:%S'),
-                   exp.strftime('%Y-%m-%d %H:%M:%S'), today))
+        c.execute('''INSERT INTO client_access (client_id, hardware_id, ip_address, trial_started_at, trial_expires_at, trial_expires_epoch, last_trial_granted_at)
+                     VALUES (?,?,?,?,?,?,?)''',
+                  (client_id, hardware_id, ip_address, local_time_str(now), local_time_str(exp), exp, today))
     return True, TRIAL_SECONDS, None
 
 
+def _resolve_auth(c, client_id: str, hardware_id: str, ip_address: str):
+    """查库解析授权判定（供 require_auth 缓存）。返回 (decision, cacheable)。到期时间均为 Unix 秒。"""
+    now = int(time.time())
+
+    # 放开IP校验，优先按client_id / hardware_id识别（你要求先用机器码识别）
+    auth = None
+    if client_id:
+        c.execute(f'SELECT {AUTH_SELECT} FROM authorizations WHERE client_id = ? LIMIT 1', (client_id,))
+        auth = c.fetchone()
+    if not auth and hardware_id:
+        c.execute(f'SELECT {AUTH_SELECT} FROM authorizations WHERE hardware_id = ? LIMIT 1', (hardware_id,))
+        auth = c.fetchone()
+    # 最后兜底：若仍未匹配，再按IP已批准记录尝试一次（兼容老客户）
+    if not auth:
+        c.execute(f'SELECT {AUTH_SELECT} FROM authorizations WHERE ip_address = ? AND is_active = 1 LIMIT 1', (ip_address,))
+        auth = c.fetchone()
+
+    decision = {
+        'auth': auth,
+        'auth_id': auth[0] if auth else None,
+        'rule': None,
+        'trial_expires_at': None,
+        'expires_at': None,
+        'reason': None
+    }
+
+    if not auth:
+        # 首次出现client_id也给予试用（按 hardware 限日）
+        authorized, left, reason = _grant_or_validate_trial(c, client_id or 'UNKNOWN', hardware_id or 'UNKNOWN', ip_address)
+        if not authorized:
+            decision['reason'] = reason or 'not_found'
+            return decision, False
+        if left is not None:
+            decision['trial_expires_at'] = now + left
+        return decision, True
+
+    # 已拒绝
+    is_active = auth[5]
+    if is_active == -1:
+        decision['reason'] = 'rejected'
+        return decision, True
+
+    # 已批准：直接放行；未批准（待审核）：进入试用逻辑
+    if is_active != 1:
+        authorized, left, reason = _grant_or_validate_trial(c, client_id, hardware_id, ip_address)
+        if not authorized:
+            decision['reason'] = reason or 'trial_expired'
+            return decision, False
+        if left is not None:
+            decision['trial_expires_at'] = now + left
+
+    # 过期时间（如配置）
+    decision['expires_at'] = auth[AUTH_EXPIRES_EPOCH]
+
+    # 若绑定规则，读取规则（预留：可用于限流/策略）
+    c.execute('SELECT rule_id FROM client_settings WHERE client_id=?', (client_id,))
+    row = c.fetchone()
+    if row and row[0]:
+        c.execute('SELECT * FROM selection_rules WHERE id=? AND is_active=1', (row[0],))
+        decision['rule'] = c.fetchone()  # 当前未强制校验，仅用于业务策略
+
+    return decision, True
+
+
+def _token_auth_row(client_id, hardware_id, auth_client_id):
+    """
+    令牌路径上传给处理函数的授权记录，与查库路径的 auth 相同（AUTH_SELECT 列，试用客户端为 None）
+    先取授权判定缓存里的记录，未命中时按令牌中的授权 client_id（claims['a']）查库
+    """
+    if not auth_client_id:
+        return None
+    decision = auth_cache.get(client_id, hardware_id)
+    if decision is not None and decision['auth'] and decision['auth'][1] == auth_client_id:
+        return decision['auth']
+    c = get_db().cursor()
+    c.execute(f'SELECT {AUTH_SELECT} FROM authorizations WHERE client_id = ? LIMIT 1', (auth_client_id,))
+    return c.fetchone()
+
+
 def require_auth(f):
     """授权验证装饰器（后端唯一判定：批准/试用/拒绝，并可指示前端弹窗）"""
+    # 传递 auth 参数给被装饰的函数（兼容老签名）
+    wants_auth = 'auth' in inspect.signature(f).parameters
+
     @wraps(f)
     def decorated_function(*args, **kwargs):
         # 获取客户端信息
@@ -241,115 +487,100 @@ def require_auth(f):
                 'error': '功能升级中，请联系QQ: 123456789'
             }), 401
         
-        # 验证授权（后端唯一判定）
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.row_factory = None
-        
-        # 放开IP校验，优先按client_id / hardware_id识别（你要求先用机器码识别）
-        auth = None
-        if client_id:
-            c.execute('SELECT * FROM authorizations WHERE client_id = ? LIMIT 1', (client_id,))
-            auth = c.fetchone()
-        if not auth and hardware_id:
-            c.execute('SELECT * FROM authorizations WHERE hardware_id = ? LIMIT 1', (hardware_id,))
-            auth = c.fetchone()
-        # 最后兜底：若仍未匹配，再按IP已批准记录尝试一次（兼容老客户）
-        if not auth:
-            c.execute('SELECT * FROM authorizations WHERE ip_address = ? AND is_active = 1 LIMIT 1', (ip_address,))
-        auth = c.fetchone()
-        
-        if not auth:
-            # 首次出现client_id也给予试用（按 hardware 限日）
-            authorized, left, reason = _grant_or_validate_trial(c, client_id or 'UNKNOWN', hardware_id or 'UNKNOWN', ip_address)
-            conn.commit()
-            conn.close()
-            if authorized:
-                # 允许通过（试用）
-                response = f(auth, *args, **kwargs)
-                return response
-            # 拒绝并指示前端弹窗
-            return jsonify({'success': False, 'show_popup': True, 'reason': reason or 'not_found'}), 403
-        
-        # 检查状态
-        is_active = auth[5]
-        
-        # 已拒绝
-        if is_active == -1:
-            conn.close()
-            return jsonify({'success': False, 'show_popup': True, 'reason': 'rejected'}), 403
-        
-        # 待审核（is_active=0）和已批准（is_active=1）都允许通过
-        # 试用期由客户端自己控制
-        
-        # 已批准：直接放行；未批准：进入试用逻辑
-        if is_active != 1:
-            authorized, left, reason = _grant_or_validate_trial(c, client_id, hardware_id, ip_address)
+        now = int(time.time())
+
+        # 带有效令牌：验签即放行，不查缓存、不查库
+        token = request.headers.get(TOKEN_HEADER)
+        claims = token_signer.verify(token, client_id, hardware_id, now) if token else None
+        if claims is not None and not token_revocations.is_revoked(claims):
+            if not ip_whitelist.allows(claims['a'] or client_id, ip_address):
+                return jsonify({'success': False, 'show_popup': True, 'reason': 'ip_not_allowed'}), 403
+            if claims['a']:
+                request_accounting.record(client_id, ip_address, get_beijing_time(), now)
+            if wants_auth:
+                return f(_token_auth_row(client_id, hardware_id, claims['a']), *args, **kwargs)
+            return f(*args, **kwargs)
+
+        # 验证授权（后端唯一判定）；先查缓存，试用到期的缓存条目视为未命中
+        decision = auth_cache.get(client_id, hardware_id)
+        if decision is not None and decision['trial_expires_at'] and now >= decision['trial_expires_at']:
+            decision = None
+
+        if decision is None:
+            conn = get_db()
+            decision, cacheable = _resolve_auth(conn.cursor(), client_id, hardware_id, ip_address)
             conn.commit()
-            if not authorized:
-                conn.close()
-                return jsonify({'success': False, 'show_popup': True, 'reason': reason or 'trial_expired'}), 403
-        
-        # 过期时间（如配置）
-        expires_at = auth[7]
-        if expires_at:
-            try:
-                expire_time = datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S')
-                if datetime.now() > expire_time:
-                    conn.close()
-                    return jsonify({'success': False, 'show_popup': True, 'reason': 'auth_expired'}), 403
-            except Exception:
-                pass
-        
-        # 若绑定规则，读取规则（预留：可用于限流/策略）
-        c.execute('SELECT rule_id FROM client_settings WHERE client_id=?', (client_id,))
-        row = c.fetchone()
-        if row and row[0]:
-            c.execute('SELECT * FROM selection_rules WHERE id=? AND is_active=1', (row[0],))
-            active_rule = c.fetchone()  # 当前未强制校验，仅用于业务策略
+            if cacheable:
+                auth_cache.put(client_id, hardware_id, decision)
 
-        # 更新请求统计（使用北京时间）；不强制覆盖管理员清空的IP
-        # 只在首次为空时写入IP，避免管理员清空后被自动回填
-        c.execute('''
-            UPDATE authorizations 
-            SET request_count = request_count + 1,
-                last_request_at = ?,
-                ip_address = CASE WHEN (ip_address IS NULL OR ip_address = '') THEN ? ELSE ip_address END
-            WHERE client_id = ?
-        ''', (get_beijing_time(), ip_address, client_id))
-        
-        conn.commit()
-        conn.close()
+        reason = decision['reason']
+        if not reason and decision['expires_at'] and now > decision['expires_at']:
+            reason = 'auth_expired'
+        if reason:
+            # 拒绝并指示前端弹窗
+            return jsonify({'success': False, 'show_popup': True, 'reason': reason}), 403
+
+        auth = decision['auth']
+
+        # IP 白名单（仅对配置了白名单的客户端生效）
+        if not ip_whitelist.allows(auth[1] if auth else client_id, ip_address):
+            return jsonify({'success': False, 'show_popup': True, 'reason': 'ip_not_allowed'}), 403
+
+        if auth:
+            # 更新请求统计（显示用北京时间 + 整数时间戳），由 request_accounting 定时批量写回
+            request_accounting.record(client_id, ip_address, get_beijing_time(), now)
+
+        # 签发新令牌，客户端从响应头取用
+        issued = token_signer.issue(client_id, hardware_id, auth[1] if auth else None,
+                                    'approved' if auth and auth[5] == 1 else 'trial', now,
+                                    decision['trial_expires_at'], decision['expires_at'])
+        if issued:
+            @after_this_request
+            def attach_token(response):
+                response.headers[TOKEN_HEADER] = issued[0]
+                return response
         
-        # 传递 auth 参数给被装饰的函数（兼容老签名）
-        sig = inspect.signature(f)
-        if 'auth' in sig.parameters:
+        if wants_auth:
             return f(auth, *args, **kwargs)
-        else:
-            return f(*args, **kwargs)
+        return f(*args, **kwargs)
     
     return decorated_function
 
+def _active_trial_expiry(c, client_id, now):
+    """客户端仍有效的最晚试用到期时间：(client_id, trial_expires_epoch) 索引上的范围查询"""
+    c.execute('''SELECT MAX(trial_expires_epoch) FROM client_access
+                 WHERE client_id=? AND trial_expires_epoch > ?''', (client_id, now))
+    row = c.fetchone()
+    return row[0] if row else None
+
+def _token_fields(client_id, hardware_id, is_active, now, trial_expires, expires_epoch):
+    """/api/register、/api/check-auth 返回的令牌字段（未授权或缺少硬件ID时为空）"""
+    issued = None
+    if hardware_id and (is_active == 1 or trial_expires):
+        if is_active == 1:
+            issued = token_signer.issue(client_id, hardware_id, client_id, 'approved', now, expires_epoch)
+        else:
+            issued = token_signer.issue(client_id, hardware_id, client_id, 'trial', now, trial_expires, expires_epoch)
+    return {
+        'token': issued[0] if issued else None,
+        'token_expires_at': issued[1] if issued else None
+    }
+
 # ==================== 管理后台鉴权 ====================
 
 def admin_required(f):
     @wraps(f)
     def wrapped(*args, **kwargs):
         if not session.get('is_admin'):
+            if request.path.startswith('/admin/api/'):
+                return jsonify({'success': False, 'error': '未登录'}), 401
             return redirect(url_for('admin_login', next=request.path))
         return f(*args, **kwargs)
     return wrapped
 
 def log_request(client_id, ip_address, request_type, success, error_msg=None):
-    """记录请求日志"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO request_logs (client_id, ip_address, request_type, success, error_msg)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (client_id, ip_address, request_type, 1 if success else 0, error_msg))
-    conn.commit()
-    conn.close()
+    """记录请求日志（入队后由 log_writer 批量写入）"""
+    log_writer.submit('request_logs', (client_id, ip_address, request_type, 1 if success else 0, error_msg, utc_timestamp()))
 
 
 @app.route('/api/event', methods=['POST'])
@@ -363,14 +594,72 @@ def track_event():
     detail_json = json.dumps(data.get('detail') or {}, ensure_ascii=False)
     success = 1 if data.get('success', True) else 0
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''INSERT INTO event_logs (client_id, hardware_id, ip_address, action, detail_json, success)
-                 VALUES (?,?,?,?,?,?)''', (client_id, hardware_id, ip_address, action, detail_json, success))
-    conn.commit()
-    conn.close()
+    log_writer.submit('event_logs', (client_id, hardware_id, ip_address, action, detail_json, success, utc_timestamp()))
     return jsonify({'success': True})
 
+
+EVENT_BATCH_MAX = 1000                      # 单次批量上报的最大事件数
+EVENT_BATCH_MAX_BYTES = 2 * 1024 * 1024     # 解压后请求体上限，防止压缩炸弹
+EVENT_MAX_AGE_SECONDS = 7 * 86400           # 客户端时间戳可回溯的最长时间
+
+def _gunzip_limited(raw: bytes, limit: int) -> bytes:
+    """解压 gzip 请求体，超过 limit 字节时抛出 ValueError"""
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = d.decompress(raw, limit + 1)
+    if len(out) > limit or d.unconsumed_tail:
+        raise ValueError('payload too large')
+    return out
+
+
+@app.route('/api/events/batch', methods=['POST'])
+def track_events_batch():
+    """
+    前端埋点批量上报（客户端本地缓冲后按量/按时发送）
+    请求体：{"events": [{"action": "", "detail": {}, "success": true, "ts": 1700000000}, ...]}
+    支持 Content-Encoding: gzip；同一批事件在一个事务内写入
+    """
+    client_id = request.headers.get('X-Client-ID')
+    hardware_id = request.headers.get('X-Hardware-ID')
+    ip_address = request.remote_addr
+
+    raw = request.get_data(cache=False)
+    try:
+        if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+            raw = _gunzip_limited(raw, EVENT_BATCH_MAX_BYTES)
+        elif len(raw) > EVENT_BATCH_MAX_BYTES:
+            raise ValueError('payload too large')
+        data = json.loads(raw or b'{}')
+    except (ValueError, zlib.error) as e:
+        return jsonify({'success': False, 'error': f'请求体无效: {e}'}), 400
+
+    events = data.get('events') if isinstance(data, dict) else data
+    if not isinstance(events, list):
+        return jsonify({'success': False, 'error': '缺少events数组'}), 400
+    if len(events) > EVENT_BATCH_MAX:
+        return jsonify({'success': False, 'error': f'单次最多上报{EVENT_BATCH_MAX}条事件'}), 413
+
+    now = time.time()
+    rows = []
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        ts = event.get('ts')
+        if isinstance(ts, (int, float)) and now - EVENT_MAX_AGE_SECONDS <= ts <= now + 60:
+            created_at = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            created_at = utc_timestamp()
+        rows.append((
+            client_id, hardware_id, ip_address,
+            event.get('action') or 'unknown',
+            json.dumps(event.get('detail') or {}, ensure_ascii=False),
+            1 if event.get('success', True) else 0,
+            created_at
+        ))
+
+    if not log_writer.write_now('event_logs', rows):
+        return jsonify({'success': False, 'error': '事件写入失败'}), 503
+    return jsonify({'success': True, 'accepted': len(rows)})
+
 # ==================== API 接口 ====================
 
 @app.route('/api/health', methods=['GET'])
@@ -382,15 +671,21 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """就绪探针：本 worker 的商品匹配器预热完成返回 200，否则 503（预热失败时会重试）"""
+    warm_matcher.start()
+    status = warm_matcher.stats()
+    return jsonify(dict(status, success=status['ready'])), 200 if status['ready'] else 503
+
 @app.route('/api/rules/active', methods=['GET'])
 @require_auth
 def api_active_rules():
     """返回启用中的选品规则列表（客户端可读取）"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     c.execute('SELECT id, name, price_diff_threshold, prefer_platform, time_window_days, min_exposure, min_clicks, min_growth_percent, allow_official FROM selection_rules WHERE is_active=1 ORDER BY updated_at DESC')
     rows = c.fetchall()
-    conn.close()
     rules = []
     for r in rows:
         rules.append({
@@ -420,11 +715,11 @@ def register_client():
         }), 400
     
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
         # 检查是否已注册
-        c.execute('SELECT * FROM authorizations WHERE hardware_id=?', (hardware_id,))
+        c.execute(f'SELECT {AUTH_SELECT} FROM authorizations WHERE hardware_id=?', (hardware_id,))
         existing = c.fetchone()
         
         if existing:
@@ -432,19 +727,21 @@ def register_client():
             client_id = existing[1]
             is_active = existing[5]
             expires_at = existing[7]
+            now = int(time.time())
+            trial_expires = _active_trial_expiry(c, client_id, now) if is_active == 0 else None
             
             # 更新最后请求时间和IP
             c.execute('UPDATE authorizations SET ip_address=? WHERE hardware_id=?', 
                      (ip_address, hardware_id))
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'client_id': client_id,
+            conn.commit()
+            
+            return jsonify({
+                'success': True,
+                'client_id': client_id,
                 'is_active': is_active,
-            'expires_at': expires_at,
-                'message': '已找到现有授权' if is_active == 1 else '等待管理员审核'
+                'expires_at': expires_at,
+                'message': '已找到现有授权' if is_active == 1 else '等待管理员审核',
+                **_token_fields(client_id, hardware_id, is_active, now, trial_expires, existing[AUTH_EXPIRES_EPOCH])
             })
         
         # 新注册：生成客户端ID
@@ -457,14 +754,16 @@ def register_client():
             VALUES (?, ?, ?, ?, 0)
         ''', (client_id, client_name, ip_address, hardware_id))
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True,
             'client_id': client_id,
             'is_active': 0,
             'expires_at': None,
-            'message': '注册成功，等待管理员审核（可试用1小时）'
+            'message': '注册成功，等待管理员审核（可试用1小时）',
+            # 试用在首次调用业务接口时发放，令牌随该响应头下发
+            'token': None,
+            'token_expires_at': None
         })
     except Exception as e:
         return jsonify({
@@ -479,6 +778,8 @@ def compare_prices():
     价格对比核心功能
     输入：淘宝商品数据
     输出：拼多多低价商品列表
+    
+    ?stream=ndjson|sse 或 Accept: application/x-ndjson / text/event-stream 时流式返回（见 streaming.py）
     """
     client_id = request.headers.get('X-Client-ID')
     ip_address = request.remote_addr
@@ -490,12 +791,20 @@ def compare_prices():
         
         log_request(client_id, ip_address, 'COMPARE_PRICES', True)
         
+        fmt = streaming.negotiate(request)
+        if fmt:
+            # 流式：按商品输入顺序，每个商品搜索完成即下发其匹配结果，最后一条为汇总
+            return streaming.stream(fmt, iter_price_comparison(taobao_products, discount_threshold))
+        
         # 调用价格对比逻辑
-        results = process_price_comparison(taobao_products, discount_threshold)
+        results, errors = process_price_comparison(taobao_products, discount_threshold)
         
         return jsonify({
             'success': True,
             'data': results,
+            # 搜索失败/超时的商品（index 为其在 products 中的位置），其余商品的结果照常返回
+            'errors': errors,
+            'partial': bool(errors),
             'timestamp': datetime.now().isoformat()
         })
     
@@ -601,45 +910,102 @@ def scrape_pinduoduo_products(keyword, max_count):
         }
     ]
 
-def process_price_comparison(taobao_products, discount_threshold):
+def _search_pinduoduo_cached(namespace, keyword, loader, limit=20):
+    """拼多多搜索：搜索缓存 -> 商品目录（关键词结果 / 最多 limit 个候选商品）-> loader 实时搜索（结果写入目录和价格历史）"""
+    def live(kw):
+        products = loader(kw)
+        price_history.record('pinduoduo', products or [])
+        return products
+    return search_cache.fetch(namespace, keyword,
+                              lambda kw: catalog.fetch('pinduoduo', kw, live, namespace=namespace, limit=limit))
+
+
+def _record_scrape(platform, products):
+    """爬取到的商品写入商品目录并追加历史采样点"""
+    catalog.ingest(platform, products)
+    price_history.record(platform, products)
+
+
+def _pinduoduo_candidates(taobao_products, deadline=None):
+    """
+    按输入顺序逐个产出 (下标, 淘宝商品, 拼多多搜索结果 TaskResult)
+    各商品的搜索并发执行（受 PDD_SEARCH_CONCURRENCY 限制），最多等待 deadline 秒（默认 COMPARE_DEADLINE_SECONDS）；
+    使用商品标题前20字搜索，归一化后相同的关键词只搜一次，并优先走搜索缓存和商品目录
+    """
+    keys, unique = search_cache.dedupe(tb_product.get('title', '')[:20] for tb_product in taobao_products)
+    unique_keys = list(unique)
+    searches = fanout.imap(
+        'pinduoduo',
+        lambda keyword: _search_pinduoduo_cached('pinduoduo:10', keyword, lambda kw: scrape_pinduoduo_products(kw, 10), limit=10),
+        list(unique.values()),
+        timeout=COMPARE_DEADLINE_SECONDS if deadline is None else deadline
+    )
+    done = {}
+    try:
+        for index, (tb_product, key) in enumerate(zip(taobao_products, keys)):
+            # 关键词第一次出现的位置不晚于当前商品，按顺序取到它为止即可
+            while key not in done:
+                search = next(searches)
+                done[unique_keys[search.index]] = search
+            yield index, tb_product, done[key]
+    finally:
+        searches.close()  # 提前结束（如流式响应的客户端断开）时取消尚未开始的搜索
+
+
+def _search_error(index, tb_product, search):
+    return {
+        'index': index,
+        'title': tb_product.get('title', ''),
+        'error': search.error
+    }
+
+
+def process_price_comparison(taobao_products, discount_threshold, deadline=None):
     """
     价格对比核心算法
     输入：淘宝商品列表
-    输出：拼多多低价商品列表
+    输出：(拼多多低价商品列表, 搜索失败的商品列表)
+    结果顺序只取决于输入：按折扣率降序，折扣相同时保持输入顺序
     """
-    results = []
-    
-    for tb_product in taobao_products:
-        keyword = tb_product.get('title', '')[:20]  # 使用商品标题前20字搜索
-        
-        # 在拼多多搜索相同商品
-        pdd_products = scrape_pinduoduo_products(keyword, 10)
-        
-        # 对比价格
-        tb_price = float(tb_product.get('price', 0))
-        
-        for pdd_product in pdd_products:
-            pdd_price = float(pdd_product.get('price', 0))
-            
-            # 计算折扣
-            if tb_price > 0:
-                discount = (tb_price - pdd_price) / tb_price
-                
-                # 如果折扣超过阈值
-                if discount >= discount_threshold:
-                    results.append({
-                        'taobao_product': tb_product,
-                        'pinduoduo_product': pdd_product,
-                        'discount_rate': f"{discount * 100:.1f}%",
-                        'price_diff': tb_price - pdd_price,
-                        'taobao_price': tb_price,
-                        'pinduoduo_price': pdd_price
-                    })
+    errors = []
+    candidate_lists = []
+    for index, tb_product, search in _pinduoduo_candidates(taobao_products, deadline):
+        if search.error:
+            errors.append(_search_error(index, tb_product, search))
+        candidate_lists.append(search.value or [])
     
-    # 按折扣率排序
-    results.sort(key=lambda x: float(x['discount_rate'].rstrip('%')), reverse=True)
+    # 折扣矩阵 + 阈值掩码一次算出，按数值折扣降序（稳定排序，折扣相同时保持输入顺序）
+    results = price_engine.compare(taobao_products, candidate_lists, discount_threshold)
     
-    return results
+    return results, errors
+
+
+def iter_price_comparison(taobao_products, discount_threshold, deadline=None):
+    """
+    价格对比的流式版本：产出 (记录类型, 数据)
+    每个商品的搜索一完成就产出它的匹配结果（商品内按折扣率降序，带 index），
+    搜索失败的商品产出 error 记录，最后产出 summary
+    """
+    started = time.perf_counter()
+    total = 0
+    errors = 0
+    for index, tb_product, search in _pinduoduo_candidates(taobao_products, deadline):
+        if search.error:
+            errors += 1
+            yield 'error', _search_error(index, tb_product, search)
+            continue
+        for match in price_engine.compare([tb_product], [search.value], discount_threshold):
+            total += 1
+            yield 'result', dict(match, index=index)
+    yield 'summary', {
+        'success': True,
+        'total': total,
+        'products': len(taobao_products),
+        'errors': errors,
+        'partial': bool(errors),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'timestamp': datetime.now().isoformat()
+    }
 
 # ==================== 管理员接口 ====================
 
@@ -654,11 +1020,17 @@ def list_clients():
             'error': '管理员密钥错误'
         }), 403
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT * FROM authorizations ORDER BY created_at DESC')
-    clients = c.fetchall()
-    conn.close()
+    next_cursor = None
+    if request.args.get('limit') or request.args.get('cursor'):
+        # 游标分页：?limit=N&cursor=上一页返回的 next_cursor
+        clients, next_cursor = pagination.keyset_page(
+            c, 'authorizations', AUTH_COLUMNS, cursor=request.args.get('cursor'),
+            limit=pagination.clamp_limit(request.args.get('limit')))
+    else:
+        c.execute(f"SELECT {', '.join(AUTH_COLUMNS)} FROM authorizations ORDER BY created_at DESC, id DESC")
+        clients = c.fetchall()
     
     clients_list = []
     for client in clients:
@@ -678,7 +1050,8 @@ def list_clients():
     return jsonify({
         'success': True,
         'data': clients_list,
-        'count': len(clients_list)
+        'count': len(clients_list),
+        'next_cursor': next_cursor
     })
 
 @app.route('/api/admin/toggle-client', methods=['POST'])
@@ -695,18 +1068,88 @@ def toggle_client():
     client_id = request.json.get('client_id')
     is_active = request.json.get('is_active', 1)
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('UPDATE authorizations SET is_active = ? WHERE client_id = ?', 
-              (is_active, client_id))
-    conn.commit()
-    conn.close()
+    with db_transaction() as c:
+        c.execute('UPDATE authorizations SET is_active = ? WHERE client_id = ? RETURNING id', 
+                  (is_active, client_id))
+        row = c.fetchone()
+        token_revocations.revoke(c, client_id)
+    # 按 hardware_id / IP 兜底识别出的缓存条目键里不是这个 client_id，按授权行ID一并失效
+    auth_cache.invalidate(client_id=client_id, auth_id=row[0] if row else None)
     
     return jsonify({
         'success': True,
         'message': f'客户端已{"启用" if is_active else "禁用"}'
     })
 
+@app.route('/api/admin/metrics', methods=['GET'])
+def admin_metrics():
+    """运行指标（缓存命中率等）"""
+    admin_key = request.args.get('admin_key')
+    
+    if admin_key != SECRET_KEY:
+        return jsonify({
+            'success': False,
+            'error': '管理员密钥错误'
+        }), 403
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'auth_cache': auth_cache.stats(),
+            'request_accounting': request_accounting.stats(),
+            'log_writer': log_writer.stats(),
+            'ip_whitelist': ip_whitelist.stats(),
+            'backup': backup_manager.stats(),
+            'fanout': fanout.stats(),
+            'search_cache': search_cache.stats(),
+            'jobs': job_manager.stats(),
+            'single_flight': single_flight.stats(),
+            'catalog': catalog.stats(),
+            'price_history': price_history.stats(),
+            'matcher': warm_matcher.stats(),
+            'image_store': image_store.stats(),
+            'auth_token': dict(token_signer.stats(), **token_revocations.stats())
+        }
+    })
+
+@app.route('/api/admin/stats', methods=['GET'])
+def admin_stats_api():
+    """
+    请求/事件统计（只读汇总表）
+    参数：kind=requests|events, granularity=hour|day, periods=最近N小时/天（默认48/30）,
+         since/until=时间桶范围（优先于 periods）, client_id, type, group_by=bucket,client_id,type
+    """
+    admin_key = request.args.get('admin_key')
+    
+    if admin_key != SECRET_KEY:
+        return jsonify({
+            'success': False,
+            'error': '管理员密钥错误'
+        }), 403
+    
+    kind = request.args.get('kind', 'requests')
+    granularity = request.args.get('granularity', 'day')
+    if kind not in log_rollups.KINDS or granularity not in log_rollups.GRANULARITIES:
+        return jsonify({'success': False, 'error': 'kind 或 granularity 无效'}), 400
+    try:
+        periods = min(max(int(request.args.get('periods', 48 if granularity == 'hour' else 30)), 1), 10000)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'periods 无效'}), 400
+    group_by = [g for g in request.args.get('group_by', 'bucket').split(',') if g]
+    
+    rows = log_rollups.query(
+        get_db().cursor(), kind, granularity,
+        since=request.args.get('since') or log_rollups.since_for(granularity, periods),
+        until=request.args.get('until') or None,
+        client_id=request.args.get('client_id') or None,
+        dim_value=request.args.get('type') or None,
+        group_by=group_by
+    )
+    return jsonify({
+        'success': True,
+        'data': rows
+    })
+
 # ==================== 管理后台页面 ====================
 
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -729,22 +1172,40 @@ def admin_logout():
 def admin_home():
     return redirect(url_for('admin_clients_page'))
 
+def _page_response(columns, rows, next_cursor, partial, name):
+    """分页接口统一返回：数据、下一页游标、渲染好的表格行（页面直接追加）"""
+    return jsonify({
+        'success': True,
+        'data': [dict(zip(columns, row)) for row in rows],
+        'next_cursor': next_cursor,
+        'html': render_template(partial, **{name: rows})
+    })
+
+def _client_page(q, cursor=None, limit=pagination.DEFAULT_LIMIT):
+    """客户端列表一页：有检索词时走 FTS5 索引按相关度排序，否则按创建时间倒序"""
+    c = get_db().cursor()
+    match, likes, params = search_index.compile_filters([(search_index.FTS_COLUMNS['authorizations'], q)])
+    where = ' AND '.join(likes)
+    if match:
+        return pagination.ranked_page(c, 'authorizations', AUTH_COLUMNS, search_index.CLIENT_FTS, match,
+                                      where, params, cursor=cursor, limit=limit)
+    return pagination.keyset_page(c, 'authorizations', AUTH_COLUMNS, where, params, cursor=cursor, limit=limit)
+
 @app.route('/admin/clients')
 @admin_required
 def admin_clients_page():
     q = request.args.get('q', '').strip()
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if q:
-        like = f"%{q}%"
-        c.execute('''SELECT * FROM authorizations 
-                     WHERE client_name LIKE ? OR client_id LIKE ? OR ip_address LIKE ?
-                     ORDER BY created_at DESC''', (like, like, like))
-    else:
-        c.execute('SELECT * FROM authorizations ORDER BY created_at DESC')
-    clients = c.fetchall()
-    conn.close()
-    return render_template('clients.html', clients=clients, q=q)
+    clients, next_cursor = _client_page(q)
+    return render_template('clients.html', clients=clients, q=q, next_cursor=next_cursor,
+                           load_more_url=url_for('admin_clients_api', q=q))
+
+@app.route('/admin/api/clients')
+@admin_required
+def admin_clients_api():
+    """客户端列表分页（JSON，页面"加载更多"调用）"""
+    clients, next_cursor = _client_page(request.args.get('q', '').strip(), cursor=request.args.get('cursor'),
+                                        limit=pagination.clamp_limit(request.args.get('limit')))
+    return _page_response(AUTH_COLUMNS, clients, next_cursor, '_client_rows.html', 'clients')
 
 @app.route('/admin/clients/new', methods=['GET', 'POST'])
 @admin_required
@@ -757,12 +1218,11 @@ def admin_client_new():
         from datetime import timedelta
         client_id = hashlib.md5(f"{name}{hardware_id}{time.time()}".encode()).hexdigest()
         expires_at = (datetime.now() + timedelta(days=expires_days)).strftime('%Y-%m-%d %H:%M:%S')
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('INSERT INTO authorizations (client_id, client_name, ip_address, hardware_id, expires_at) VALUES (?,?,?,?,?)',
-                  (client_id, name, ip, hardware_id, expires_at))
-        conn.commit()
-        conn.close()
+        with db_transaction() as c:
+            c.execute('INSERT INTO authorizations (client_id, client_name, ip_address, hardware_id, expires_at, expires_epoch) VALUES (?,?,?,?,?,?)',
+                      (client_id, name, ip, hardware_id, expires_at, local_epoch(expires_at)))
+        # 新客户端可能按 hardware_id 命中原先缓存的试用判定
+        auth_cache.invalidate()
         flash('已创建客户端', 'success')
         return redirect(url_for('admin_clients_page'))
     return render_template('client_form.html', client=None)
@@ -770,12 +1230,11 @@ def admin_client_new():
 @app.route('/admin/clients/<int:cid>/edit', methods=['GET', 'POST'])
 @admin_required
 def admin_client_edit(cid):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     c.execute('SELECT * FROM authorizations WHERE id = ?', (cid,))
     client = c.fetchone()
     if not client:
-        conn.close()
         flash('未找到客户端', 'danger')
         return redirect(url_for('admin_clients_page'))
     if request.method == 'POST':
@@ -784,26 +1243,33 @@ def admin_client_edit(cid):
         hardware_id = request.form.get('hardware_id') or None
         is_active = 1 if request.form.get('is_active') == 'on' else 0
         expires_at = request.form.get('expires_at') or None
-        c.execute('''UPDATE authorizations SET client_name=?, ip_address=?, hardware_id=?, is_active=?, expires_at=? WHERE id=?''',
-                  (name, ip, hardware_id, is_active, expires_at, cid))
+        c.execute('''UPDATE authorizations SET client_name=?, ip_address=?, hardware_id=?, is_active=?, expires_at=?, expires_epoch=? WHERE id=?''',
+                  (name, ip, hardware_id, is_active, expires_at, local_epoch(expires_at), cid))
+        token_revocations.revoke(c, client[1])
         conn.commit()
-        conn.close()
+        auth_cache.invalidate(client_id=client[1], auth_id=cid)
         flash('已保存', 'success')
         return redirect(url_for('admin_clients_page'))
-    conn.close()
     return render_template('client_form.html', client=client)
 
+def _revoke_tokens_by_id(c, cid):
+    """客户端状态变更后吊销其已签发的令牌（在同一写事务中）"""
+    c.execute('SELECT client_id FROM authorizations WHERE id=?', (cid,))
+    row = c.fetchone()
+    if row:
+        token_revocations.revoke(c, row[0])
+
 @app.route('/admin/clients/<int:cid>/approve')
 @admin_required
 def admin_client_approve(cid):
     """批准客户端"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     from datetime import timedelta
     expires_at = (datetime.now() + timedelta(days=365)).strftime('%Y-%m-%d %H:%M:%S')
-    c.execute('UPDATE authorizations SET is_active=1, expires_at=? WHERE id=?', (expires_at, cid))
-    conn.commit()
-    conn.close()
+    with db_transaction() as c:
+        c.execute('UPDATE authorizations SET is_active=1, expires_at=?, expires_epoch=? WHERE id=?',
+                  (expires_at, local_epoch(expires_at), cid))
+        _revoke_tokens_by_id(c, cid)
+    auth_cache.invalidate(auth_id=cid)
     flash('✓ 已批准客户端，有效期1年', 'success')
     return redirect(url_for('admin_clients_page'))
 
@@ -811,11 +1277,10 @@ def admin_client_approve(cid):
 @admin_required
 def admin_client_reject(cid):
     """拒绝客户端"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('UPDATE authorizations SET is_active=-1 WHERE id=?', (cid,))
-    conn.commit()
-    conn.close()
+    with db_transaction() as c:
+        c.execute('UPDATE authorizations SET is_active=-1 WHERE id=?', (cid,))
+        _revoke_tokens_by_id(c, cid)
+    auth_cache.invalidate(auth_id=cid)
     flash('✗ 已拒绝客户端', 'warning')
     return redirect(url_for('admin_clients_page'))
 
@@ -823,97 +1288,116 @@ def admin_client_reject(cid):
 @admin_required
 def admin_client_set_status(cid, status):
     """设置客户端状态"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('UPDATE authorizations SET is_active=? WHERE id=?', (status, cid))
-    conn.commit()
-    conn.close()
+    with db_transaction() as c:
+        c.execute('UPDATE authorizations SET is_active=? WHERE id=?', (status, cid))
+        _revoke_tokens_by_id(c, cid)
+    auth_cache.invalidate(auth_id=cid)
     
     status_text = {0: '待审核', 1: '已批准', -1: '已拒绝'}.get(status, '未知')
     flash(f'已更新状态为：{status_text}', 'success')
     return redirect(url_for('admin_clients_page'))
 
+def _search_filters(table, fields, args):
+    """日志筛选条件 -> (where, params)；文本条件走分区的 FTS5 索引，q 为全字段检索"""
+    filters = [((column,), args.get(key, '').strip()) for column, key in fields]
+    filters.append((search_index.FTS_COLUMNS[table], args.get('q', '').strip()))
+    where, params = search_index.where_clause(filters, '{partition}_fts')
+    if args.get('success', '') in ('0', '1'):
+        where = ' AND '.join(filter(None, [where, 'success = ?']))
+        params.append(int(args['success']))
+    return where, params
+
+def _log_filters(args):
+    return _search_filters('request_logs', (('client_id', 'client_id'), ('ip_address', 'ip'), ('request_type', 'action')), args)
+
+def _event_filters(args):
+    return _search_filters('event_logs', (('client_id', 'client_id'), ('action', 'action'), ('ip_address', 'ip')), args)
+
+def _filter_args(*keys):
+    return {key: request.args.get(key, '').strip() for key in keys}
+
 @app.route('/admin/logs')
 @admin_required
 def admin_logs():
-    client_id = request.args.get('client_id', '').strip()
-    ip = request.args.get('ip', '').strip()
-    action = request.args.get('action', '').strip()
-    success = request.args.get('success', '')
-    delete_before = request.args.get('delete_before')
+    filters = _filter_args('q', 'client_id', 'ip', 'action', 'success')
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    # 可选：删除7天前日志（整个分区删除）
+    if request.args.get('delete_before'):
+        with db_transaction() as tx:
+            log_partitions.drop_before(tx, 'request_logs', 7)
 
-    # 可选：删除7天前日志
-    if delete_before:
-        c.execute("DELETE FROM request_logs WHERE created_at < datetime('now','-7 days')")
-        conn.commit()
+    where, params = _log_filters(filters)
+    logs, next_cursor = pagination.partitioned_page(
+        get_db().cursor(), 'request_logs', log_partitions.COLUMNS['request_logs'], where, params)
+    return render_template('logs.html', logs=logs, next_cursor=next_cursor,
+                           load_more_url=url_for('admin_logs_api', **filters), **filters)
 
-    # 构建查询
-    sql = 'SELECT * FROM request_logs WHERE 1=1'
-    params = []
-    if client_id:
-        sql += ' AND client_id LIKE ?'
-        params.append(f"%{client_id}%")
-    if ip:
-        sql += ' AND ip_address LIKE ?'
-        params.append(f"%{ip}%")
-    if action:
-        sql += ' AND request_type LIKE ?'
-        params.append(f"%{action}%")
-    if success in ('0','1'):
-        sql += ' AND success = ?'
-        params.append(int(success))
-    sql += ' ORDER BY created_at DESC LIMIT 500'
-
-    c.execute(sql, tuple(params))
-    logs = c.fetchall()
-    conn.close()
-    return render_template('logs.html', logs=logs, client_id=client_id, ip=ip, action=action, success=success)
+@app.route('/admin/api/logs')
+@admin_required
+def admin_logs_api():
+    """请求日志分页（JSON）"""
+    columns = log_partitions.COLUMNS['request_logs']
+    where, params = _log_filters(request.args)
+    logs, next_cursor = pagination.partitioned_page(
+        get_db().cursor(), 'request_logs', columns, where, params,
+        cursor=request.args.get('cursor'), limit=pagination.clamp_limit(request.args.get('limit')))
+    return _page_response(columns, logs, next_cursor, '_log_rows.html', 'logs')
 
 
 @app.route('/admin/events')
 @admin_required
 def admin_events():
-    client_id = request.args.get('client_id', '').strip()
-    action = request.args.get('action', '').strip()
-    ip = request.args.get('ip', '').strip()
-    success = request.args.get('success', '')
-    delete_before = request.args.get('delete_before')
+    filters = _filter_args('q', 'client_id', 'action', 'ip', 'success')
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    if request.args.get('delete_before'):
+        with db_transaction() as tx:
+            log_partitions.drop_before(tx, 'event_logs', 30)
 
-    if delete_before:
-        c.execute("DELETE FROM event_logs WHERE created_at < datetime('now','-30 days')")
-        conn.commit()
+    where, params = _event_filters(filters)
+    rows, next_cursor = pagination.partitioned_page(
+        get_db().cursor(), 'event_logs', log_partitions.COLUMNS['event_logs'], where, params)
+    return render_template('events.html', rows=rows, next_cursor=next_cursor,
+                           load_more_url=url_for('admin_events_api', **filters), **filters)
 
-    sql = 'SELECT id, client_id, hardware_id, ip_address, action, detail_json, success, created_at FROM event_logs WHERE 1=1'
-    params = []
-    if client_id:
-        sql += ' AND client_id LIKE ?'
-        params.append(f"%{client_id}%")
-    if action:
-        sql += ' AND action LIKE ?'
-        params.append(f"%{action}%")
-    if ip:
-        sql += ' AND ip_address LIKE ?'
-        params.append(f"%{ip}%")
-    if success in ('0','1'):
-        sql += ' AND success = ?'
-        params.append(int(success))
-    sql += ' ORDER BY created_at DESC LIMIT 500'
-
-    c.execute(sql, tuple(params))
-    rows = c.fetchall()
-    conn.close()
-    return render_template('events.html', rows=rows, client_id=client_id, action=action, ip=ip, success=success)
+@app.route('/admin/api/events')
+@admin_required
+def admin_events_api():
+    """事件日志分页（JSON）"""
+    columns = log_partitions.COLUMNS['event_logs']
+    where, params = _event_filters(request.args)
+    rows, next_cursor = pagination.partitioned_page(
+        get_db().cursor(), 'event_logs', columns, where, params,
+        cursor=request.args.get('cursor'), limit=pagination.clamp_limit(request.args.get('limit')))
+    return _page_response(columns, rows, next_cursor, '_event_rows.html', 'rows')
+
+@app.route('/admin/stats')
+@admin_required
+def admin_stats():
+    """请求/事件统计概览（只读汇总表，不扫描日志）"""
+    kind = request.args.get('kind', 'requests')
+    if kind not in log_rollups.KINDS:
+        kind = 'requests'
+    client_id = request.args.get('client_id', '').strip()
+    try:
+        days = min(max(int(request.args.get('days', 7)), 1), 365)
+    except ValueError:
+        days = 7
+
+    c = get_db().cursor()
+    since = log_rollups.since_for('day', days)
+    filters = dict(since=since, client_id=client_id or None)
+    daily = log_rollups.query(c, kind, 'day', group_by=('bucket',), **filters)
+    hourly = log_rollups.query(c, kind, 'hour', since=log_rollups.since_for('hour', 24),
+                               client_id=client_id or None, group_by=('bucket',))
+    by_type = log_rollups.query(c, kind, 'day', group_by=('type',), limit=50, **filters)
+    by_client = log_rollups.query(c, kind, 'day', group_by=('client_id',), limit=50, **filters)
+    return render_template('stats.html', kind=kind, client_id=client_id, days=days,
+                           daily=daily, hourly=hourly, by_type=by_type, by_client=by_client)
 
 @app.route('/admin/rules', methods=['GET', 'POST'])
 @admin_required
 def admin_rules():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     if request.method == 'POST':
         name = request.form.get('name') or '默认规则'
@@ -929,24 +1413,29 @@ def admin_rules():
                      VALUES (?,?,?,?,?,?,?,?)''',
                   (name, price_diff_threshold, prefer_platform, time_window_days, min_exposure, min_clicks, min_growth_percent, allow_official))
         conn.commit()
+        # 规则变更影响所有绑定该规则的缓存判定
+        auth_cache.invalidate()
     c.execute('SELECT * FROM selection_rules WHERE is_active=1 ORDER BY updated_at DESC')
     rules = c.fetchall()
-    conn.close()
     return render_template('rules.html', rules=rules)
 
 @app.route('/admin/ipwl/<client_id>', methods=['GET', 'POST'])
 @admin_required
 def admin_ip_whitelist(client_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     if request.method == 'POST':
         ip_cidr = request.form.get('ip_cidr')
         if ip_cidr:
-            c.execute('INSERT INTO ip_whitelist (client_id, ip_cidr) VALUES (?,?)', (client_id, ip_cidr))
-            conn.commit()
+            network = IPWhitelist.parse(ip_cidr)
+            if network is None:
+                flash(f'无效的 IP / 网段：{ip_cidr}', 'danger')
+            else:
+                c.execute('INSERT INTO ip_whitelist (client_id, ip_cidr) VALUES (?,?)', (client_id, str(network)))
+                conn.commit()
+                refresh_ip_whitelist(force=True)
     c.execute('SELECT * FROM ip_whitelist WHERE client_id=? ORDER BY created_at DESC', (client_id,))
     ips = c.fetchall()
-    conn.close()
     return render_template('ipwl.html', client_id=client_id, ips=ips)
 
 # ==================== 智能选品API ====================
@@ -957,75 +1446,40 @@ def intelligent_selection():
     """
     智能选品API（核心逻辑全在服务器）
     客户端只传参数，服务器返回结果
+    ?stream=ndjson|sse 或对应的 Accept 头时流式返回
     """
     try:
         data = request.json
         client_id = request.headers.get('X-Client-ID')
         
         # 获取参数
-        category = data.get('category')  # 类目
-        timerange = data.get('timerange', '近7天')  # 时间段
-        count = int(data.get('count', 50))  # 数量
         discount_threshold = float(data.get('discount_threshold', 0.30))  # 价差阈值
-        growth_threshold = float(data.get('growth_threshold', 0.20))  # 增长阈值
-        allow_official = data.get('allow_official', True)  # 是否包含官方
         
         log_request(client_id, request.remote_addr, 'intelligent_selection', True)
         
-        # 1. 从抖音/淘宝爬取商品（服务器端执行）
-        source_products = scrape_source_platform(
-            category=category,
-            timerange=timerange,
-            count=count,
-            growth_threshold=growth_threshold,
-            allow_official=allow_official
-        )
+        # 1. 从抖音/淘宝爬取商品（服务器端执行，相同参数的并发请求共用一次爬取）
+        source_args = _selection_source_args(data)
+        source_products = _selection_sources(source_args)
         
+        fmt = streaming.negotiate(request)
         if not source_products:
+            if fmt:
+                return streaming.stream(fmt, iter([('summary', {'success': False, 'error': '未找到符合条件的源商品'})]))
             return jsonify({
                 'success': False,
                 'error': '未找到符合条件的源商品'
             })
         
         # 2. 逐个从拼多多搜索匹配商品（服务器端执行）
-        matched_results = []
-        
-        for idx, source_prod in enumerate(source_products):
-            # 搜索拼多多
-            pdd_candidates = search_pinduoduo(source_prod['title'])
-            
-            if not pdd_candidates:
-                continue
-            
-            # 使用AI匹配器找出最相似的商品
-            from ai_matcher import ProductMatcher
-            matcher = ProductMatcher()
-            
-            matched = matcher.match_products(source_prod, pdd_candidates)
-            
-            # 筛选价格符合条件的
-            for pdd_prod, similarity in matched:
-                if similarity < 0.6:  # 相似度阈值
-                    continue
-                
-                # 计算价差
-                price_diff = (source_prod['price'] - pdd_prod['price']) / source_prod['price']
-                
-                if price_diff >= discount_threshold:
-                    matched_results.append({
-                        'title': source_prod['title'],
-                        'douyin_price': source_prod['price'],
-                        'douyin_url': source_prod['url'],
-                        'douyin_sales': source_prod.get('sales', 0),
-                        'growth_rate': source_prod.get('growth_rate', ''),
-                        'pdd_price': pdd_prod['price'],
-                        'pdd_urls': [pdd_prod['url']],  # 可以有多个
-                        'discount_rate': f"{price_diff:.1%}",
-                        'similarity': f"{similarity:.1%}",
-                        'image_url': source_prod.get('image_url', '')
-                    })
-                    break  # 找到一个就够了
+        matches = _selection_matches(source_products, discount_threshold)
+        if fmt:
+            # 流式：每匹配到一个商品立即下发，最后一条为汇总（见 streaming.py）
+            return streaming.stream(fmt, streaming.results(matches, sources=len(source_products)))
         
+        # 非流式：相同参数的并发请求共用一次完整匹配
+        matched_results = single_flight.do(
+            make_key('intelligent_selection', dict(source_args, discount_threshold=discount_threshold)),
+            lambda: list(matches))
         return jsonify({
             'success': True,
             'data': matched_results,
@@ -1037,6 +1491,94 @@ def intelligent_selection():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _selection_source_args(data):
+    """智能选品的源商品筛选参数（接口和后台任务共用）"""
+    return {
+        'category': data.get('category'),  # 类目
+        'timerange': data.get('timerange', '近7天'),  # 时间段
+        'count': int(data.get('count', 50)),  # 数量
+        'growth_threshold': float(data.get('growth_threshold', 0.20)),  # 增长阈值
+        'allow_official': data.get('allow_official', True)  # 是否包含官方
+    }
+
+
+# 选品时间段 -> 增长率窗口（天）
+TIMERANGE_DAYS = {'近1天': 1, '近7天': 7, '近30天': 30}
+
+
+def _selection_sources(source_args):
+    """按筛选参数爬取源商品，记录后按历史销量增长率过滤；相同参数的并发请求合并为一次"""
+    def scrape():
+        products = scrape_source_platform(**source_args)
+        _record_scrape('douyin', products)
+        return _filter_growth(products, source_args['timerange'], source_args['growth_threshold'])
+    return single_flight.do(make_key('selection_sources', source_args), scrape)
+
+
+def _filter_growth(products, timerange, growth_threshold):
+    """
+    用历史销量计算时间段内的增长率：有足够历史的商品按阈值过滤并填入 growth_rate，
+    历史不足的商品保留爬取到的 growth_rate，不过滤
+    """
+    days = TIMERANGE_DAYS.get(timerange, 7)
+    growth = price_history.growth('douyin', [product_key(p) for p in products], windows=(days,))[days]
+    selected = []
+    for product, rate in zip(products, growth.tolist()):
+        if rate == rate:  # 非 NaN
+            if rate < growth_threshold:
+                continue
+            product = dict(product, growth_rate=f"{rate:.0%}")
+        selected.append(product)
+    return selected
+
+
+def _selection_matches(source_products, discount_threshold, progress=None):
+    """
+    逐个源商品搜索拼多多并做AI匹配，匹配成功即产出一条结果；相同关键词只搜一次，并优先走搜索缓存和商品目录
+    progress(已处理数) 在每个源商品处理完后调用（后台任务上报进度）
+    """
+    keys, unique = search_cache.dedupe(source_prod['title'] for source_prod in source_products)
+    searched = {}
+    # 使用AI匹配器找出最相似的商品（进程内共享、已预热）
+    matcher = warm_matcher.get(MATCHER_WARMUP_TIMEOUT)
+    
+    for idx, source_prod in enumerate(source_products):
+        if progress is not None and idx:
+            progress(idx)
+        # 搜索拼多多
+        if keys[idx] not in searched:
+            searched[keys[idx]] = _search_pinduoduo_cached('pinduoduo', unique[keys[idx]], search_pinduoduo)
+        pdd_candidates = searched[keys[idx]]
+        
+        if not pdd_candidates:
+            continue
+        
+        matched = matcher.match_products(source_prod, pdd_candidates)
+        
+        # 筛选价格符合条件的
+        for pdd_prod, similarity in matched:
+            if similarity < 0.6:  # 相似度阈值
+                continue
+            
+            # 计算价差
+            price_diff = (source_prod['price'] - pdd_prod['price']) / source_prod['price']
+            
+            if price_diff >= discount_threshold:
+                yield {
+                    'title': source_prod['title'],
+                    'douyin_price': source_prod['price'],
+                    'douyin_url': source_prod['url'],
+                    'douyin_sales': source_prod.get('sales', 0),
+                    'growth_rate': source_prod.get('growth_rate', ''),
+                    'pdd_price': pdd_prod['price'],
+                    'pdd_urls': [pdd_prod['url']],  # 可以有多个
+                    'discount_rate': f"{price_diff:.1%}",
+                    'similarity': f"{similarity:.1%}",
+                    'image_url': source_prod.get('image_url', '')
+                }
+                break  # 找到一个就够了
+
+
 def scrape_source_platform(category, timerange, count, growth_threshold, allow_official):
     """
     从源平台（抖音/淘宝）爬取商品
@@ -1094,31 +1636,32 @@ def check_auth():
     if not client_id:
         return jsonify({'success': False, 'error': '缺少客户端ID'}), 400
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT is_active FROM authorizations WHERE client_id = ? LIMIT 1', (client_id,))
+    c.execute('SELECT is_active, expires_epoch FROM authorizations WHERE client_id = ? LIMIT 1', (client_id,))
     row = c.fetchone()
 
     if not row:
         # 未注册也尝试按试用规则判断（不发试用，仅返回未授权）
-        conn.close()
         return jsonify({'success': True, 'authorized': False, 'is_active': 0, 'trial_remaining_seconds': 0})
 
-    is_active = row[0]
+    is_active, expires_epoch = row
+    now = int(time.time())
+    trial_expires = None
     trial_left = 0
     if is_active != 1:
-        # 查是否有有效试用（取最近一条）
-        c.execute('''SELECT trial_expires_at FROM client_access WHERE client_id=? ORDER BY trial_expires_at DESC LIMIT 1''', (client_id,))
-        r = c.fetchone()
-        if r and r[0]:
-            try:
-                exp = datetime.strptime(r[0], '%Y-%m-%d %H:%M:%S')
-                left = (exp - datetime.now()).total_seconds()
-                trial_left = int(left) if left > 0 else 0
-            except Exception:
-                pass
-    conn.close()
-    return jsonify({'success': True, 'authorized': bool(is_active == 1 or trial_left > 0), 'is_active': is_active, 'trial_remaining_seconds': trial_left})
+        # 是否有有效试用
+        trial_expires = _active_trial_expiry(c, client_id, now)
+        if trial_expires:
+            trial_left = trial_expires - now
+    return jsonify({
+        'success': True,
+        'authorized': bool(is_active == 1 or trial_left > 0),
+        'is_active': is_active,
+        'trial_remaining_seconds': trial_left,
+        # 带上 X-Hardware-ID 时签发令牌，后续请求放在 X-Auth-Token 头中
+        **_token_fields(client_id, request.headers.get('X-Hardware-ID'), is_active, now, trial_expires, expires_epoch)
+    })
 
 
 # ==================== 抖店爬虫API（支持验证码交互） ====================
@@ -1150,37 +1693,47 @@ def cleanup_stale_scrapers():
         except Exception as e:
             logger.error(f"❌ 清理爬虫实例失败 {client_id}: {e}")
 
-def backup_database():
-    """备份数据库"""
+def purge_expired_logs():
+    """删除过期的日志分区，并回收空间、更新统计信息"""
     try:
-        import shutil
-        backup_dir = "backups"
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d")
-        backup_file = f"{backup_dir}/authorization_{timestamp}.db"
-        
-        # 只备份今天的（避免重复备份）
-        if not os.path.exists(backup_file):
-            shutil.copy2(DB_PATH, backup_file)
-            logger.info(f"💾 数据库备份成功: {backup_file}")
-            
-            # 删除7天前的备份
-            for f in os.listdir(backup_dir):
-                if f.startswith("authorization_") and f.endswith(".db"):
-                    file_path = os.path.join(backup_dir, f)
-                    if os.path.getmtime(file_path) < time.time() - 7*86400:
-                        os.remove(file_path)
-                        logger.info(f"🗑️ 删除旧备份: {f}")
+        dropped = log_partitions.apply_retention(DB_PATH)
+        for table, names in dropped.items():
+            if names:
+                logger.info(f"🗑️ 删除过期日志分区 {table}: {', '.join(names)}")
+        deleted = log_rollups.apply_retention(DB_PATH)
+        if deleted:
+            logger.info(f"🗑️ 删除过期小时汇总 {deleted} 行")
     except Exception as e:
-        logger.error(f"❌ 数据库备份失败: {e}")
+        logger.error(f"❌ 清理日志分区失败: {e}")
+
+def backup_database():
+    """备份数据库（在线备份 API + 压缩 + 完整性校验，见 backup.py）"""
+    result = backup_manager.run()
+    if result.get('success'):
+        logger.info(f"💾 数据库备份成功: {result['file']}（{result['archive_bytes'] // 1024}KB，{result['elapsed_ms']}ms）")
+        for name in result.get('removed', []):
+            logger.info(f"🗑️ 删除旧备份: {name}")
+    elif not result.get('skipped'):  # 其他 worker 正在备份
+        logger.error(f"❌ 数据库备份失败: {result.get('error')}")
 
 # 启动定时任务
 scheduler = BackgroundScheduler()
 scheduler.add_job(cleanup_stale_scrapers, 'interval', minutes=10)  # 每10分钟清理一次
 scheduler.add_job(backup_database, 'cron', hour=3, minute=0)  # 每天凌晨3点备份
+scheduler.add_job(purge_expired_logs, 'cron', hour=3, minute=30)  # 每天凌晨3点半清理过期日志分区
+scheduler.add_job(request_accounting.flush, 'interval', seconds=ACCOUNTING_FLUSH_SECONDS)  # 请求计数批量写回
+scheduler.add_job(refresh_ip_whitelist, 'interval', seconds=30)  # 同步其他进程对白名单的修改
+scheduler.add_job(token_revocations.refresh, 'interval', seconds=5)  # 同步其他进程写入的令牌吊销
+scheduler.add_job(search_cache.purge_expired, 'interval', minutes=30)  # 清理过期的搜索缓存
+scheduler.add_job(job_manager.purge_expired, 'interval', minutes=30)  # 清理过期的后台任务结果
+scheduler.add_job(catalog.purge_expired, 'interval', hours=6)  # 清理长期未再见到的目录商品
+scheduler.add_job(price_history.purge_expired, 'interval', days=1)  # 清理超出保留期的历史数据块
+scheduler.add_job(image_store.purge_expired, 'interval', days=1)  # 清理超出保留期的图片哈希
 scheduler.start()
-atexit.register(lambda: scheduler.shutdown())
+atexit.register(scheduler.shutdown)
+atexit.register(request_accounting.flush)  # 退出前写回剩余计数
+atexit.register(log_writer.stop)  # 退出前写完队列中的日志
+atexit.register(fanout.shutdown)
 
 @app.route('/api/douyin-login-start', methods=['POST'])
 @require_auth
@@ -1315,9 +1868,12 @@ def douyin_scrape(auth=None):
     """
     步骤4：根据客户选择的参数爬取商品 - 优化版
     """
-    client_id = request.headers.get('X-Client-ID')
-    data = request.json
-    
+    body, status = _run_douyin_scrape(request.headers.get('X-Client-ID'), request.json)
+    return jsonify(body), status
+
+
+def _run_douyin_scrape(client_id, data):
+    """按参数爬取商品，返回 (响应体, HTTP状态码)；接口和后台任务共用"""
     rank_type = data.get('rank_type', '搜索榜')
     time_range = data.get('time_range', '近1天')
     category = data.get('category')
@@ -1328,20 +1884,20 @@ def douyin_scrape(auth=None):
     
     scraper = scraper_pool.get(client_id)
     if not scraper:
-        return jsonify({
+        return {
             'success': False,
             'error_type': 'auth',
             'error': '会话已过期，请重新登录'
-        }), 400
+        }, 400
     
     if scraper.login_status != 'logged_in':
-        return jsonify({
+        return {
             'success': False,
             'error_type': 'auth',
             'error': '请先完成登录'
-        }), 400
+        }, 400
     
-    try:
+    def scrape():
         # 选择选项
         scraper.select_options(
             rank_type=rank_type,
@@ -1350,50 +1906,65 @@ def douyin_scrape(auth=None):
             brand_type=brand_type
         )
         
-        # 获取商品
+        # 获取商品（写入商品目录和价格历史）
         products = scraper.get_products(limit=limit, first_time_only=first_time_only)
+        _record_scrape('douyin', products)
+        return products
+    
+    try:
+        # 同一客户端相同榜单参数的并发请求只爬取一次，共享结果（异常也共享，各自按下面的分支返回）
+        # 键里必须带 client_id：每个客户端用自己的登录会话爬取，不能拿到别的账号的数据或登录异常
+        products = single_flight.do(make_key('douyin_scrape', {
+            'client_id': client_id,
+            'rank_type': rank_type,
+            'time_range': time_range,
+            'category': category,
+            'brand_type': brand_type,
+            'limit': limit,
+            'first_time_only': first_time_only
+        }), scrape)
         
         # 如果指定了前N名，则截取
         if top_n > 0:
             products = products[:top_n]
         
-        return jsonify({
+        return {
             'success': True,
             'products': products,
             'count': len(products)
-        })
+        }, 200
     
     except LoginRequiredException as e:
         logger.warning(f"❌ 需要登录: {client_id}")
-        return jsonify({
+        return {
             'success': False,
             'error_type': 'auth',
             'error': '登录已过期，请重新登录'
-        }), 401
+        }, 401
     
     except ElementNotFoundException as e:
         logger.error(f"❌ 元素定位失败: {client_id}, {e}")
-        return jsonify({
+        return {
             'success': False,
             'error_type': 'scraper',
             'error': '页面结构已变化，请联系客服更新程序'
-        }), 500
+        }, 500
     
     except NetworkException as e:
         logger.error(f"❌ 网络错误: {client_id}, {e}")
-        return jsonify({
+        return {
             'success': False,
             'error_type': 'network',
             'error': '网络连接失败，请检查网络后重试'
-        }), 500
+        }, 500
     
     except Exception as e:
         logger.error(f"❌ 爬取异常: {client_id}, {e}", exc_info=True)
-        return jsonify({
+        return {
             'success': False,
             'error_type': 'unknown',
             'error': f'系统错误：{str(e)}'
-        }), 500
+        }, 500
 
 
 @app.route('/api/douyin-screenshot', methods=['POST'])
@@ -1443,8 +2014,101 @@ def douyin_cleanup(auth=None):
     return jsonify({'success': True})
 
 
+# ==================== 后台任务API ====================
+
+def _job_intelligent_selection(ctx, params):
+    """后台任务：智能选品，每匹配到一个商品就追加一条结果"""
+    source_products = _selection_sources(_selection_source_args(params))
+    if not source_products:
+        raise JobError('未找到符合条件的源商品', 'empty')
+    total = len(source_products)
+    matches = _selection_matches(source_products, float(params.get('discount_threshold', 0.30)),
+                                 progress=lambda done: ctx.progress(done, total))
+    for match in matches:
+        ctx.result(match)
+
+
+def _job_douyin_scrape(ctx, params):
+    """后台任务：抖店爬取（使用本进程中该客户端已登录的浏览器会话）"""
+    ctx.check()
+    body, _ = _run_douyin_scrape(ctx.client_id, params)
+    if not body['success']:
+        raise JobError(body['error'], body['error_type'])
+    ctx.results(body['products'])
+
+
+job_manager.register('intelligent_selection', _job_intelligent_selection)
+# 浏览器会话在提交任务的进程内，不能换进程重跑
+job_manager.register('douyin_scrape', _job_douyin_scrape, restartable=False)
+job_manager.start()  # 退出时交还未完成的任务（见 JobManager.start）
+
+
+@app.route('/api/jobs', methods=['POST'])
+@require_auth
+def submit_job():
+    """
+    提交后台任务
+    请求：{"kind": "intelligent_selection" | "douyin_scrape", "params": {与同名接口相同的参数}}
+    返回 202 和任务信息，之后轮询 GET /api/jobs/<id>
+    """
+    client_id = request.headers.get('X-Client-ID')
+    data = request.json or {}
+    try:
+        job = job_manager.submit(client_id, data.get('kind'), data.get('params') or {})
+    except JobError as e:
+        log_request(client_id, request.remote_addr, 'JOB_SUBMIT', False, str(e))
+        return jsonify({
+            'success': False,
+            'error_type': e.error_type,
+            'error': str(e)
+        }), 429 if e.error_type == 'too_many_jobs' else 400
+    
+    log_request(client_id, request.remote_addr, 'JOB_SUBMIT', True)
+    return jsonify({'success': True, 'job': job}), 202
+
+
+@app.route('/api/jobs', methods=['GET'])
+@require_auth
+def list_jobs():
+    """当前客户端最近的任务（重连后找回任务ID）"""
+    jobs = job_manager.list_jobs(request.headers.get('X-Client-ID'),
+                                 limit=pagination.clamp_limit(request.args.get('limit'), default=20))
+    return jsonify({'success': True, 'data': jobs})
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_job(job_id):
+    """
+    任务进度和结果
+    ?after=N 只返回序号大于 N 的结果（上次返回的 next_after），轮询时只取增量
+    """
+    job = job_manager.get(job_id, request.headers.get('X-Client-ID'))
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在或已过期'}), 404
+    results, next_after = job_manager.results(job_id, after=request.args.get('after', 0, type=int),
+                                              limit=pagination.clamp_limit(request.args.get('limit'), default=pagination.MAX_LIMIT))
+    return jsonify({
+        'success': True,
+        'job': job,
+        'results': results,
+        'next_after': next_after
+    })
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@require_auth
+def cancel_job(job_id):
+    """取消任务：排队中的立即取消，运行中的在下一个检查点退出（返回 cancelling）"""
+    status = job_manager.cancel(job_id, request.headers.get('X-Client-ID'))
+    if status is None:
+        return jsonify({'success': False, 'error': '任务不存在或已过期'}), 404
+    return jsonify({'success': True, 'status': status})
+
+
 if __name__ == '__main__':
     init_db()
+    warm_matcher.start()  # 后台预热，不阻塞启动
     logger.info("============================================================")
     logger.info("智能选品系统 - 服务器端")
     logger.info("============================================================")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+授权判定缓存
+缓存 require_auth 解析出的授权结果（授权行、绑定规则、试用到期时间），
+按 (client_id, hardware_id) 索引，带 TTL 上限，并由管理后台操作显式失效。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class AuthCache:
+    """进程内 TTL 授权缓存（线程安全）"""
+
+    def __init__(self, ttl: float = 60, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, client_id: str, hardware_id: str) -> Optional[Dict[str, Any]]:
+        """读取缓存的授权判定，过期或不存在返回 None"""
+        key = (client_id, hardware_id)
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, client_id: str, hardware_id: str, decision: Dict[str, Any]) -> None:
+        """写入授权判定；超过容量时淘汰最久未使用的条目"""
+        if self.ttl <= 0:
+            return
+        key = (client_id, hardware_id)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, decision)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, client_id: Optional[str] = None, auth_id: Optional[int] = None) -> int:
+        """
+        失效缓存条目
+
+        Args:
+            client_id: 按客户端ID失效
+            auth_id: 按 authorizations.id 失效（管理后台按行ID操作）
+            两者都不传时清空全部缓存（例如规则变更）
+
+        Returns:
+            被移除的条目数
+        """
+        with self._lock:
+            if client_id is None and auth_id is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [
+                    key for key, (_, decision) in self._entries.items()
+                    if (client_id is not None and key[0] == client_id)
+                    or (auth_id is not None and decision.get('auth_id') == auth_id)
+                ]
+                for key in keys:
+                    del self._entries[key]
+                removed = len(keys)
+            self.invalidations += 1
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'invalidations': self.invalidations
+            }
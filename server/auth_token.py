@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+短期签名授权令牌（无状态）
+/api/register、/api/check-auth 以及 require_auth 查库放行后签发令牌（响应头 X-Auth-Token），
+客户端之后每次请求带上该令牌，require_auth 只需验证 HMAC 签名和有效期即可放行，不再查库。
+
+令牌格式：base64url(JSON 载荷) + '.' + base64url(HMAC-SHA256 签名)
+载荷字段：
+  c  请求头中的 client_id      h  hardware_id
+  a  命中的授权记录 client_id（纯试用为 null）
+  s  状态 approved / trial     i  签发时间     e  到期时间（Unix 秒）
+
+到期时间取 签发时间+ttl、试用到期、授权到期 三者最小值。
+管理后台修改客户端时写入吊销表，签发时间早于吊销时间的令牌全部失效；
+吊销表很小，各进程定时同步到内存（本进程内的吊销立即生效）。
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import db
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Auth-Token'
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class TokenSigner:
+    """签发 / 验证令牌"""
+
+    def __init__(self, secret: str, ttl: int = 300):
+        self._key = hashlib.sha256(('auth-token:' + secret).encode('utf-8')).digest()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.issued = 0
+        self.verified = 0
+        self.rejected: Dict[str, int] = {}
+
+    def _sign(self, body: str) -> str:
+        return _b64encode(hmac.new(self._key, body.encode('ascii'), hashlib.sha256).digest())
+
+    def issue(self, client_id: str, hardware_id: str, auth_client_id: Optional[str], status: str,
+              now: int, *limits: Optional[int]) -> Optional[Tuple[str, int]]:
+        """签发令牌，返回 (令牌, 到期时间)；limits 为试用/授权到期时间，已到期时不签发"""
+        expires = min([now + self.ttl] + [limit for limit in limits if limit])
+        if expires <= now:
+            return None
+        payload = {'c': client_id, 'h': hardware_id, 'a': auth_client_id, 's': status, 'i': now, 'e': expires}
+        body = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        with self._lock:
+            self.issued += 1
+        return f'{body}.{self._sign(body)}', expires
+
+    def verify(self, token: str, client_id: str, hardware_id: str, now: int) -> Optional[Dict[str, Any]]:
+        """验证签名、有效期以及与请求头的绑定关系，失败返回 None"""
+        claims, reason = None, None
+        body, _, signature = token.partition('.')
+        if not signature or not hmac.compare_digest(signature, self._sign(body)):
+            reason = 'bad_signature'
+        else:
+            try:
+                claims = json.loads(_b64decode(body))
+            except ValueError:
+                reason = 'malformed'
+            else:
+                if claims.get('e', 0) <= now:
+                    reason = 'expired'
+                elif claims.get('c') != client_id or claims.get('h') != hardware_id:
+                    reason = 'mismatch'
+        with self._lock:
+            if reason:
+                self.rejected[reason] = self.rejected.get(reason, 0) + 1
+            else:
+                self.verified += 1
+        return None if reason else claims
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'ttl_seconds': self.ttl,
+            'issued': self.issued,
+            'verified': self.verified,
+            'rejected': dict(self.rejected)
+        }
+
+
+class TokenRevocations:
+    """吊销表：client_id -> 吊销时间；签发时间不晚于吊销时间的令牌无效"""
+
+    def __init__(self, db_path: str, ttl: int):
+        self.db_path = db_path
+        self.ttl = ttl  # 令牌最长有效期，更早的吊销记录不再需要
+        self._revoked: Dict[str, int] = {}
+        self._signature = None
+        self._lock = threading.Lock()
+        self.revoked_hits = 0
+
+    @staticmethod
+    def init_table(c) -> None:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS token_revocations (
+                client_id TEXT PRIMARY KEY,
+                revoked_at INTEGER NOT NULL
+            )
+        ''')
+
+    def revoke(self, c, client_id: str) -> None:
+        """在管理后台的写事务中调用"""
+        if not client_id:
+            return
+        now = int(time.time())
+        c.execute('''INSERT INTO token_revocations (client_id, revoked_at) VALUES (?, ?)
+                     ON CONFLICT (client_id) DO UPDATE SET revoked_at = excluded.revoked_at''', (client_id, now))
+        with self._lock:
+            self._revoked[client_id] = now
+
+    def is_revoked(self, claims: Dict[str, Any]) -> bool:
+        issued = claims.get('i', 0)
+        for client_id in (claims.get('a'), claims.get('c')):
+            revoked_at = self._revoked.get(client_id) if client_id else None
+            if revoked_at is not None and issued <= revoked_at:
+                self.revoked_hits += 1
+                return True
+        return False
+
+    def refresh(self, force: bool = False) -> None:
+        """同步其他进程写入的吊销记录，顺便清理已无意义的旧记录（定时任务调用）"""
+        conn = db.connect(self.db_path)
+        try:
+            cutoff = int(time.time()) - self.ttl
+            c = conn.cursor()
+            c.execute('SELECT COUNT(*), MAX(revoked_at) FROM token_revocations')
+            signature = c.fetchone()
+            if not force and signature == self._signature:
+                return
+            c.execute('SELECT client_id, revoked_at FROM token_revocations WHERE revoked_at >= ?', (cutoff,))
+            revoked = dict(c.fetchall())
+            with self._lock:
+                self._revoked = revoked
+            self._signature = signature
+            if signature[0] > len(revoked):
+                with db.transaction_on(conn) as tx:
+                    tx.execute('DELETE FROM token_revocations WHERE revoked_at < ?', (cutoff,))
+        except Exception as e:
+            logger.error(f"❌ 同步令牌吊销表失败: {e}")
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'revoked_clients': len(self._revoked),
+            'revoked_hits': self.revoked_hits
+        }
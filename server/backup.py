@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+数据库在线备份
+原来的 shutil.copy2 直接复制正在写入的数据库文件，可能复制到写了一半的页；
+这里改用 SQLite 在线备份 API：
+
+1. 分步备份：每步复制 step_pages 页，步间 sleep，把锁让给前台写入
+   （其他连接写入会导致备份从头开始，重启次数超过上限后改为一步完成，WAL 模式下一步备份也不阻塞写入）
+2. 压缩：备份出的临时文件流式压缩为 .db.zst（安装了 zstandard 时）或 .db.gz
+3. 校验：把压缩包解压还原到临时文件并执行 PRAGMA integrity_check，失败则删除该备份
+4. 保留：最多保留 keep 份，且删除超过 max_age_days 天的备份
+
+gunicorn 的每个 worker 都有自己的定时任务，会在同一时刻调用 run()；备份目录下的锁文件（flock）保证
+同一时刻只有一个进程在备份，其余进程直接跳过。临时文件名带进程号，互不覆盖。
+"""
+
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl  # Windows 上没有，只用进程内的锁
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard  # 可选：pip install zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'authorization_'
+LOCK_FILE = '.backup.lock'
+EXTENSIONS = {'zstd': '.db.zst', 'gzip': '.db.gz'}
+CHUNK_SIZE = 1024 * 1024
+
+
+def default_compression() -> str:
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+def _open_compressed(path: str, mode: str):
+    """按扩展名打开压缩文件（mode 为 'rb' / 'wb'）"""
+    if path.endswith(EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise RuntimeError('需要安装 zstandard 才能处理 .zst 备份')
+        f = open(path, mode)
+        if mode == 'wb':
+            return zstandard.ZstdCompressor(level=10).stream_writer(f, closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+    return gzip.open(path, mode, compresslevel=6) if mode == 'wb' else gzip.open(path, mode)
+
+
+def restore(archive: str, dest: str) -> None:
+    """把压缩备份还原成数据库文件"""
+    with _open_compressed(archive, 'rb') as src, open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def integrity_check(db_file: str) -> str:
+    """PRAGMA integrity_check，正常返回 'ok'"""
+    conn = sqlite3.connect(db_file)
+    try:
+        return '; '.join(row[0] for row in conn.execute('PRAGMA integrity_check').fetchall())
+    finally:
+        conn.close()
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+class BackupManager:
+    """定时任务调用 run()；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, db_path: str, backup_dir: str = 'backups', compression: Optional[str] = None,
+                 keep: int = 14, max_age_days: int = 30, step_pages: int = 256,
+                 step_sleep: float = 0.01, max_restarts: int = 20):
+        compression = compression or default_compression()
+        if compression not in EXTENSIONS:
+            raise ValueError(f"未知的压缩方式: {compression}（可选 {', '.join(EXTENSIONS)}）")
+        if compression == 'zstd' and zstandard is None:
+            logger.warning("⚠️ 未安装 zstandard，备份改用 gzip 压缩")
+            compression = 'gzip'
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.compression = compression
+        self.keep = keep
+        self.max_age_days = max_age_days
+        self.step_pages = step_pages
+        self.step_sleep = step_sleep
+        self.max_restarts = max_restarts
+        self._lock = threading.Lock()
+        self.last_result: Dict[str, Any] = {}
+
+    # ---------- 备份 ----------
+
+    def _copy(self, dest: str) -> Dict[str, Any]:
+        """在线备份到 dest（未压缩），返回步数和重启次数"""
+        progress = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+        def on_progress(status, remaining, total):
+            progress['steps'] += 1
+            if progress['remaining'] is not None and remaining > progress['remaining']:
+                progress['restarts'] += 1  # 源库被其他连接修改，备份从头开始
+            progress['remaining'] = remaining
+            if progress['restarts'] > self.max_restarts:
+                raise _TooManyRestarts()
+            time.sleep(self.step_sleep)  # 步间让出锁
+
+        source = sqlite3.connect(self.db_path, timeout=30)
+        target = sqlite3.connect(dest)
+        try:
+            try:
+                source.backup(target, pages=self.step_pages, progress=on_progress)
+            except _TooManyRestarts:
+                logger.warning(f"⚠️ 备份重启 {progress['restarts']} 次，改为一步完成")
+                source.backup(target, pages=-1)
+                progress['single_step'] = True
+        finally:
+            target.close()
+            source.close()
+        progress.pop('remaining')
+        return progress
+
+    def _compress(self, src: str, archive: str) -> None:
+        tmp = f'{archive}.{os.getpid()}.tmp'
+        with open(src, 'rb') as f, _open_compressed(tmp, 'wb') as out:
+            shutil.copyfileobj(f, out, CHUNK_SIZE)
+        os.replace(tmp, archive)
+
+    def _verify(self, archive: str) -> str:
+        """还原到临时文件并做完整性检查"""
+        restored = f'{archive}.{os.getpid()}.verify'
+        try:
+            restore(archive, restored)
+            return integrity_check(restored)
+        finally:
+            if os.path.exists(restored):
+                os.remove(restored)
+
+    def _lock_file(self):
+        """跨进程的备份锁：拿到时返回打开的锁文件，其他进程正在备份时返回 None"""
+        f = open(os.path.join(self.backup_dir, LOCK_FILE), 'a')
+        if fcntl is None:
+            return f
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    def run(self) -> Dict[str, Any]:
+        """执行一次备份 + 校验 + 清理，返回结果（同时记录到 last_result）"""
+        if not self._lock.acquire(blocking=False):
+            logger.warning("⚠️ 上一次备份尚未完成，跳过")
+            return {'success': False, 'error': 'busy'}
+        try:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            lock_file = self._lock_file()
+            if lock_file is None:
+                logger.info("其他进程正在备份，跳过")
+                return {'success': False, 'error': 'busy', 'skipped': True}
+            try:
+                return self._run()
+            finally:
+                lock_file.close()  # 关闭即释放 flock
+        finally:
+            self._lock.release()
+
+    def _run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        raw = os.path.join(self.backup_dir, f'{PREFIX}{stamp}.{os.getpid()}.db.part')
+        archive = os.path.join(self.backup_dir, f'{PREFIX}{stamp}{EXTENSIONS[self.compression]}')
+        result: Dict[str, Any] = {'file': archive, 'compression': self.compression, 'started_at': stamp}
+        compressed = False
+        try:
+            result.update(self._copy(raw))
+            result['db_bytes'] = os.path.getsize(raw)
+            self._compress(raw, archive)
+            compressed = True
+            result['archive_bytes'] = os.path.getsize(archive)
+            check = self._verify(archive)
+            result['integrity'] = check
+            if check != 'ok':
+                raise RuntimeError(f'integrity_check 未通过: {check}')
+            result['removed'] = self.apply_retention()
+            result['success'] = True
+        except Exception as e:
+            # 压缩之后任何一步失败（包括校验时解压出错）都删除这份备份，不留下未经校验的文件
+            if compressed and os.path.exists(archive):
+                os.remove(archive)
+            result.update(success=False, error=str(e))
+        finally:
+            if os.path.exists(raw):
+                os.remove(raw)
+            result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            self.last_result = result
+        return result
+
+    # ---------- 保留策略 ----------
+
+    def list_backups(self) -> List[str]:
+        """现有备份文件（含旧版未压缩的 .db），按时间从新到旧"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = [name for name in os.listdir(self.backup_dir)
+                 if name.startswith(PREFIX) and name.endswith(('.db', EXTENSIONS['gzip'], EXTENSIONS['zstd']))]
+        paths = [os.path.join(self.backup_dir, name) for name in names]
+        return sorted(paths, key=os.path.getmtime, reverse=True)
+
+    def apply_retention(self) -> List[str]:
+        """超出份数或超过保留天数的备份删除，返回被删除的文件名"""
+        cutoff = time.time() - self.max_age_days * 86400
+        removed = []
+        for index, path in enumerate(self.list_backups()):
+            if index >= self.keep or os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed.append(os.path.basename(path))
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        backups = self.list_backups()
+        return {
+            'compression': self.compression,
+            'count': len(backups),
+            'total_bytes': sum(os.path.getsize(path) for path in backups),
+            'keep': self.keep,
+            'max_age_days': self.max_age_days,
+            'last': self.last_result
+        }
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+商品目录（本地商品库）
+智能选品、价格对比每次都重新爬取源平台、重新搜索拼多多，爬到的商品用完即丢。
+这里把每次爬取/搜索到的商品归一化后存入 SQLite，匹配时先查本地，只有冷门或过期的关键词才去实时爬取：
+
+- catalog_products：每个平台一行一个商品（product_id、标题分词 tokens、数值价格、图片哈希、last_seen）；
+  任何一次爬取再见到同一商品都会更新价格和 last_seen
+- catalog_products_fts：tokens 上的 FTS5 索引（触发器同步），candidates() 按关键词的分词查目录里的商品
+- catalog_keywords / catalog_keyword_products：某个关键词上次实时搜索的时间和当时返回的商品（按名次）
+
+fetch() 的顺序：
+1. 关键词在 fresh 秒内搜索过且有结果 -> 直接从目录取商品（当前价格）
+2. 目录里 fresh 秒内见到过、标题包含关键词全部分词的商品不少于 min_candidates 个 -> 直接用这些候选
+   （按 BM25 相关度排序，不一定与平台搜索的名次一致；min_candidates=0 关闭这一步）
+3. 否则实时搜索并写入目录；实时搜索失败时依次退回：该关键词的旧结果（stale-if-error）、
+   retention 内见到过的候选商品
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import db
+from search_cache import normalize_keyword
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_FTS = 'catalog_products_fts'
+
+
+def product_key(product: Dict[str, Any]) -> str:
+    """商品在平台内的唯一标识：优先用 product_id / id，否则用链接（或标题）的哈希"""
+    product_id = product.get('product_id') or product.get('id')
+    if product_id:
+        return str(product_id)
+    basis = product.get('url') or product.get('title') or ''
+    return hashlib.sha1(basis.encode('utf-8')).hexdigest()[:20]
+
+
+def tokenize(text: str) -> List[str]:
+    """标题/关键词 -> 去重后的 jieba 搜索引擎模式分词（先归一化：全半角、大小写、去营销词和标点）"""
+    import jieba  # 匹配器预热时已加载词典
+    normalized = normalize_keyword(text)
+    return list(dict.fromkeys(word for word in jieba.cut_for_search(normalized) if word.strip()))
+
+
+def _fts_query(tokens: Sequence[str]) -> str:
+    return ' AND '.join('"' + token.replace('"', '""') + '"' for token in tokens)
+
+
+def _price(product: Dict[str, Any]) -> Optional[float]:
+    try:
+        return float(product.get('price'))
+    except (TypeError, ValueError):
+        return None
+
+
+class Catalog:
+    """按平台存放商品并记录关键词搜索结果（线程安全）；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, db_path: str, fresh: int = 21600, retention: int = 30 * 86400, min_candidates: int = 5):
+        self.db_path = db_path
+        self.fresh = fresh
+        self.retention = retention
+        self.min_candidates = min_candidates
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.catalog_hits = 0
+        self.candidate_hits = 0
+        self.live_loads = 0
+        self.stale_served = 0
+        self.load_errors = 0
+        self.ingested = 0
+
+    @staticmethod
+    def retokenize(c) -> int:
+        """按当前分词规则重算所有商品的 tokens（触发器同步 FTS 索引，迁移时调用），返回商品数"""
+        rows = c.execute('SELECT id, title FROM catalog_products').fetchall()
+        c.executemany('UPDATE catalog_products SET tokens=? WHERE id=?',
+                      [(' '.join(tokenize(title)), row_id) for row_id, title in rows])
+        return len(rows)
+
+    @staticmethod
+    def init_tables(c) -> None:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                platform TEXT NOT NULL,
+                product_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                tokens TEXT NOT NULL,
+                price REAL,
+                image_url TEXT,
+                image_hash TEXT,
+                url TEXT,
+                data TEXT NOT NULL,
+                first_seen INTEGER NOT NULL,
+                last_seen INTEGER NOT NULL,
+                UNIQUE (platform, product_id)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_catalog_products_last_seen ON catalog_products(last_seen)')
+        # tokens 是空格分隔的分词，unicode61 按空格切分即得到原来的词
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (PRODUCTS_FTS,))
+        created = c.fetchone() is None
+        c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCTS_FTS} USING fts5(
+                          tokens, content='catalog_products', content_rowid='id', tokenize='unicode61')''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {PRODUCTS_FTS}_ai AFTER INSERT ON catalog_products BEGIN
+                          INSERT INTO {PRODUCTS_FTS} (rowid, tokens) VALUES (new.id, new.tokens);
+                      END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {PRODUCTS_FTS}_ad AFTER DELETE ON catalog_products BEGIN
+                          INSERT INTO {PRODUCTS_FTS} ({PRODUCTS_FTS}, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+                      END''')
+        # 每次再见到商品都会 UPDATE（价格、last_seen），标题分词没变时不重写索引
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {PRODUCTS_FTS}_au AFTER UPDATE OF tokens ON catalog_products
+                      WHEN old.tokens IS NOT new.tokens BEGIN
+                          INSERT INTO {PRODUCTS_FTS} ({PRODUCTS_FTS}, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+                          INSERT INTO {PRODUCTS_FTS} (rowid, tokens) VALUES (new.id, new.tokens);
+                      END''')
+        if created:
+            # 外部内容索引必须先与原表一致，之后触发器的 'delete' 才不会破坏索引
+            c.execute(f"INSERT INTO {PRODUCTS_FTS} ({PRODUCTS_FTS}) VALUES ('rebuild')")
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_keywords (
+                namespace TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                refreshed_at INTEGER NOT NULL,
+                result_count INTEGER NOT NULL,
+                PRIMARY KEY (namespace, keyword)
+            ) WITHOUT ROWID
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_catalog_keywords_refreshed ON catalog_keywords(refreshed_at)')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_keyword_products (
+                namespace TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                product_row INTEGER NOT NULL,
+                PRIMARY KEY (namespace, keyword, rank)
+            ) WITHOUT ROWID
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_catalog_keyword_products_row ON catalog_keyword_products(product_row)')
+
+    def _conn(self):
+        """目录自己的线程内连接，不并入请求线程上未提交的事务"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = db.connect(self.db_path)
+        return conn
+
+    def _upsert(self, c, platform: str, products: Sequence[Dict[str, Any]], now: int) -> List[int]:
+        rows = []
+        for product in products:
+            title = product.get('title') or ''
+            c.execute('''INSERT INTO catalog_products
+                             (platform, product_id, title, tokens, price, image_url, image_hash, url, data,
+                              first_seen, last_seen)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                         ON CONFLICT (platform, product_id) DO UPDATE
+                         SET title = excluded.title, tokens = excluded.tokens, price = excluded.price,
+                             image_url = excluded.image_url,
+                             image_hash = COALESCE(excluded.image_hash, catalog_products.image_hash),
+                             url = excluded.url, data = excluded.data, last_seen = excluded.last_seen
+                         RETURNING id''',
+                      (platform, product_key(product), title, ' '.join(tokenize(title)), _price(product),
+                       product.get('image_url'), product.get('image_hash'), product.get('url'),
+                       json.dumps(product, ensure_ascii=False), now, now))
+            rows.append(c.fetchone()[0])
+        return rows
+
+    def ingest(self, platform: str, products: Iterable[Dict[str, Any]]) -> int:
+        """把一次爬取得到的商品写入目录（新增或更新价格、last_seen），返回写入条数；写入失败只记日志"""
+        products = [product for product in products if isinstance(product, dict)]
+        if not products:
+            return 0
+        try:
+            with db.transaction_on(self._conn()) as c:
+                self._upsert(c, platform, products, int(time.time()))
+        except Exception as e:
+            logger.warning(f"⚠️ 商品目录写入失败: {e}")
+            return 0
+        with self._lock:
+            self.ingested += len(products)
+        return len(products)
+
+    def _remember(self, namespace: str, platform: str, keyword: str, products: List[Dict[str, Any]]) -> None:
+        """记录关键词的实时搜索结果"""
+        now = int(time.time())
+        try:
+            with db.transaction_on(self._conn()) as c:
+                rows = self._upsert(c, platform, products, now)
+                c.execute('DELETE FROM catalog_keyword_products WHERE namespace=? AND keyword=?', (namespace, keyword))
+                c.executemany('INSERT INTO catalog_keyword_products (namespace, keyword, rank, product_row) '
+                              'VALUES (?, ?, ?, ?)', [(namespace, keyword, rank, row) for rank, row in enumerate(rows)])
+                c.execute('''INSERT INTO catalog_keywords (namespace, keyword, refreshed_at, result_count) VALUES (?, ?, ?, ?)
+                             ON CONFLICT (namespace, keyword) DO UPDATE
+                             SET refreshed_at = excluded.refreshed_at, result_count = excluded.result_count''',
+                          (namespace, keyword, now, len(rows)))
+        except Exception as e:
+            logger.warning(f"⚠️ 商品目录写入失败: {e}")
+            return
+        with self._lock:
+            self.ingested += len(products)
+
+    def lookup(self, namespace: str, keyword: str, max_age: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        关键词上次搜索到的商品（按原名次，商品数据取目录中最近一次爬到的）
+        关键词从未搜索过、超过 max_age 秒（默认 fresh）未刷新、或上次没有搜到商品时返回 None
+        （空结果由搜索缓存按较短的负缓存时间处理，不在目录里保留 fresh 秒）
+        """
+        c = self._conn()
+        row = c.execute('SELECT refreshed_at, result_count FROM catalog_keywords WHERE namespace=? AND keyword=?',
+                        (namespace, normalize_keyword(keyword))).fetchone()
+        max_age = self.fresh if max_age is None else max_age
+        if row is None or row[0] <= int(time.time()) - max_age or row[1] == 0:
+            return None
+        rows = c.execute('''SELECT p.data FROM catalog_keyword_products k
+                            JOIN catalog_products p ON p.id = k.product_row
+                            WHERE k.namespace=? AND k.keyword=? ORDER BY k.rank''',
+                         (namespace, normalize_keyword(keyword))).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def candidates(self, platform: str, keyword: str, limit: int = 20,
+                   max_age: Optional[int] = None) -> List[Dict[str, Any]]:
+        """目录中标题包含关键词全部分词、且 max_age 秒（默认 retention）内见到过的商品，按 BM25 相关度排序"""
+        max_age = self.retention if max_age is None else max_age
+        tokens = tokenize(keyword)
+        if not tokens:
+            return []
+        rows = self._conn().execute(f'''SELECT p.data FROM {PRODUCTS_FTS} f
+                                         JOIN catalog_products p ON p.id = f.rowid
+                                         WHERE {PRODUCTS_FTS} MATCH ? AND p.platform = ? AND p.last_seen > ?
+                                         ORDER BY f.rank LIMIT ?''',
+                                     (_fts_query(tokens), platform, int(time.time()) - max_age, limit)).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def fetch(self, platform: str, keyword: str, loader: Callable[[str], List[Dict[str, Any]]],
+              namespace: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        先查目录（关键词的搜索结果，再按分词查候选商品），都不够时用原始关键词调用 loader 实时搜索并写入目录
+        namespace 区分同一平台的不同搜索方式（如只取前10个），默认为平台名；limit 为候选商品的最多个数
+        loader 失败时依次返回：该关键词的旧结果、目录中包含关键词全部分词的商品；都没有时原样抛出异常
+        """
+        namespace = namespace or platform
+        products = self.lookup(namespace, keyword)
+        if products is not None:
+            with self._lock:
+                self.catalog_hits += 1
+            return products
+        if self.min_candidates > 0:
+            products = self.candidates(platform, keyword, limit=limit, max_age=self.fresh)
+            if len(products) >= min(self.min_candidates, limit):
+                with self._lock:
+                    self.candidate_hits += 1
+                return products
+        try:
+            products = list(loader(keyword) or [])
+        except Exception as e:
+            with self._lock:
+                self.load_errors += 1
+            stale = self.lookup(namespace, keyword, max_age=self.retention)
+            if stale is None:
+                stale = self.candidates(platform, keyword, limit=limit) or None
+            if stale is None:
+                raise
+            logger.warning(f"⚠️ 实时搜索失败，使用商品目录中的旧结果: {keyword}, {e}")
+            with self._lock:
+                self.stale_served += 1
+            return stale
+        with self._lock:
+            self.live_loads += 1
+        self._remember(namespace, platform, normalize_keyword(keyword), products)
+        return products
+
+    def purge_expired(self) -> int:
+        """删除超过 retention 未再见到的商品和关键词（定时任务调用），返回删除的商品数"""
+        cutoff = int(time.time()) - self.retention
+        conn = db.connect(self.db_path)
+        try:
+            with db.transaction_on(conn) as c:
+                c.execute('DELETE FROM catalog_keywords WHERE refreshed_at <= ?', (cutoff,))
+                c.execute('''DELETE FROM catalog_keyword_products WHERE NOT EXISTS (
+                                 SELECT 1 FROM catalog_keywords k
+                                 WHERE k.namespace = catalog_keyword_products.namespace
+                                   AND k.keyword = catalog_keyword_products.keyword)''')
+                c.execute('''DELETE FROM catalog_products WHERE last_seen <= ? AND NOT EXISTS (
+                                 SELECT 1 FROM catalog_keyword_products k WHERE k.product_row = catalog_products.id)''',
+                          (cutoff,))
+                return c.rowcount
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.catalog_hits + self.candidate_hits + self.live_loads + self.stale_served
+        return {
+            'catalog_hits': self.catalog_hits,
+            'candidate_hits': self.candidate_hits,
+            'live_loads': self.live_loads,
+            'stale_served': self.stale_served,
+            'hit_rate': round((self.catalog_hits + self.candidate_hits) / lookups, 4) if lookups else 0.0,
+            'load_errors': self.load_errors,
+            'ingested': self.ingested,
+            'fresh_seconds': self.fresh,
+            'min_candidates': self.min_candidates,
+            'retention_seconds': self.retention
+        }
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+SQLite 连接管理
+所有请求处理函数共用的连接层：
+1. 每个线程复用一个连接（不再每个请求 sqlite3.connect）
+2. 统一开启 WAL、synchronous=NORMAL、busy_timeout
+3. 提供上下文管理的事务辅助函数
+WAL 模式下读不阻塞写、写不阻塞读，管理后台和埋点同时写入时不再出现 "database is locked"。
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+BUSY_TIMEOUT_MS = 5000      # 等待写锁的最长时间
+CACHED_STATEMENTS = 256     # 每个连接缓存的预编译语句数
+CACHE_SIZE_KB = 8192        # 页缓存大小（KB）
+
+_local = threading.local()
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """新建连接并应用统一的 PRAGMA"""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=CACHED_STATEMENTS
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+def get_conn(db_path: str) -> sqlite3.Connection:
+    """获取当前线程的连接（首次调用时创建）"""
+    conns: Dict[str, sqlite3.Connection] = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = connect(db_path)
+    return conn
+
+
+def release(db_path: str) -> None:
+    """请求结束时调用：回滚未提交的事务，避免把半截事务带给同线程的下一个请求"""
+    conn = getattr(_local, 'conns', {}).get(db_path)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def close(db_path: str) -> None:
+    """关闭当前线程的连接"""
+    conn = getattr(_local, 'conns', {}).pop(db_path, None)
+    if conn is not None:
+        conn.close()
+
+
+def transaction(db_path: str, immediate: bool = True):
+    """
+    事务上下文：正常退出提交，异常回滚
+    若当前连接已处于事务中则并入该事务，由外层负责提交
+
+    Args:
+        immediate: 使用 BEGIN IMMEDIATE 在开始时就拿写锁，
+                   避免读后升级写时与其他写者冲突
+    """
+    return transaction_on(get_conn(db_path), immediate)
+
+
+@contextmanager
+def transaction_on(conn: sqlite3.Connection, immediate: bool = True) -> Iterator[sqlite3.Cursor]:
+    """在指定连接上开启事务（用于定时任务等自行管理的独立连接）"""
+    if conn.in_transaction:
+        yield conn.cursor()
+        return
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+def init_auto_vacuum(conn: sqlite3.Connection) -> bool:
+    """
+    新库（还没有任何表）在建表前直接设为 auto_vacuum=INCREMENTAL（connect 已切换 WAL、写过文件头，
+    仍需 VACUUM 才生效，但空库的 VACUUM 没有开销）
+    返回当前是否已是 INCREMENTAL；老库不在这里转换（需要整库 VACUUM，见 tools/enable_incremental_vacuum.py）
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+    return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """
+    把已有数据库切换为 auto_vacuum=INCREMENTAL，使删除分区后可以用 PRAGMA incremental_vacuum 回收空间
+    需要一次整库 VACUUM（持有写锁，耗时与库大小成正比），只在停服维护时通过 tools/enable_incremental_vacuum.py 执行
+    返回是否做了转换
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+有界并发扇出
+价格对比要为每个淘宝商品去拼多多搜索一次，原来逐个串行，耗时随商品数线性增长。
+这里每个平台一个进程内共享的线程池，max_workers 即该平台的并发上限（所有请求合计），
+一次请求的任务全部提交后，在截止时间内按输入顺序收集结果：
+
+- 返回顺序与输入顺序一致，与完成先后无关
+- 单个任务异常或超时只影响该条（TaskResult.error），不影响其他结果
+- 截止时间到达时，尚未开始的任务直接取消，已在运行的任务结果丢弃
+- imap() 按输入顺序边完成边产出，供流式响应使用
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TaskResult(NamedTuple):
+    index: int              # 在输入中的位置
+    value: Any              # 任务返回值（失败时为 None）
+    error: Optional[str]    # 失败原因：'timeout' / 'cancelled' / 异常信息
+
+
+class FanOut:
+    """按平台划分的有界线程池；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, limits: Dict[str, int], default_limit: int = 4):
+        self.limits = dict(limits)
+        self.default_limit = default_limit
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self, platform: str) -> ThreadPoolExecutor:
+        with self._lock:
+            executor = self._executors.get(platform)
+            if executor is None:
+                workers = max(1, self.limits.get(platform, self.default_limit))
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'fanout-{platform}')
+                self._executors[platform] = executor
+                self._counters[platform] = {'submitted': 0, 'succeeded': 0, 'failed': 0,
+                                            'timed_out': 0, 'in_flight': 0, 'requests': 0}
+            return executor
+
+    def _count(self, platform: str, **deltas: int) -> None:
+        with self._lock:
+            counters = self._counters[platform]
+            for key, delta in deltas.items():
+                counters[key] += delta
+
+    def imap(self, platform: str, func: Callable[[Any], Any], items: Iterable[Any],
+             timeout: float) -> Iterator[TaskResult]:
+        """
+        对 items 逐个并发执行 func，最多等待 timeout 秒
+        按输入顺序逐个产出 TaskResult：前面的任务一完成就返回，不必等全部完成；
+        调用方提前停止迭代（例如客户端断开）时取消尚未开始的任务
+        """
+        executor = self._executor(platform)
+        deadline = time.monotonic() + timeout
+
+        def run(item):
+            self._count(platform, in_flight=1)
+            try:
+                return func(item)
+            finally:
+                self._count(platform, in_flight=-1)
+
+        futures = [executor.submit(run, item) for item in items]
+        self._count(platform, submitted=len(futures), requests=1)
+
+        timed_out = 0
+        try:
+            for index, future in enumerate(futures):
+                try:
+                    value = future.result(timeout=max(deadline - time.monotonic(), 0))
+                except FutureTimeout:
+                    future.cancel()
+                    timed_out += 1
+                    self._count(platform, timed_out=1)
+                    yield TaskResult(index, None, 'timeout')
+                except CancelledError:
+                    self._count(platform, failed=1)
+                    yield TaskResult(index, None, 'cancelled')
+                except Exception as e:
+                    self._count(platform, failed=1)
+                    yield TaskResult(index, None, f'{type(e).__name__}: {e}')
+                else:
+                    self._count(platform, succeeded=1)
+                    yield TaskResult(index, value, None)
+        finally:
+            for future in futures:
+                future.cancel()
+            if timed_out:
+                logger.warning(f"⚠️ {platform} 并发任务 {timed_out}/{len(futures)} 个超过 {timeout}s 截止时间")
+
+    def map(self, platform: str, func: Callable[[Any], Any], items: Iterable[Any],
+            timeout: float) -> List[TaskResult]:
+        """imap 的列表版本：返回与 items 一一对应的 TaskResult 列表"""
+        return list(self.imap(platform, func, items, timeout))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executors, self._executors = list(self._executors.values()), {}
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                platform: dict(counters, max_workers=max(1, self.limits.get(platform, self.default_limit)))
+                for platform, counters in self._counters.items()
+            }
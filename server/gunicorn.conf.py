@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+"""
+gunicorn 配置（在 server 目录下启动时自动加载）
+只放 worker 生命周期钩子；worker 数、端口等仍由启动脚本的命令行参数指定。
+"""
+
+
+def post_worker_init(worker):
+    """worker 加载完 app 后在后台预热商品匹配器（见 warm_matcher.py），不阻塞 worker 开始接收请求"""
+    import app
+    app.warm_matcher.start()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+商品图片缓存 + 感知哈希库
+匹配器计算图片相似度时，每一对商品都重新下载两张图（源商品图片对每个候选各下载一次），
+每次都重新算哈希。这里：
+
+1. 磁盘图片缓存：按 URL 的 sha1 存文件（目录/前两位/sha1），总大小超过 max_bytes 时按最近使用时间淘汰（LRU，
+   命中时更新文件 mtime）
+2. SQLite 表 image_hashes：URL 哈希 -> 内容哈希、phash、dhash；不同 URL 指向同一张图（内容哈希相同）时直接复用
+3. 进程内 LRU 缓存最近用到的哈希；同一 URL 并发请求只下载一次（single-flight）
+4. 下载失败的 URL 在 failure_ttl 秒内不再重试（失效链接不会每次匹配都等满超时）
+5. image_hashes 按写入时间保留 retention_days 天，由定时任务 purge_expired() 清理
+
+跨运行、跨客户端重复出现的商品图片不会再下载、再计算哈希。
+PIL / imagehash 在第一次计算哈希时才导入（与 ai_matcher 一样在匹配器预热线程里加载）。
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+import db
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 单张图片上限，超过不缓存
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+class ImageStore:
+    """图片内容和感知哈希缓存（线程安全）；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, db_path: str, directory: str, max_bytes: int = 1024 * 1024 * 1024,
+                 timeout: float = 10, max_memory_entries: int = 20000, failure_ttl: float = 300,
+                 retention_days: int = 90):
+        self.db_path = db_path
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_memory_entries = max_memory_entries
+        self.failure_ttl = failure_ttl
+        self.retention_days = retention_days
+        self._hashes: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()  # URL 哈希 -> (phash, dhash)
+        self._failures: "OrderedDict[str, float]" = OrderedDict()  # URL 哈希 -> 下载失败记录的过期时间
+        self._downloads = SingleFlight(grace=0)
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()  # 同一时刻只有一个线程扫描、淘汰
+        self._local = threading.local()
+        self._size: Optional[int] = None  # 磁盘缓存总大小（首次使用时扫描）
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.content_hits = 0
+        self.disk_hits = 0
+        self.downloads = 0
+        self.download_errors = 0
+        self.failure_hits = 0
+        self.computed = 0
+        self.evicted = 0
+
+    @staticmethod
+    def init_table(c) -> None:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                url_hash TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                phash TEXT NOT NULL,
+                dhash TEXT NOT NULL,
+                created_at INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_image_hashes_content ON image_hashes(content_hash)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_image_hashes_created ON image_hashes(created_at)')
+
+    def _conn(self):
+        """自己的线程内连接，不并入请求线程上未提交的事务"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = db.connect(self.db_path)
+        return conn
+
+    # ==================== 磁盘图片缓存 ====================
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _disk_usage(self) -> int:
+        return sum(item.stat().st_size for item in self._files())
+
+    def _files(self):
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                for item in os.scandir(entry.path):
+                    if item.is_file() and not item.name.startswith('.'):
+                        yield item
+
+    def _store(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"⚠️ 图片缓存写入失败: {e}")
+            return
+        # 首次扫描目录在锁外进行，扫描期间其他线程照常读写缓存
+        scanned = self._disk_usage() if self._size is None else None
+        with self._lock:
+            if self._size is None:
+                self._size = scanned
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        按 mtime 从旧到新删除，直到总大小降到上限的 90%（重新扫描，其他进程写入的文件也算在内）
+        扫描和删除都不持有 _lock；已有线程在淘汰时直接返回
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            files = []
+            for item in self._files():
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue  # 扫描期间被删除
+                files.append((stat.st_mtime, stat.st_size, item.path))
+            files.sort()
+            size = sum(item[1] for item in files)
+            target = self.max_bytes * 0.9
+            evicted = 0
+            for _, file_size, path in files:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= file_size
+                evicted += 1
+            with self._lock:
+                self._size = size
+                self.evicted += evicted
+        finally:
+            self._evict_lock.release()
+
+    def content(self, url: str) -> Optional[bytes]:
+        """图片内容：先读磁盘缓存（命中时刷新最近使用时间），否则下载并缓存；下载失败返回 None"""
+        if not url:
+            return None
+        key = url_key(url)
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            with self._lock:
+                self.disk_hits += 1
+            return data
+        except OSError:
+            pass
+        with self._lock:
+            expires = self._failures.get(key)
+            if expires is not None:
+                if expires > time.monotonic():
+                    self.failure_hits += 1
+                    return None
+                del self._failures[key]
+        return self._downloads.do(key, lambda: self._download(url, key))
+
+    def _download(self, url: str, key: str) -> Optional[bytes]:
+        try:
+            response = requests.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.content
+        except Exception as e:
+            logger.warning(f"⚠️ 图片下载失败 {url}: {e}")
+            with self._lock:
+                self.download_errors += 1
+                self._failures[key] = time.monotonic() + self.failure_ttl
+                self._failures.move_to_end(key)
+                while len(self._failures) > self.max_memory_entries:
+                    self._failures.popitem(last=False)
+            return None
+        with self._lock:
+            self.downloads += 1
+        if data and len(data) <= MAX_IMAGE_BYTES:
+            self._store(key, data)
+        return data or None
+
+    def image(self, url: str):
+        """PIL 图片（高级匹配的 SIFT 特征用）；无法获取或解码时返回 None"""
+        data = self.content(url)
+        if data is None:
+            return None
+        from PIL import Image
+        try:
+            return Image.open(BytesIO(data))
+        except Exception as e:
+            logger.warning(f"⚠️ 图片解码失败 {url}: {e}")
+            return None
+
+    # ==================== 感知哈希 ====================
+
+    def _remember(self, key: str, hashes: Tuple[str, str]) -> None:
+        with self._lock:
+            self._hashes[key] = hashes
+            self._hashes.move_to_end(key)
+            while len(self._hashes) > self.max_memory_entries:
+                self._hashes.popitem(last=False)
+
+    def hashes(self, url: str):
+        """
+        图片的 (phash, dhash)，imagehash.ImageHash 对象；无法获取图片时返回 None
+        顺序：进程内缓存 -> SQLite（按 URL）-> 取图片内容 -> SQLite（按内容哈希）-> 计算并保存
+        """
+        hex_hashes = self.hex_hashes(url)
+        if hex_hashes is None:
+            return None
+        import imagehash
+        return imagehash.hex_to_hash(hex_hashes[0]), imagehash.hex_to_hash(hex_hashes[1])
+
+    def hex_hashes(self, url: str) -> Optional[Tuple[str, str]]:
+        """同 hashes()，返回十六进制字符串"""
+        if not url:
+            return None
+        key = url_key(url)
+        with self._lock:
+            cached = self._hashes.get(key)
+            if cached is not None:
+                self._hashes.move_to_end(key)
+                self.memory_hits += 1
+                return cached
+
+        conn = self._conn()
+        row = conn.execute('SELECT phash, dhash FROM image_hashes WHERE url_hash=?', (key,)).fetchone()
+        if row is not None:
+            with self._lock:
+                self.db_hits += 1
+            self._remember(key, row)
+            return row
+
+        data = self.content(url)
+        if data is None:
+            return None
+        content_hash = hashlib.sha1(data).hexdigest()
+        row = conn.execute('SELECT phash, dhash FROM image_hashes WHERE content_hash=? LIMIT 1',
+                           (content_hash,)).fetchone()
+        if row is not None:
+            with self._lock:
+                self.content_hits += 1
+        else:
+            row = self._compute(url, data)
+            if row is None:
+                return None
+        try:
+            with db.transaction_on(conn) as c:
+                c.execute('INSERT OR REPLACE INTO image_hashes (url_hash, content_hash, phash, dhash, created_at) '
+                          'VALUES (?, ?, ?, ?, ?)', (key, content_hash, row[0], row[1], int(time.time())))
+        except Exception as e:
+            logger.warning(f"⚠️ 图片哈希写入失败: {e}")
+        self._remember(key, tuple(row))
+        return tuple(row)
+
+    def _compute(self, url: str, data: bytes) -> Optional[Tuple[str, str]]:
+        from PIL import Image
+        import imagehash
+        try:
+            img = Image.open(BytesIO(data))
+            result = str(imagehash.phash(img)), str(imagehash.dhash(img))
+        except Exception as e:
+            logger.warning(f"⚠️ 图片哈希计算失败 {url}: {e}")
+            return None
+        with self._lock:
+            self.computed += 1
+        return result
+
+    def purge_expired(self) -> int:
+        """删除写入超过 retention_days 天的哈希记录（定时任务调用），返回删除行数；仍在用的图片下次重新计算"""
+        cutoff = int(time.time()) - self.retention_days * 86400
+        conn = db.connect(self.db_path)
+        try:
+            with db.transaction_on(conn) as c:
+                c.execute('DELETE FROM image_hashes WHERE created_at < ?', (cutoff,))
+                return c.rowcount
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'memory_entries': len(self._hashes),
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'content_hits': self.content_hits,
+            'computed': self.computed,
+            'disk_hits': self.disk_hits,
+            'downloads': self.downloads,
+            'download_errors': self.download_errors,
+            'failure_hits': self.failure_hits,
+            'failed_urls': len(self._failures),
+            'evicted': self.evicted,
+            'disk_bytes': self._size,
+            'max_bytes': self.max_bytes
+        }
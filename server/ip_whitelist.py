@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+IP 白名单匹配
+把 ip_whitelist 表里的 IP / 网段按客户端编译成前缀树（路径压缩的二进制基数树），
+require_auth 查询时只需沿树走一遍，耗时与前缀长度成正比（IPv4 ≤32 层，IPv6 ≤128 层），
+与规则条数无关。
+
+编译结果是不可变快照：白名单变更时整体重建后替换引用，读者无需加锁。
+"""
+
+import ipaddress
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Node:
+    __slots__ = ('prefix', 'length', 'children', 'terminal')
+
+    def __init__(self, prefix: int, length: int, terminal: bool = False):
+        self.prefix = prefix        # 前 length 位组成的整数
+        self.length = length
+        self.children = [None, None]
+        self.terminal = terminal    # 该节点本身是一条白名单网段
+
+
+class PrefixTrie:
+    """单一地址族的前缀树（width=32 为 IPv4，128 为 IPv6）"""
+
+    def __init__(self, width: int):
+        self.width = width
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def insert(self, network: int, prefix_len: int) -> None:
+        """插入网段：network 为网络地址整数，prefix_len 为掩码位数"""
+        prefix = network >> (self.width - prefix_len) if prefix_len else 0
+        self.size += 1
+        node = self.root
+        while True:
+            if node.terminal:
+                return  # 已被更短的网段覆盖
+            if node.length == prefix_len:
+                node.terminal = True
+                node.children = [None, None]  # 子网段全部被覆盖
+                return
+            bit = (prefix >> (prefix_len - node.length - 1)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(prefix, prefix_len, True)
+                return
+
+            # 计算与子节点的公共前缀长度
+            m = min(prefix_len, child.length)
+            diff = (prefix >> (prefix_len - m)) ^ (child.prefix >> (child.length - m))
+            common = m - diff.bit_length()
+            if common == child.length:
+                node = child
+                continue
+
+            # 在公共前缀处分裂
+            split = _Node(child.prefix >> (child.length - common), common)
+            node.children[bit] = split
+            split.children[(child.prefix >> (child.length - common - 1)) & 1] = child
+            if common == prefix_len:
+                split.terminal = True
+                split.children = [None, None]
+            else:
+                split.children[(prefix >> (prefix_len - common - 1)) & 1] = _Node(prefix, prefix_len, True)
+            return
+
+    def contains(self, address: int) -> bool:
+        """地址是否落在任一网段内"""
+        width = self.width
+        node = self.root
+        while True:
+            if node.terminal:
+                return True
+            if node.length >= width:
+                return False
+            child = node.children[(address >> (width - node.length - 1)) & 1]
+            if child is None or (address >> (width - child.length)) != child.prefix:
+                return False
+            node = child
+
+
+class IPWhitelist:
+    """按客户端编译的白名单快照；没有配置白名单的客户端不受限制"""
+
+    def __init__(self, rules: Iterable[Tuple[str, str]] = ()):
+        self._tries: Dict[str, Tuple[PrefixTrie, PrefixTrie]] = {}
+        self.rule_count = 0
+        self.invalid_count = 0
+        for client_id, ip_cidr in rules:
+            self._add(client_id, ip_cidr)
+
+    @staticmethod
+    def parse(ip_cidr: str) -> Optional[ipaddress._BaseNetwork]:
+        """解析 IP 或网段（主机位非零时自动归一），无效返回 None"""
+        try:
+            return ipaddress.ip_network((ip_cidr or '').strip(), strict=False)
+        except ValueError:
+            return None
+
+    def _add(self, client_id: str, ip_cidr: str) -> None:
+        network = self.parse(ip_cidr)
+        if network is None:
+            self.invalid_count += 1
+            logger.warning(f"⚠️ 忽略无效的白名单条目 {client_id}: {ip_cidr}")
+            return
+        tries = self._tries.get(client_id)
+        if tries is None:
+            tries = self._tries[client_id] = (PrefixTrie(32), PrefixTrie(128))
+        trie = tries[0] if network.version == 4 else tries[1]
+        trie.insert(int(network.network_address), network.prefixlen)
+        self.rule_count += 1
+
+    def has_rules(self, client_id: str) -> bool:
+        return client_id in self._tries
+
+    def allows(self, client_id: str, ip_address: Optional[str]) -> bool:
+        """该客户端是否允许从此 IP 访问"""
+        tries = self._tries.get(client_id)
+        if tries is None:
+            return True
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        trie = tries[0] if address.version == 4 else tries[1]
+        return trie.contains(int(address))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'clients': len(self._tries),
+            'rules': self.rule_count,
+            'invalid_rules': self.invalid_count
+        }
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+后台任务（智能选品、抖店爬取等长耗时操作）
+原来这些操作在 HTTP 请求里同步执行，一个 gunicorn worker / Flask 线程被占用数分钟。
+改为：POST /api/jobs 提交后立即返回任务ID，由后台线程池执行；客户端轮询 GET /api/jobs/<id>
+查看进度和已产出的部分结果，DELETE 取消。
+
+- 任务和结果持久化在 SQLite（jobs / job_results），进程重启后未完成的任务重新排队
+- 多进程部署时各进程从 jobs 表抢占排队中的任务（UPDATE ... WHERE status='queued'）
+- 依赖进程内状态的任务（如绑定了浏览器会话的抖店爬取）注册为 restartable=False：
+  只由提交它的进程执行，该进程退出后标记为失败（interrupted）而不是重新排队
+- 运行中的任务定时写心跳，心跳超时（进程崩溃）的任务重新排队或标记失败
+- 结束的任务保留 ttl 秒后清理，期间客户端可随时重连取结果，无需重新提交
+"""
+
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import db
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+JOB_COLUMNS = ('id', 'client_id', 'kind', 'status', 'progress', 'result_count', 'error', 'error_type',
+               'cancel_requested', 'attempts', 'created_at', 'started_at', 'finished_at', 'expires_at')
+
+
+class JobCancelled(Exception):
+    """任务被取消（由 JobContext.check 抛出）"""
+
+
+class JobError(Exception):
+    """任务按预期失败（参数错误、会话过期等），error_type 原样返回给客户端"""
+
+    def __init__(self, message: str, error_type: str = 'unknown'):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class _Handler(NamedTuple):
+    func: Callable[['JobContext', Dict[str, Any]], None]
+    restartable: bool
+
+
+class JobContext:
+    """传给任务函数：上报进度 / 产出结果 / 检查是否被取消"""
+
+    CANCEL_CHECK_INTERVAL = 1.0  # 跨进程取消标记的检查间隔（秒）
+
+    def __init__(self, manager: 'JobManager', job_id: str, client_id: str):
+        self.manager = manager
+        self.job_id = job_id
+        self.client_id = client_id
+        self.cancel_event = threading.Event()
+        self._seq = 0
+        self._last_check = 0.0
+
+    def check(self) -> None:
+        """已被取消时抛出 JobCancelled；任务函数在耗时步骤之间调用"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        now = time.monotonic()
+        if now - self._last_check >= self.CANCEL_CHECK_INTERVAL:
+            self._last_check = now
+            row = self.manager._conn().execute('SELECT cancel_requested FROM jobs WHERE id=?',
+                                               (self.job_id,)).fetchone()
+            if row is None or row[0]:
+                self.cancel_event.set()
+                raise JobCancelled()
+
+    def progress(self, done: float, total: Optional[float] = None) -> None:
+        """上报进度（done/total 或 0~1 的小数），同时刷新心跳"""
+        self.check()
+        value = done / total if total else done
+        with db.transaction_on(self.manager._conn()) as c:
+            c.execute('UPDATE jobs SET progress=?, heartbeat_at=? WHERE id=?',
+                      (round(min(max(value, 0.0), 1.0), 4), int(time.time()), self.job_id))
+
+    def results(self, items: Iterable[Dict[str, Any]]) -> None:
+        """追加部分结果，客户端轮询时即可取到"""
+        self.check()
+        rows = []
+        for item in items:
+            self._seq += 1
+            rows.append((self.job_id, self._seq, json.dumps(item, ensure_ascii=False)))
+        if not rows:
+            return
+        with db.transaction_on(self.manager._conn()) as c:
+            c.executemany('INSERT INTO job_results (job_id, seq, data) VALUES (?, ?, ?)', rows)
+            c.execute('UPDATE jobs SET result_count=?, heartbeat_at=? WHERE id=?',
+                      (self._seq, int(time.time()), self.job_id))
+
+    def result(self, item: Dict[str, Any]) -> None:
+        self.results([item])
+
+
+def _register_shutdown(func: Callable[[], None]) -> None:
+    """
+    进程退出时调用 func。concurrent.futures 在 threading 的退出钩子里等待线程池线程结束，这一步早于 atexit，
+    线程池里还有任务在跑时进程就卡在这里，atexit 里的 stop() 永远执行不到；
+    所以注册到同一处（后注册的先执行），先取消、交还任务，再等待线程结束
+    """
+    register = getattr(threading, '_register_atexit', None)  # CPython 3.9+
+    if register is None:
+        atexit.register(func)
+    else:
+        register(func)
+
+
+class JobManager:
+    """任务调度器；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, db_path: str, workers: int = 2, ttl: int = 86400, stale_after: int = 90,
+                 poll_interval: float = 2.0, max_attempts: int = 3, max_active_per_client: int = 3):
+        self.db_path = db_path
+        self.workers = workers
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_active_per_client = max_active_per_client
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._handlers: Dict[str, _Handler] = {}
+        self._running: Dict[str, JobContext] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._shutdown_registered = False
+        self.counters = {'submitted': 0, SUCCEEDED: 0, FAILED: 0, CANCELLED: 0, 'recovered': 0, 'interrupted': 0}
+
+    @staticmethod
+    def init_tables(c) -> None:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                client_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL DEFAULT 0,
+                result_count INTEGER DEFAULT 0,
+                error TEXT,
+                error_type TEXT,
+                cancel_requested INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                affinity TEXT,              -- 非空时只能由该进程执行
+                owner TEXT,                 -- 正在执行的进程
+                heartbeat_at INTEGER,
+                created_at INTEGER NOT NULL,
+                started_at INTEGER,
+                finished_at INTEGER,
+                expires_at INTEGER
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS job_results (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            ) WITHOUT ROWID
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_client_created ON jobs(client_id, created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_affinity ON jobs(affinity)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs(expires_at)')
+
+    def _conn(self):
+        """任务系统自己的线程内连接，不并入请求线程上未提交的事务"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = db.connect(self.db_path)
+        return conn
+
+    def register(self, kind: str, func: Callable[[JobContext, Dict[str, Any]], None],
+                 restartable: bool = True) -> None:
+        """注册任务类型：func(ctx, params)，通过 ctx.results()/ctx.progress() 产出结果和进度"""
+        self._handlers[kind] = _Handler(func, restartable)
+
+    @property
+    def kinds(self) -> Tuple[str, ...]:
+        return tuple(self._handlers)
+
+    # ---------- 接口调用 ----------
+
+    def submit(self, client_id: str, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """提交任务，返回任务信息；类型未知或该客户端未完成的任务过多时抛出 JobError"""
+        handler = self._handlers.get(kind)
+        if handler is None:
+            raise JobError(f"未知的任务类型: {kind}（可选 {', '.join(self._handlers)}）", 'invalid')
+        job_id = uuid.uuid4().hex
+        now = int(time.time())
+        with db.transaction_on(self._conn()) as c:
+            c.execute('SELECT COUNT(*) FROM jobs WHERE client_id=? AND status IN (?, ?)', (client_id, QUEUED, RUNNING))
+            if c.fetchone()[0] >= self.max_active_per_client:
+                raise JobError(f'未完成的任务已达上限（{self.max_active_per_client} 个），请等待或取消后再提交', 'too_many_jobs')
+            c.execute('''INSERT INTO jobs (id, client_id, kind, params, status, affinity, heartbeat_at, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                      (job_id, client_id, kind, json.dumps(params, ensure_ascii=False), QUEUED,
+                       None if handler.restartable else self.owner, now, now))
+        with self._lock:
+            self.counters['submitted'] += 1
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id: str, client_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """任务信息；传 client_id 时只返回该客户端的任务，已过期的任务视为不存在"""
+        row = self._conn().execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        if client_id is not None and job['client_id'] != client_id:
+            return None
+        if job['expires_at'] is not None and job['expires_at'] <= int(time.time()):
+            return None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        job['done'] = job['status'] in FINISHED
+        return job
+
+    def list_jobs(self, client_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """客户端最近的任务（用于重连后找回任务ID）"""
+        c = self._conn().execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE client_id=? "
+                                 f"AND (expires_at IS NULL OR expires_at > ?) ORDER BY created_at DESC LIMIT ?",
+                                 (client_id, int(time.time()), limit))
+        return [dict(zip(JOB_COLUMNS, row), done=row[3] in FINISHED) for row in c.fetchall()]
+
+    def results(self, job_id: str, after: int = 0, limit: int = 500) -> Tuple[List[Dict[str, Any]], int]:
+        """seq > after 的结果，返回 (结果列表, 最后一条的 seq)；客户端下次轮询带上 after 只取增量"""
+        rows = self._conn().execute('SELECT seq, data FROM job_results WHERE job_id=? AND seq > ? ORDER BY seq LIMIT ?',
+                                    (job_id, after, limit)).fetchall()
+        return [json.loads(data) for _, data in rows], (rows[-1][0] if rows else after)
+
+    def cancel(self, job_id: str, client_id: Optional[str] = None) -> Optional[str]:
+        """
+        取消任务，返回取消后的状态（任务不存在返回 None）
+        排队中的任务直接取消；运行中的任务打上取消标记，由任务在下一次 check() 时退出，返回 'cancelling'
+        """
+        job = self.get(job_id, client_id)
+        if job is None:
+            return None
+        if job['done']:
+            return job['status']
+        now = int(time.time())
+        with db.transaction_on(self._conn()) as c:
+            c.execute('''UPDATE jobs SET status=?, cancel_requested=1, finished_at=?, expires_at=?
+                         WHERE id=? AND status=?''', (CANCELLED, now, now + self.ttl, job_id, QUEUED))
+            if c.rowcount:
+                with self._lock:
+                    self.counters[CANCELLED] += 1
+                return CANCELLED
+            c.execute('UPDATE jobs SET cancel_requested=1 WHERE id=?', (job_id,))
+        with self._lock:
+            ctx = self._running.get(job_id)
+        if ctx is not None:
+            ctx.cancel_event.set()
+        return 'cancelling'
+
+    # ---------- 调度 ----------
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._thread = threading.Thread(target=self._loop, name='job-dispatcher', daemon=True)
+        self._thread.start()
+        if not self._shutdown_registered:
+            _register_shutdown(self.stop)  # 退出时交还未完成的任务
+            self._shutdown_registered = True
+
+    def stop(self, timeout: float = 5) -> None:
+        """
+        停止调度；仍在运行的任务交还：可重跑的重新排队，其余标记为中断
+        进程退出时自动调用（start() 中注册），重复调用无副作用
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+        with self._lock:
+            running = list(self._running.values())
+        for ctx in running:
+            ctx.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            self._release(owner=self.owner)
+        except Exception as e:
+            logger.warning(f"⚠️ 交还运行中的任务失败: {e}")
+
+    def _loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self._heartbeat()
+                self._release(stale_before=int(time.time()) - self.stale_after)
+                self._dispatch()
+            except Exception as e:
+                logger.error(f"❌ 任务调度异常: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _heartbeat(self) -> None:
+        now = int(time.time())
+        with db.transaction_on(self._conn()) as c:
+            c.execute('UPDATE jobs SET heartbeat_at=? WHERE owner=? AND status=?', (now, self.owner, RUNNING))
+            c.execute('UPDATE jobs SET heartbeat_at=? WHERE affinity=? AND status=?', (now, self.owner, QUEUED))
+
+    def _release(self, owner: Optional[str] = None, stale_before: Optional[int] = None) -> None:
+        """
+        交还任务：owner 指定时为本进程退出，stale_before 指定时为心跳超时（其他进程已崩溃）
+        可重跑且未超过重试次数的重新排队，否则标记为失败
+        """
+        now = int(time.time())
+        with db.transaction_on(self._conn()) as c:
+            if owner is not None:
+                c.execute('SELECT id, kind, attempts, affinity FROM jobs WHERE owner=? AND status=?', (owner, RUNNING))
+                rows = c.fetchall()
+                c.execute('SELECT id, kind, attempts, affinity FROM jobs WHERE affinity=? AND status=?', (owner, QUEUED))
+                rows += c.fetchall()
+            else:
+                c.execute('''SELECT id, kind, attempts, affinity FROM jobs
+                             WHERE status=? AND heartbeat_at < ?''', (RUNNING, stale_before))
+                rows = c.fetchall()
+                c.execute('''SELECT id, kind, attempts, affinity FROM jobs
+                             WHERE status=? AND affinity IS NOT NULL AND heartbeat_at < ?''', (QUEUED, stale_before))
+                rows += c.fetchall()
+            for job_id, kind, attempts, affinity in rows:
+                handler = self._handlers.get(kind)
+                if affinity is None and handler is not None and handler.restartable and attempts < self.max_attempts:
+                    c.execute('''UPDATE jobs SET status=?, owner=NULL, heartbeat_at=?, progress=0
+                                 WHERE id=? AND status=?''', (QUEUED, now, job_id, RUNNING))
+                    key = 'recovered'
+                else:
+                    c.execute('''UPDATE jobs SET status=?, error=?, error_type=?, finished_at=?, expires_at=?
+                                 WHERE id=?''', (FAILED, '服务重启，任务已中断，请重新提交', 'interrupted',
+                                                 now, now + self.ttl, job_id))
+                    key = 'interrupted'
+                with self._lock:
+                    self.counters[key] += 1
+                logger.warning(f"⚠️ 任务 {job_id} ({kind}) {'重新排队' if key == 'recovered' else '已中断'}")
+
+    def _dispatch(self) -> None:
+        """按提交顺序抢占排队中的任务，直到线程池占满"""
+        with self._lock:
+            free = self.workers - len(self._running)
+        if free <= 0 or self._stopping.is_set():
+            return
+        kinds = self.kinds
+        if not kinds:
+            return
+        conn = self._conn()
+        placeholders = ', '.join('?' * len(kinds))
+        rows = conn.execute(f'''SELECT id, client_id, kind, params, attempts FROM jobs
+                                WHERE status=? AND kind IN ({placeholders}) AND (affinity IS NULL OR affinity=?)
+                                ORDER BY created_at LIMIT ?''', (QUEUED,) + kinds + (self.owner, free)).fetchall()
+        now = int(time.time())
+        for job_id, client_id, kind, params, attempts in rows:
+            with db.transaction_on(conn) as c:
+                c.execute('''UPDATE jobs SET status=?, owner=?, attempts=?, started_at=?, heartbeat_at=?
+                             WHERE id=? AND status=?''', (RUNNING, self.owner, attempts + 1, now, now, job_id, QUEUED))
+                claimed = c.rowcount == 1
+                if claimed and attempts:
+                    # 重跑：丢弃上一次执行产出的部分结果
+                    c.execute('DELETE FROM job_results WHERE job_id=?', (job_id,))
+                    c.execute('UPDATE jobs SET result_count=0 WHERE id=?', (job_id,))
+            if not claimed:
+                continue  # 被其他进程抢走
+            ctx = JobContext(self, job_id, client_id)
+            with self._lock:
+                self._running[job_id] = ctx
+            self._executor.submit(self._run, ctx, kind, json.loads(params))
+
+    def _run(self, ctx: JobContext, kind: str, params: Dict[str, Any]) -> None:
+        status, error, error_type = SUCCEEDED, None, None
+        try:
+            self._handlers[kind].func(ctx, params)
+        except JobCancelled:
+            status = CANCELLED
+        except JobError as e:
+            status, error, error_type = FAILED, str(e), e.error_type
+        except Exception as e:
+            logger.error(f"❌ 任务执行异常 {ctx.job_id} ({kind}): {e}", exc_info=True)
+            status, error, error_type = FAILED, f'系统错误：{e}', 'unknown'
+        finally:
+            if not self._stopping.is_set():
+                self._finish(ctx.job_id, status, error, error_type)
+            with self._lock:
+                self._running.pop(ctx.job_id, None)
+            self._wakeup.set()
+
+    def _finish(self, job_id: str, status: str, error: Optional[str], error_type: Optional[str]) -> None:
+        now = int(time.time())
+        with db.transaction_on(self._conn()) as c:
+            c.execute('''UPDATE jobs SET status=?, error=?, error_type=?, progress=CASE WHEN ?=? THEN 1 ELSE progress END,
+                         finished_at=?, expires_at=? WHERE id=? AND owner=?''',
+                      (status, error, error_type, status, SUCCEEDED, now, now + self.ttl, job_id, self.owner))
+        with self._lock:
+            self.counters[status] += 1
+
+    def purge_expired(self) -> int:
+        """删除已过期的任务及其结果（定时任务调用），返回删除的任务数"""
+        now = int(time.time())
+        conn = db.connect(self.db_path)
+        try:
+            with db.transaction_on(conn) as c:
+                c.execute('DELETE FROM job_results WHERE job_id IN (SELECT id FROM jobs WHERE expires_at <= ?)', (now,))
+                c.execute('DELETE FROM jobs WHERE expires_at <= ?', (now,))
+                return c.rowcount
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        counts = dict(self._conn().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'running_here': len(self._running),
+                'by_status': counts,
+                'ttl_seconds': self.ttl,
+                **self.counters
+            }
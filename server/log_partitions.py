@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+日志按天分区
+request_logs / event_logs 不再是单张表，而是按 UTC 日期拆成分区表
+（request_logs_p20251024 ...），再用同名视图 UNION ALL 拼起来，读取方的 SQL 不用改。
+
+- 写入：log_writer 按 created_at 路由到当天分区，分区不存在时自动创建
+- 清理：过期数据直接 DROP 整个分区，不再 DELETE 全表扫描
+- 主键：每个分区的自增ID从 日期*10^8 起步，所有分区之间ID唯一且随时间递增
+- 检索：每个分区带一张 FTS5 索引（{分区}_fts，见 search_index.py），随分区创建和删除
+"""
+
+import logging
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import db
+import search_index
+
+logger = logging.getLogger(__name__)
+
+SCHEMAS = {
+    'request_logs': '''
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT,
+            ip_address TEXT,
+            request_type TEXT,
+            success INTEGER,
+            error_msg TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ''',
+    'event_logs': '''
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT,
+            hardware_id TEXT,
+            ip_address TEXT,
+            action TEXT,
+            detail_json TEXT,
+            success INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ''',
+}
+
+COLUMNS = {
+    'request_logs': ('id', 'client_id', 'ip_address', 'request_type', 'success', 'error_msg', 'created_at'),
+    'event_logs': ('id', 'client_id', 'hardware_id', 'ip_address', 'action', 'detail_json', 'success', 'created_at'),
+}
+
+# 各日志保留天数（与原管理后台"删除N天前日志"一致）
+RETENTION_DAYS = {
+    'request_logs': 7,
+    'event_logs': 30,
+}
+
+ID_SPAN = 10 ** 8  # 每个分区可用的ID区间
+
+_known = set()
+_lock = threading.Lock()
+
+
+def partition_name(table: str, day: str) -> str:
+    """'2025-10-24' -> request_logs_p20251024"""
+    return f"{table}_p{day.replace('-', '')}"
+
+
+def partition_day(created_at: Optional[str]) -> str:
+    """created_at（UTC 'YYYY-MM-DD HH:MM:SS'）所属的分区日期"""
+    if created_at and re.match(r'\d{4}-\d{2}-\d{2}', created_at):
+        return created_at[:10]
+    return datetime.utcnow().strftime('%Y-%m-%d')
+
+
+def list_partitions(c, table: str) -> List[Tuple[str, str]]:
+    """返回 [(日期YYYYMMDD, 分区表名), ...]，按日期升序"""
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name GLOB ?",
+              (f'{table}_p[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]',))
+    return sorted((name[-8:], name) for (name,) in c.fetchall())
+
+
+def rebuild_view(c, table: str) -> None:
+    """用全部分区重建同名视图"""
+    parts = [name for _, name in list_partitions(c, table)]
+    c.execute(f'DROP VIEW IF EXISTS {table}')
+    if parts:
+        union = '\n UNION ALL '.join(f'SELECT * FROM {name}' for name in parts)
+    else:
+        # 没有分区时保留一个空视图，保证查询不报错
+        cols = ', '.join(f'NULL AS {col}' for col in COLUMNS[table])
+        union = f'SELECT {cols} WHERE 0'
+    c.execute(f'CREATE VIEW {table} AS {union}')
+
+
+def ensure_partition(c, table: str, day: str) -> str:
+    """确保某天的分区存在（需在写事务中调用），返回分区表名"""
+    name = partition_name(table, day)
+    if name in _known:
+        return name
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    if c.fetchone() is None:
+        # 调用方持有写锁时检查和创建之间不会有其他进程插入；IF NOT EXISTS 兜底，已存在时不报错
+        c.execute(f'CREATE TABLE IF NOT EXISTS {name} ({SCHEMAS[table]})')
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_client_time ON {name}(client_id, created_at)')
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_time ON {name}(created_at)')
+        search_index.ensure_log_index(c, table, name)
+        # sqlite_sequence 的 name 列没有唯一约束，INSERT OR IGNORE 不起作用，用 NOT EXISTS 防止重复插入
+        c.execute('''INSERT INTO sqlite_sequence (name, seq)
+                     SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name=?)''',
+                  (name, int(day.replace('-', '')) * ID_SPAN, name))
+        rebuild_view(c, table)
+        logger.info(f"🗂️ 创建日志分区 {name}")
+    with _lock:
+        _known.add(name)
+    return name
+
+
+def _migrate_legacy(c, table: str) -> None:
+    """把旧的单表数据按天搬进分区，然后删除旧表"""
+    c.execute("SELECT type FROM sqlite_master WHERE name=?", (table,))
+    row = c.fetchone()
+    if not row or row[0] != 'table':
+        return
+    legacy = f'{table}_legacy'
+    c.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+    cols = ', '.join(COLUMNS[table])
+    c.execute(f"SELECT DISTINCT substr(COALESCE(created_at, CURRENT_TIMESTAMP), 1, 10) FROM {legacy}")
+    days = [d for (d,) in c.fetchall()]
+    for day in days:
+        name = ensure_partition(c, table, partition_day(day))
+        c.execute(f'''INSERT INTO {name} ({cols})
+                      SELECT {cols} FROM {legacy}
+                      WHERE substr(COALESCE(created_at, CURRENT_TIMESTAMP), 1, 10) = ?''', (day,))
+    c.execute(f'DROP TABLE {legacy}')
+    logger.info(f"🗂️ {table} 已迁移为按天分区（{len(days)} 个分区）")
+
+
+def init_partitions(c) -> None:
+    """
+    初始化：迁移旧表、确保当天分区和各分区的检索索引、重建视图
+    在 init_db 中、BEGIN IMMEDIATE 写事务内调用（多个 worker 同时启动时串行执行）
+    """
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    for table in SCHEMAS:
+        _migrate_legacy(c, table)
+        ensure_partition(c, table, today)
+        for _, name in list_partitions(c, table):
+            search_index.ensure_log_index(c, table, name)
+        rebuild_view(c, table)
+
+
+def drop_before(c, table: str, keep_days: int) -> List[str]:
+    """删除早于 keep_days 天的分区（需在写事务中调用），返回被删除的分区名"""
+    cutoff = (datetime.utcnow() - timedelta(days=keep_days)).strftime('%Y%m%d')
+    dropped = []
+    for day, name in list_partitions(c, table):
+        if day < cutoff:
+            search_index.drop_log_index(c, name)
+            c.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    if dropped:
+        with _lock:
+            _known.difference_update(dropped)
+        rebuild_view(c, table)
+    return dropped
+
+
+def forget() -> None:
+    """清空已知分区缓存（写入失败时调用，下次写入重新检查分区是否存在）"""
+    with _lock:
+        _known.clear()
+
+
+def apply_retention(db_path: str, retention: Optional[Dict[str, int]] = None) -> Dict[str, List[str]]:
+    """
+    按保留天数删除过期分区，然后增量回收空间并更新统计信息（定时任务调用）
+
+    Returns:
+        {表名: [被删除的分区名, ...]}
+    """
+    retention = retention or RETENTION_DAYS
+    conn = db.connect(db_path)
+    try:
+        with db.transaction_on(conn) as c:
+            result = {table: drop_before(c, table, days) for table, days in retention.items()}
+        if any(result.values()):
+            conn.execute('PRAGMA incremental_vacuum').fetchall()
+            conn.execute('ANALYZE')
+            conn.commit()
+        return result
+    finally:
+        conn.close()
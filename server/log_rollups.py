@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+日志汇总表（按小时 / 按天）
+log_writer 每写入一批日志，就在同一个事务里把这批日志按
+（时间桶, client_id, 请求类型/行为, 是否成功）聚合后 UPSERT 进汇总表，
+管理后台的统计页和统计接口只读汇总表，不再扫描日志分区。
+
+- request_rollup_hourly / request_rollup_daily：request_logs 按 request_type 汇总
+- event_rollup_hourly / event_rollup_daily：event_logs 按 action 汇总
+- 日志分区过期删除后，汇总数据仍然保留（小时表另按 HOURLY_RETENTION_DAYS 清理）
+"""
+
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# 日志表 -> (汇总表前缀, 维度列, 维度列在日志行中的下标, success 在日志行中的下标)
+# 日志行布局与 log_writer.INSERT_SQL 一致，created_at 为最后一列
+SOURCES = {
+    'request_logs': ('request_rollup', 'request_type', 2, 3),
+    'event_logs': ('event_rollup', 'action', 3, 5),
+}
+
+# 粒度 -> (汇总表后缀, created_at 截取长度, 桶后缀)
+GRANULARITIES = {
+    'hour': ('hourly', 13, ':00:00'),
+    'day': ('daily', 10, ''),
+}
+
+KINDS = {
+    'requests': 'request_logs',
+    'events': 'event_logs',
+}
+
+HOURLY_RETENTION_DAYS = 90  # 小时表保留天数；天表永久保留
+
+
+def rollup_table(table: str, granularity: str) -> str:
+    return f"{SOURCES[table][0]}_{GRANULARITIES[granularity][0]}"
+
+
+def bucket_of(created_at: Optional[str], granularity: str) -> str:
+    """created_at（UTC 'YYYY-MM-DD HH:MM:SS'）所属的时间桶"""
+    _, length, suffix = GRANULARITIES[granularity]
+    value = created_at or datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    return value[:length] + suffix
+
+
+def init_rollups(c) -> None:
+    """建汇总表；首次创建时从现有日志回填（在 init_db 中、日志分区初始化之后调用）"""
+    for table, (_, dim, _, _) in SOURCES.items():
+        for granularity, (_, length, suffix) in GRANULARITIES.items():
+            name = rollup_table(table, granularity)
+            c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+            if c.fetchone() is not None:
+                continue
+            c.execute(f'''
+                CREATE TABLE IF NOT EXISTS {name} (
+                    bucket TEXT NOT NULL,
+                    client_id TEXT NOT NULL DEFAULT '',
+                    {dim} TEXT NOT NULL DEFAULT '',
+                    success INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, client_id, {dim}, success)
+                ) WITHOUT ROWID
+            ''')
+            c.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_client ON {name}(client_id, bucket)')
+            c.execute(f'''
+                INSERT INTO {name} (bucket, client_id, {dim}, success, count)
+                SELECT substr(COALESCE(created_at, CURRENT_TIMESTAMP), 1, {length}) || '{suffix}',
+                       COALESCE(client_id, ''), COALESCE({dim}, ''),
+                       CASE WHEN success THEN 1 ELSE 0 END, COUNT(*)
+                FROM {table}
+                GROUP BY 1, 2, 3, 4
+            ''')
+            logger.info(f"📊 创建日志汇总表 {name}（回填 {c.rowcount} 行）")
+
+
+def apply_batch(c, batch: Iterable[Tuple[str, tuple]]) -> None:
+    """把一批日志行累加进汇总表（需在写入日志的同一事务中调用）"""
+    counts: Dict[Tuple[str, str], Counter] = {}
+    for table, row in batch:
+        source = SOURCES.get(table)
+        if source is None:
+            continue
+        _, _, dim_index, success_index = source
+        key = (row[0] or '', row[dim_index] or '', 1 if row[success_index] else 0)
+        for granularity in GRANULARITIES:
+            counter = counts.setdefault((table, granularity), Counter())
+            counter[(bucket_of(row[-1], granularity),) + key] += 1
+
+    for (table, granularity), counter in counts.items():
+        dim = SOURCES[table][1]
+        c.executemany(f'''
+            INSERT INTO {rollup_table(table, granularity)} (bucket, client_id, {dim}, success, count)
+            VALUES (?,?,?,?,?)
+            ON CONFLICT (bucket, client_id, {dim}, success) DO UPDATE SET count = count + excluded.count
+        ''', [key + (count,) for key, count in counter.items()])
+
+
+def query(c, kind: str, granularity: str = 'day', since: Optional[str] = None,
+          until: Optional[str] = None, client_id: Optional[str] = None,
+          dim_value: Optional[str] = None, group_by: Sequence[str] = ('bucket',),
+          limit: int = 1000) -> List[Dict[str, Any]]:
+    """
+    读取汇总数据
+
+    Args:
+        kind: requests / events
+        granularity: hour / day
+        since, until: 时间桶范围（含 since，不含 until），格式同 bucket
+        client_id, dim_value: 精确过滤
+        group_by: bucket / client_id / type 的任意组合，type 即请求类型或行为
+
+    Returns:
+        [{分组列..., total, succeeded, failed}, ...]；按 bucket 分组时按时间升序，否则按 total 降序
+    """
+    table = KINDS[kind]
+    dim = SOURCES[table][1]
+    columns = {'bucket': 'bucket', 'client_id': 'client_id', 'type': dim}
+    groups = [g for g in group_by if g in columns]
+
+    select = [columns[g] for g in groups] + ['SUM(count)', 'SUM(CASE WHEN success THEN count ELSE 0 END)']
+    sql = f'SELECT {", ".join(select)} FROM {rollup_table(table, granularity)} WHERE 1=1'
+    params: List[Any] = []
+    if since:
+        sql += ' AND bucket >= ?'
+        params.append(since)
+    if until:
+        sql += ' AND bucket < ?'
+        params.append(until)
+    if client_id:
+        sql += ' AND client_id = ?'
+        params.append(client_id)
+    if dim_value:
+        sql += f' AND {dim} = ?'
+        params.append(dim_value)
+    if groups:
+        sql += ' GROUP BY ' + ', '.join(columns[g] for g in groups)
+    sql += ' ORDER BY bucket' if 'bucket' in groups else ' ORDER BY SUM(count) DESC'
+    sql += ' LIMIT ?'
+    params.append(limit)
+
+    c.execute(sql, tuple(params))
+    result = []
+    for row in c.fetchall():
+        item = dict(zip(groups, row[:len(groups)]))
+        total, succeeded = row[len(groups)] or 0, row[len(groups) + 1] or 0
+        item.update(total=total, succeeded=succeeded, failed=total - succeeded)
+        result.append(item)
+    return result
+
+
+def since_for(granularity: str, periods: int) -> str:
+    """最近 periods 个小时/天的起始桶"""
+    now = datetime.utcnow()
+    if granularity == 'hour':
+        return bucket_of((now - timedelta(hours=periods - 1)).strftime('%Y-%m-%d %H:%M:%S'), 'hour')
+    return (now - timedelta(days=periods - 1)).strftime('%Y-%m-%d')
+
+
+def apply_retention(db_path: str, keep_days: int = HOURLY_RETENTION_DAYS) -> int:
+    """删除过期的小时汇总（定时任务调用），返回删除的行数"""
+    cutoff = (datetime.utcnow() - timedelta(days=keep_days)).strftime('%Y-%m-%d')
+    deleted = 0
+    conn = db.connect(db_path)
+    try:
+        with db.transaction_on(conn) as c:
+            for table in SOURCES:
+                c.execute(f'DELETE FROM {rollup_table(table, "hour")} WHERE bucket < ?', (cutoff,))
+                deleted += c.rowcount
+        return deleted
+    finally:
+        conn.close()
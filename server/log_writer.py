@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+异步批量日志写入
+log_request / 埋点事件不再在请求内逐条 INSERT + 提交，
+而是放入有界队列，由后台线程按批 executemany 写入 request_logs / event_logs
+（按 created_at 路由到对应的日分区，见 log_partitions.py），
+同一事务内累加小时/天汇总表（见 log_rollups.py）。
+
+队列满时的处理策略（LOG_QUEUE_POLICY）：
+- drop:  直接丢弃并计数
+- block: 阻塞请求线程直到有空位（最多 block_timeout 秒，超时后丢弃）
+- spill: 追加写入本地 JSONL 溢出文件，写入线程空闲时回放入库（默认）
+         每个进程写自己的文件（log_spill.<pid>.jsonl），已退出进程留下的文件由其他进程接手回放
+"""
+
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import db
+import log_partitions
+import log_rollups
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('drop', 'block', 'spill')
+
+# {table} 替换为分区表名；created_at 必须是最后一列（用于分区路由）
+INSERT_SQL = {
+    'request_logs': '''INSERT INTO {table} (client_id, ip_address, request_type, success, error_msg, created_at)
+                       VALUES (?,?,?,?,?,?)''',
+    'event_logs': '''INSERT INTO {table} (client_id, hardware_id, ip_address, action, detail_json, success, created_at)
+                     VALUES (?,?,?,?,?,?,?)''',
+}
+
+
+def utc_timestamp() -> str:
+    """与 CURRENT_TIMESTAMP 相同格式的 UTC 时间（入队时取值，保证批量写入不改变日志时间）"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        return True  # Windows 上 os.kill(pid, 0) 会结束进程，不接手其他进程的文件
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # 进程存在但无权发信号
+    return True
+
+
+class LogWriter:
+    """后台批量日志写入线程"""
+
+    def __init__(self, db_path: str, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, policy: str = 'spill',
+                 spill_path: str = 'log_spill.jsonl', block_timeout: float = 2.0):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的队列策略: {policy}（可选 {', '.join(POLICIES)}）")
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.spill_path = spill_path
+        self.block_timeout = block_timeout
+        self._queue: "queue.Queue[Tuple[str, tuple]]" = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    # ---------- 生产者 ----------
+
+    def submit(self, table: str, row: tuple) -> bool:
+        """提交一行日志；返回是否进入队列或溢出文件"""
+        item = (table, row)
+        try:
+            if self.policy == 'block':
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            if self.policy == 'spill':
+                return self._spill([item])
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+        with self._stats_lock:
+            self.enqueued += 1
+        return True
+
+    def write_now(self, table: str, rows: List[tuple]) -> bool:
+        """同步写入一批日志（单个事务），供批量上报接口使用"""
+        if not rows:
+            return True
+        return self._flush([(table, row) for row in rows])
+
+    def _own_spill_path(self) -> str:
+        """本进程的溢出文件：log_spill.jsonl -> log_spill.<pid>.jsonl（fork 后按子进程号）"""
+        root, ext = os.path.splitext(self.spill_path)
+        return f'{root}.{os.getpid()}{ext}'
+
+    def _spill(self, items: List[Tuple[str, tuple]]) -> bool:
+        try:
+            with self._spill_lock:
+                with open(self._own_spill_path(), 'a', encoding='utf-8') as f:
+                    for table, row in items:
+                        f.write(json.dumps([table, list(row)], ensure_ascii=False) + '\n')
+            with self._stats_lock:
+                self.spilled += len(items)
+            return True
+        except Exception as e:
+            logger.error(f"❌ 日志溢出文件写入失败: {e}")
+            with self._stats_lock:
+                self.dropped += len(items)
+            return False
+
+    # ---------- 写入线程 ----------
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """停止写入线程并写完队列中剩余日志（用于进程退出）"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._drain()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                batch = self._collect()
+                if batch:
+                    self._flush(batch)
+                else:
+                    self._replay_spill()
+            except Exception as e:
+                # 单次异常不能让写入线程退出，否则之后的日志都只进队列不入库
+                logger.error(f"❌ 日志写入线程异常: {e}", exc_info=True)
+                self._stop.wait(self.flush_interval)
+
+    def _collect(self) -> List[Tuple[str, tuple]]:
+        """等待第一条日志，再在 flush_interval 内凑满一批"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self) -> None:
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                break
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[str, tuple]]) -> bool:
+        """按表和日分区分组，在一个事务内 executemany 写入并更新汇总表"""
+        grouped: Dict[Tuple[str, str], List[tuple]] = {}
+        for table, row in batch:
+            day = log_partitions.partition_day(row[-1])
+            grouped.setdefault((table, day), []).append(row)
+
+        started = time.perf_counter()
+        try:
+            with db.transaction(self.db_path) as c:
+                for (table, day), rows in grouped.items():
+                    partition = log_partitions.ensure_partition(c, table, day)
+                    c.executemany(INSERT_SQL[table].format(table=partition), rows)
+                log_rollups.apply_batch(c, batch)
+        except Exception as e:
+            logger.error(f"❌ 批量写入日志失败（{len(batch)}条）: {e}")
+            log_partitions.forget()
+            with self._stats_lock:
+                self.failed += len(batch)
+            # 写库失败时尽量落到溢出文件，等待下次回放
+            if self.policy == 'spill':
+                return self._spill(batch)
+            return False
+
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self.written += len(batch)
+            self.flush_count += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self._total_flush_ms += elapsed
+        return True
+
+    def _pending_spills(self) -> List[str]:
+        """
+        待回放的溢出文件：本进程的，加上已退出进程留下的（含旧版不带进程号的 log_spill.jsonl）
+        以及已退出进程认领后没回放完的 *.<pid>.replay 文件
+        仍在运行的其他进程的文件由它自己回放，避免读到写了一半的行
+        """
+        root, ext = os.path.splitext(self.spill_path)
+        paths = []
+        for path in glob.glob(glob.escape(root) + '.*' + ext) + [self.spill_path]:
+            pid = path[len(root) + 1:-len(ext) or None] if path != self.spill_path else ''
+            if pid and not pid.isdigit():
+                continue
+            if pid and int(pid) != os.getpid() and _pid_alive(int(pid)):
+                continue
+            if os.path.exists(path):
+                paths.append(path)
+        for path in glob.glob(glob.escape(root) + '*' + ext + '.*.replay'):
+            pid = path[:-len('.replay')].rsplit('.', 1)[1]
+            if pid.isdigit() and (int(pid) == os.getpid() or not _pid_alive(int(pid))):
+                paths.append(path)
+        return paths
+
+    def _replay_spill(self) -> None:
+        """
+        把溢出文件中的日志回放入库
+        先原子地改名为 <文件>.<pid>.replay 认领，全部写完后才删除；进程中途退出时留下的 .replay 文件
+        由下一个进程重新认领回放（至少一次，可能重复写入已提交的批次，但不会丢日志）
+        """
+        for pending in self._pending_spills():
+            spill_path = pending.rsplit('.', 2)[0] if pending.endswith('.replay') else pending
+            replay_path = f'{spill_path}.{os.getpid()}.replay'
+            with self._spill_lock:
+                try:
+                    os.replace(pending, replay_path)  # 原子地认领；其他进程先认领时文件已不存在
+                except FileNotFoundError:
+                    continue
+            batch: List[Tuple[str, tuple]] = []
+            with open(replay_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        table, row = json.loads(line)
+                    except ValueError:
+                        continue
+                    if table in INSERT_SQL:
+                        batch.append((table, tuple(row)))
+            if spill_path == self._own_spill_path():
+                with self._stats_lock:
+                    self.spilled -= min(self.spilled, len(batch))
+            # 写库失败的批次由 _flush 重新落到本进程的溢出文件，这里写完即可删除
+            for i in range(0, len(batch), self.batch_size):
+                self._flush(batch[i:i + self.batch_size])
+            os.remove(replay_path)
+            logger.info(f"📥 已回放溢出日志 {len(batch)} 条（{os.path.basename(pending)}）")
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度、写入延迟等指标"""
+        return {
+            'policy': self.policy,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'spilled_pending': self.spilled,
+            'failed': self.failed,
+            'flush_count': self.flush_count,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._total_flush_ms / self.flush_count, 2) if self.flush_count else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 2)
+        }
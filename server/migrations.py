@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+数据库版本化迁移（PRAGMA user_version）
+init_db 建完基础表后调用 migrate()，按版本号顺序执行尚未执行的迁移，每个迁移一个事务。
+
+新增迁移：在 MIGRATIONS 末尾追加 (版本号, 说明, 函数)，版本号递增，已发布的迁移不要修改。
+"""
+
+import logging
+from typing import Callable, List, Tuple
+
+import db
+from catalog import Catalog
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(c, table: str) -> set:
+    c.execute(f'PRAGMA table_info({table})')
+    return {row[1] for row in c.fetchall()}
+
+
+def _add_column(c, table: str, column: str, decl: str) -> None:
+    if column not in _columns(c, table):
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+
+def _epoch_columns(c) -> None:
+    """
+    到期/试用/最后请求时间增加整数时间戳列（Unix 秒），热路径改为整数比较
+
+    原字符串列的时区并不统一，回填时按各自的写入方式换算：
+    - trial_expires_at / expires_at：服务器本地时间（datetime.now()）
+    - last_request_at：北京时间（get_beijing_time()）
+    """
+    _add_column(c, 'client_access', 'trial_expires_epoch', 'INTEGER')
+    _add_column(c, 'authorizations', 'expires_epoch', 'INTEGER')
+    _add_column(c, 'authorizations', 'last_request_epoch', 'INTEGER')
+
+    c.execute('''UPDATE client_access
+                 SET trial_expires_epoch = CAST(strftime('%s', trial_expires_at, 'utc') AS INTEGER)
+                 WHERE trial_expires_at IS NOT NULL AND trial_expires_epoch IS NULL''')
+    c.execute('''UPDATE authorizations
+                 SET expires_epoch = CAST(strftime('%s', expires_at, 'utc') AS INTEGER)
+                 WHERE expires_at IS NOT NULL AND expires_at != '' AND expires_epoch IS NULL''')
+    c.execute('''UPDATE authorizations
+                 SET last_request_epoch = CAST(strftime('%s', last_request_at) AS INTEGER) - 8 * 3600
+                 WHERE last_request_at IS NOT NULL AND last_request_epoch IS NULL''')
+
+    # check_auth：按客户端取仍有效的试用 -> (client_id, trial_expires_epoch) 上的范围查询
+    c.execute('CREATE INDEX IF NOT EXISTS idx_access_client_trial_epoch ON client_access(client_id, trial_expires_epoch)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_auth_expires_epoch ON authorizations(expires_epoch)')
+    c.execute('DROP INDEX IF EXISTS idx_access_trial_expires')
+
+
+def _request_path_indexes(c) -> None:
+    """require_auth / register_client 按 hardware_id、ip_address 查 authorizations（见 test_query_plans.py）"""
+    c.execute('CREATE INDEX IF NOT EXISTS idx_auth_hardware_id ON authorizations(hardware_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_auth_ip_active ON authorizations(ip_address, is_active)')
+
+
+def _catalog_tokens(c) -> None:
+    """catalog_products.tokens 原来存的是整串归一化标题，改为 jieba 分词并重建 FTS 索引（见 catalog.py）"""
+    count = Catalog.retokenize(c)
+    logger.info(f"🔧 重新分词商品目录 {count} 个商品")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, '整数时间戳列 trial_expires_epoch / expires_epoch / last_request_epoch', _epoch_columns),
+    (2, 'authorizations 的 hardware_id / ip_address 索引', _request_path_indexes),
+    (3, '商品目录标题分词 + FTS5 候选索引', _catalog_tokens),
+]
+
+
+def current_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn) -> int:
+    """执行未执行的迁移，返回迁移后的版本号"""
+    version = current_version(conn)
+    for target, description, func in MIGRATIONS:
+        if target <= version:
+            continue
+        with db.transaction_on(conn) as c:
+            done = current_version(conn) >= target  # 同时启动的其他 worker 已在等锁期间执行完
+            if not done:
+                func(c)
+                c.execute(f'PRAGMA user_version = {target}')
+        if not done:
+            logger.info(f"🔧 数据库迁移 v{target}: {description}")
+        version = target
+    return version
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+管理后台游标分页（keyset pagination）
+按 (created_at, id) 倒序翻页：下一页的条件是 (created_at, id) < 上一页最后一行，
+直接沿 created_at 索引（隐含 rowid）定位，不用 OFFSET，翻到多深都只读一页的数据。
+
+日志表是按天分区的视图，这里按分区从新到旧逐个查询，凑满一页即停止，
+不会对 UNION ALL 视图整体排序。
+
+全文检索结果按相关度（FTS5 rank）排序时，游标为 (rank, id)。
+"""
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+import log_partitions
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def clamp_limit(value: Any, default: int = DEFAULT_LIMIT) -> int:
+    try:
+        return min(max(int(value), 1), MAX_LIMIT)
+    except (TypeError, ValueError):
+        return default
+
+
+def encode_cursor(created_at: Optional[str], row_id: int) -> str:
+    """'2025-10-24 10:00:00|123'"""
+    return f"{created_at or ''}|{row_id}"
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, int]]:
+    """解析游标，无效时返回 None（即从第一页开始）"""
+    if not cursor or '|' not in cursor:
+        return None
+    created_at, _, row_id = cursor.rpartition('|')
+    try:
+        return created_at, int(row_id)
+    except ValueError:
+        return None
+
+
+def _page_sql(source: str, columns: Sequence[str], where: str, with_cursor: bool) -> str:
+    sql = f"SELECT {', '.join(columns)} FROM {source} WHERE {where or '1=1'}"
+    if with_cursor:
+        sql += ' AND (created_at, id) < (?, ?)'
+    return sql + ' ORDER BY created_at DESC, id DESC LIMIT ?'
+
+
+def keyset_page(c, source: str, columns: Sequence[str], where: str = '', params: Sequence[Any] = (),
+                cursor: Optional[str] = None, limit: int = DEFAULT_LIMIT) -> Tuple[List[tuple], Optional[str]]:
+    """
+    单表翻页
+
+    Args:
+        columns: 必须包含 id 和 created_at
+        where / params: 过滤条件（不含游标条件）
+
+    Returns:
+        (当前页的行, 下一页游标；没有下一页时为 None)
+    """
+    position = decode_cursor(cursor)
+    args = list(params) + (list(position) if position else []) + [limit + 1]
+    c.execute(_page_sql(source, columns, where, position is not None), tuple(args))
+    rows = c.fetchall()
+    return _finish(rows, columns, limit)
+
+
+def partitioned_page(c, table: str, columns: Sequence[str], where: str = '', params: Sequence[Any] = (),
+                     cursor: Optional[str] = None, limit: int = DEFAULT_LIMIT) -> Tuple[List[tuple], Optional[str]]:
+    """
+    按天分区的日志表翻页：从游标所在的分区开始往旧的分区查，凑满 limit+1 行为止
+    where 中的 {partition} 会替换为当前分区表名（用于关联分区的检索索引）
+    """
+    position = decode_cursor(cursor)
+    cursor_day = position[0][:10].replace('-', '') if position and position[0] else None
+    rows: List[tuple] = []
+    for day, name in reversed(log_partitions.list_partitions(c, table)):
+        if cursor_day and day > cursor_day:
+            continue
+        use_cursor = position is not None and day == cursor_day
+        args = list(params) + (list(position) if use_cursor else []) + [limit + 1 - len(rows)]
+        c.execute(_page_sql(name, columns, where.replace('{partition}', name), use_cursor), tuple(args))
+        rows.extend(c.fetchall())
+        if len(rows) > limit:
+            break
+    return _finish(rows, columns, limit)
+
+
+def ranked_page(c, source: str, columns: Sequence[str], fts_table: str, match: str,
+                where: str = '', params: Sequence[Any] = (), cursor: Optional[str] = None,
+                limit: int = DEFAULT_LIMIT) -> Tuple[List[tuple], Optional[str]]:
+    """按 FTS5 相关度翻页（越相关越靠前），游标为 'rank|id'"""
+    sql = f"SELECT {', '.join('s.' + col for col in columns)}, f.rank " \
+          f"FROM (SELECT rowid AS doc_id, rank FROM {fts_table} WHERE {fts_table} MATCH ?) f " \
+          f"JOIN {source} s ON s.id = f.doc_id WHERE {where or '1=1'}"
+    args: List[Any] = [match] + list(params)
+    position = decode_cursor(cursor)
+    if position:
+        try:
+            args.extend([float(position[0]), position[1]])
+            sql += ' AND (f.rank, s.id) > (?, ?)'
+        except ValueError:
+            pass
+    sql += ' ORDER BY f.rank, s.id LIMIT ?'
+    args.append(limit + 1)
+    c.execute(sql, tuple(args))
+    rows = c.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(repr(rows[-1][-1]), rows[-1][list(columns).index('id')])
+    return [row[:-1] for row in rows], next_cursor
+
+
+def _finish(rows: List[tuple], columns: Sequence[str], limit: int) -> Tuple[List[tuple], Optional[str]]:
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last[list(columns).index('created_at')], last[list(columns).index('id')])
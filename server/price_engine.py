@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+价格对比计算（NumPy 向量化）
+原来对每个 (淘宝商品, 拼多多候选) 逐对计算折扣并格式化成 "35.0%" 字符串，
+排序时再 rstrip('%') 解析回来。这里：
+
+1. 源商品价格 -> 长度 n 的数组；每个源商品的候选价格 -> n×k 矩阵（候选不足 k 个的位置为 NaN）
+2. 一次算出折扣矩阵 (src - cand) / src 和阈值掩码（源价格 <= 0 的行整行无效）
+3. 按数值折扣降序稳定排序（折扣相同时保持输入顺序），只对入选的结果格式化
+"""
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+def price_array(products: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """商品列表的价格数组（与原逻辑一致：缺省为 0，无法转换时抛出 ValueError）"""
+    return np.array([p.get('price', 0) for p in products], dtype=np.float64).reshape(len(products))
+
+
+def candidate_matrix(candidate_lists: Sequence[Sequence[Dict[str, Any]]]) -> np.ndarray:
+    """各源商品的候选价格，按最长的候选列表补齐为 n×k 矩阵，空位为 NaN"""
+    lengths = np.fromiter(map(len, candidate_lists), dtype=np.intp, count=len(candidate_lists))
+    width = int(lengths.max()) if len(lengths) else 0
+    # np.array 的 float64 转换与 float() 一致：数字字符串可转换，无法转换时抛出 ValueError
+    flat = np.array([p.get('price', 0) for candidates in candidate_lists for p in candidates], dtype=np.float64)
+    if len(flat) == len(lengths) * width:
+        return flat.reshape(len(lengths), width)  # 各商品候选数相同（常见情况），无需补齐
+    matrix = np.full((len(lengths), width), np.nan)
+    # 布尔掩码按行优先顺序赋值，与 flat 的拼接顺序一致
+    matrix[np.arange(width) < lengths[:, None]] = flat
+    return matrix
+
+
+def discount_matrix(source: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """折扣率矩阵 (src - cand) / src；源价格 <= 0 的行为 NaN"""
+    column = source[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        discounts = (column - candidates) / column
+    discounts[~(source > 0)] = np.nan
+    return discounts
+
+
+def select(discounts: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """阈值掩码：返回达到阈值的 (源商品下标, 候选下标, 折扣率)，按输入顺序（行优先）"""
+    rows, cols = np.nonzero(discounts >= threshold)  # NaN 比较为 False
+    return rows, cols, discounts[rows, cols]
+
+
+def ranking(values: np.ndarray) -> np.ndarray:
+    """按折扣率降序的排列下标（稳定排序，折扣相同时保持输入顺序）"""
+    return np.argsort(-values, kind='stable')
+
+
+def rank(discounts: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    阈值过滤 + 按折扣降序排序
+
+    Returns:
+        (源商品下标, 候选下标, 折扣率)，已排好序
+    """
+    rows, cols, values = select(discounts, threshold)
+    order = ranking(values)
+    return rows[order], cols[order], values[order]
+
+
+def format_rate(value: float) -> str:
+    """0.35 -> '35.0%'（仅在输出时调用）"""
+    return f"{value * 100:.1f}%"
+
+
+def compare(source_products: Sequence[Dict[str, Any]], candidate_lists: Sequence[Sequence[Dict[str, Any]]],
+            threshold: float) -> List[Dict[str, Any]]:
+    """对比源商品与各自的候选商品，返回折扣达到阈值的配对（按折扣率降序）"""
+    source = price_array(source_products)
+    candidates = candidate_matrix(candidate_lists)
+    rows, cols, values = select(discount_matrix(source, candidates), float(threshold))
+    source_prices = source[rows]
+    candidate_prices = candidates[rows, cols]
+    # 按输入顺序构建（顺序访问商品字典），最后按排序下标重排
+    results = [
+        {
+            'taobao_product': source_products[row],
+            'pinduoduo_product': candidate_lists[row][col],
+            'discount_rate': format_rate(value),
+            'price_diff': diff,
+            'taobao_price': source_price,
+            'pinduoduo_price': candidate_price
+        }
+        for row, col, value, diff, source_price, candidate_price in zip(
+            rows.tolist(), cols.tolist(), values.tolist(), (source_prices - candidate_prices).tolist(),
+            source_prices.tolist(), candidate_prices.tolist())
+    ]
+    return [results[i] for i in ranking(values).tolist()]
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+商品价格/销量/排名历史（按月分块的定长数组）
+智能选品的 growth_threshold、选品规则的 min_growth_percent 原来只能依赖爬到的 growth_rate 字符串，
+服务器没有任何历史数据。这里每次爬取都追加一个采样点：
+
+1. 字典编码：(平台, product_id) -> 整数编号（history_products）
+2. 每个商品每个月一行（history_blocks），时间戳/价格/销量/排名各是一个定长小端数组 BLOB，
+   追加时在 SQL 里直接拼接 BLOB，不读出旧数据
+3. growth()：一次读出所有相关商品的数据块拼成大数组，按 (商品, 时间) 排序后用 searchsorted
+   同时求出所有商品在“现在”和“N 天前”的取值，几千个商品的 1/7/30 天增长率一次算完
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+import db
+from catalog import product_key
+
+logger = logging.getLogger(__name__)
+
+# 列 -> 存储类型（小端定长）；缺失值为 NaN
+DTYPES = {
+    'ts': np.dtype('<u4'),
+    'price': np.dtype('<f4'),
+    'sales': np.dtype('<f8'),
+    'rank': np.dtype('<f4'),
+}
+METRICS = ('price', 'sales', 'rank')
+WINDOWS = (1, 7, 30)
+CURRENT_MAX_AGE = 86400  # “当前值”最多取多久以前的采样点（秒）
+PAST_TOLERANCE = 0.25    # “N天前的值”的采样点最多比目标时刻早 N 天的这个比例
+
+_NUMBER = re.compile(r'(\d+(?:\.\d+)?)\s*(万|亿|w|W|k|K)?')
+_UNITS = {'万': 1e4, 'w': 1e4, 'W': 1e4, '亿': 1e8, 'k': 1e3, 'K': 1e3}
+_CHUNK = 500  # IN (...) 每批参数个数
+
+
+def parse_number(value: Any) -> float:
+    """'¥59.9' -> 59.9，'1.2万+' -> 12000.0，'5000+' -> 5000.0；无法解析时为 NaN"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _NUMBER.search(str(value or '').replace(',', ''))
+    if match is None:
+        return math.nan
+    return float(match.group(1)) * _UNITS.get(match.group(2), 1)
+
+
+def month_of(ts: float) -> int:
+    """epoch -> 202510（UTC）"""
+    t = time.gmtime(ts)
+    return t.tm_year * 100 + t.tm_mon
+
+
+def months_between(start: float, end: float) -> List[int]:
+    """[start, end] 覆盖的所有月份"""
+    first, last = month_of(start), month_of(end)
+    months = []
+    year, month = divmod(first, 100)
+    while year * 100 + month <= last:
+        months.append(year * 100 + month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class PriceHistory:
+    """追加采样点并按滑动窗口计算增长率（线程安全）；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, db_path: str, retention_months: int = 13):
+        self.db_path = db_path
+        self.retention_months = retention_months
+        self._codes: Dict[tuple, int] = {}  # (平台, product_id) -> 编号，进程内缓存
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.points_recorded = 0
+        self.queries = 0
+        self.queried_products = 0
+        self.last_query_ms = 0.0
+
+    @staticmethod
+    def init_tables(c) -> None:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS history_products (
+                id INTEGER PRIMARY KEY,
+                platform TEXT NOT NULL,
+                product_id TEXT NOT NULL,
+                UNIQUE (platform, product_id)
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS history_blocks (
+                product INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                ts BLOB NOT NULL,
+                price BLOB NOT NULL,
+                sales BLOB NOT NULL,
+                rank BLOB NOT NULL,
+                PRIMARY KEY (product, month)
+            ) WITHOUT ROWID
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_history_blocks_month ON history_blocks(month)')
+
+    def _conn(self):
+        """历史数据自己的线程内连接，不并入请求线程上未提交的事务"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = db.connect(self.db_path)
+        return conn
+
+    def _lookup_codes(self, c, platform: str, product_ids: Sequence[str], create: bool) -> Dict[str, int]:
+        """product_id -> 编号；create=True 时为新商品分配编号"""
+        with self._lock:
+            codes = {pid: self._codes[(platform, pid)] for pid in product_ids if (platform, pid) in self._codes}
+        missing = [pid for pid in dict.fromkeys(product_ids) if pid not in codes]
+        if create and missing:
+            c.executemany('INSERT OR IGNORE INTO history_products (platform, product_id) VALUES (?, ?)',
+                          [(platform, pid) for pid in missing])
+        for start in range(0, len(missing), _CHUNK):
+            chunk = missing[start:start + _CHUNK]
+            found = dict(c.execute(f'SELECT product_id, id FROM history_products WHERE platform=? '
+                                   f'AND product_id IN ({",".join("?" * len(chunk))})', [platform] + chunk).fetchall())
+            codes.update(found)
+            with self._lock:
+                self._codes.update(((platform, pid), code) for pid, code in found.items())
+        return codes
+
+    def record(self, platform: str, products: Iterable[Dict[str, Any]], now: Optional[float] = None) -> int:
+        """为一次爬取到的商品各追加一个采样点（价格、销量、排名），返回追加的点数；写入失败只记日志"""
+        now = int(time.time() if now is None else now)
+        samples = {}
+        for product in products:
+            if not isinstance(product, dict):
+                continue
+            values = [parse_number(product.get(metric)) for metric in METRICS]
+            if all(math.isnan(value) for value in values):
+                continue
+            samples[product_key(product)] = values  # 同一批中重复出现的商品取最后一次
+        if not samples:
+            return 0
+        ts = np.array([now], dtype=DTYPES['ts']).tobytes()
+        month = month_of(now)
+        try:
+            with db.transaction_on(self._conn()) as c:
+                codes = self._lookup_codes(c, platform, list(samples), create=True)
+                c.executemany('''INSERT INTO history_blocks (product, month, ts, price, sales, rank)
+                                 VALUES (?, ?, ?, ?, ?, ?)
+                                 ON CONFLICT (product, month) DO UPDATE
+                                 SET ts = CAST(ts || excluded.ts AS BLOB),
+                                     price = CAST(price || excluded.price AS BLOB),
+                                     sales = CAST(sales || excluded.sales AS BLOB),
+                                     rank = CAST(rank || excluded.rank AS BLOB)''',
+                              [(codes[pid], month, ts) + tuple(np.array([value], dtype=DTYPES[metric]).tobytes()
+                                                               for metric, value in zip(METRICS, values))
+                               for pid, values in samples.items()])
+        except Exception as e:
+            logger.warning(f"⚠️ 价格历史写入失败: {e}")
+            return 0
+        with self._lock:
+            self.points_recorded += len(samples)
+        return len(samples)
+
+    def _series(self, codes: np.ndarray, metric: str, since: float, until: float):
+        """读出 codes 中各商品 [since, until] 所在月份的数据块，返回 (商品下标, 时间戳, 取值)，已去掉缺失值"""
+        position = {code: index for index, code in enumerate(codes.tolist()) if code >= 0}
+        months = months_between(since, until)
+        owners, stamp_blobs, value_blobs = [], [], []
+        c = self._conn()
+        known = list(position)
+        for start in range(0, len(known), _CHUNK):
+            chunk = known[start:start + _CHUNK]
+            for code, ts, data in c.execute(f'SELECT product, ts, {metric} FROM history_blocks '
+                                            f'WHERE product IN ({",".join("?" * len(chunk))}) '
+                                            f'AND month IN ({",".join("?" * len(months))})', chunk + months):
+                owners.append(position[code])
+                stamp_blobs.append(ts)
+                value_blobs.append(data)
+        # 所有数据块拼成一块后一次转换
+        counts = np.fromiter(map(len, stamp_blobs), dtype=np.int64, count=len(stamp_blobs)) // DTYPES['ts'].itemsize
+        owners = np.repeat(np.array(owners, dtype=np.int64), counts)
+        stamps = np.frombuffer(b''.join(stamp_blobs), dtype=DTYPES['ts']).astype(np.int64)
+        values = np.frombuffer(b''.join(value_blobs), dtype=DTYPES[metric]).astype(np.float64)
+        present = ~np.isnan(values)
+        return owners[present], stamps[present], values[present]
+
+    def growth(self, platform: str, product_ids: Sequence[str], windows: Sequence[int] = WINDOWS,
+               metric: str = 'sales', now: Optional[float] = None) -> Dict[int, np.ndarray]:
+        """
+        滑动窗口增长率：(当前值 - N天前的值) / N天前的值
+        “当前值”“N天前的值”分别取该时刻及之前最近的一个采样点，且采样点不能太旧：
+        当前值在 CURRENT_MAX_AGE 秒内，N天前的值不早于目标时刻 N*PAST_TOLERANCE 天
+        （否则采样间隔不规则时，25 天前的一个点会被当成 1 天前、7 天前的值）
+
+        Returns:
+            {天数: 与 product_ids 对齐的 float64 数组}，没有足够历史、采样点太旧或 N 天前的值 <= 0 时为 NaN
+        """
+        if metric not in METRICS:
+            raise ValueError(f'未知指标: {metric}')
+        started = time.perf_counter()
+        now = int(time.time() if now is None else now)
+        n = len(product_ids)
+        codes_by_id = self._lookup_codes(self._conn(), platform, list(product_ids), create=False) if n else {}
+        codes = np.array([codes_by_id.get(pid, -1) for pid in product_ids], dtype=np.int64)
+        # 多读一个月：N天前那一刻之前最近的采样点可能在更早的月份
+        owners, stamps, values = self._series(codes, metric, now - (max(windows) + 31) * 86400, now)
+
+        # 按 (商品下标, 时间) 排序后组合成单调递增的键，查询时对所有商品一次 searchsorted
+        order = np.lexsort((stamps, owners))
+        owners, stamps, values = owners[order], stamps[order], values[order]
+        keys = (owners << 32) | stamps
+        index = np.arange(n, dtype=np.int64)
+
+        def value_at(ts: int, max_age: float) -> np.ndarray:
+            """每个商品在 ts 及之前最近的采样点的取值；没有或早于 ts - max_age 时为 NaN"""
+            if not len(keys):
+                return np.full(n, np.nan)
+            pos = np.searchsorted(keys, (index << 32) | ts, side='right') - 1
+            clipped = np.clip(pos, 0, None)
+            found = (pos >= 0) & (owners[clipped] == index) & (stamps[clipped] >= ts - max_age)
+            return np.where(found, values[clipped], np.nan)
+
+        current = value_at(now, CURRENT_MAX_AGE)
+        result = {}
+        for days in windows:
+            past = value_at(now - days * 86400, days * 86400 * PAST_TOLERANCE)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[days] = np.where(past > 0, (current - past) / past, np.nan)
+
+        with self._lock:
+            self.queries += 1
+            self.queried_products += n
+            self.last_query_ms = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    def purge_expired(self) -> int:
+        """删除超过 retention_months 的月份数据块（定时任务调用），返回删除行数"""
+        year, month = divmod(month_of(time.time()), 100)
+        total = year * 12 + month - 1 - self.retention_months
+        cutoff = (total // 12) * 100 + total % 12 + 1
+        conn = db.connect(self.db_path)
+        try:
+            with db.transaction_on(conn) as c:
+                c.execute('DELETE FROM history_blocks WHERE month < ?', (cutoff,))
+                return c.rowcount
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'points_recorded': self.points_recorded,
+            'cached_codes': len(self._codes),
+            'queries': self.queries,
+            'queried_products': self.queried_products,
+            'last_query_ms': self.last_query_ms,
+            'retention_months': self.retention_months
+        }
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+请求计数写回缓冲（write-behind）
+require_auth 不再每个请求 UPDATE authorizations 并提交，
+而是在内存中累加每个客户端的请求数 / 最后请求时间，由定时任务批量写回。
+进程异常退出时最多丢失一个刷新周期内的计数。
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import db
+
+logger = logging.getLogger(__name__)
+
+
+class RequestAccounting:
+    """按 client_id 聚合的请求计数缓冲（线程安全）"""
+
+    def __init__(self, db_path: str, flush_interval: float = 5, max_pending: int = 5000):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # client_id -> [请求增量, 最后请求时间, 首个IP, 最后请求时间戳]
+        self._pending: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.flush_count = 0
+        self.flushed_requests = 0
+        self.last_flush_at: Optional[float] = None
+        self.last_flush_ms = 0.0
+
+    def record(self, client_id: str, ip_address: Optional[str], request_at: str, request_epoch: int) -> None:
+        """记录一次已授权请求；缓冲的客户端数超过上限时立即刷新"""
+        with self._lock:
+            entry = self._pending.get(client_id)
+            if entry is None:
+                self._pending[client_id] = [1, request_at, ip_address, request_epoch]
+            else:
+                entry[0] += 1
+                if request_epoch > entry[3]:
+                    entry[1] = request_at
+                    entry[3] = request_epoch
+            overflow = len(self._pending) >= self.max_pending
+        if overflow:
+            self.flush()
+
+    def flush(self) -> int:
+        """把缓冲的计数在一个事务内写回数据库，返回写回的请求数"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                # 只在IP为空时写入，避免管理员清空后被自动回填
+                with db.transaction(self.db_path) as c:
+                    c.executemany('''
+                        UPDATE authorizations
+                        SET request_count = request_count + ?,
+                            last_request_at = CASE WHEN (last_request_epoch IS NULL OR last_request_epoch < ?) THEN ? ELSE last_request_at END,
+                            last_request_epoch = MAX(COALESCE(last_request_epoch, 0), ?),
+                            ip_address = CASE WHEN (ip_address IS NULL OR ip_address = '') THEN ? ELSE ip_address END
+                        WHERE client_id = ?
+                    ''', [(count, last_epoch, last_at, last_epoch, ip, client_id)
+                          for client_id, (count, last_at, ip, last_epoch) in batch.items()])
+            except Exception as e:
+                # 写回失败：把增量合并回缓冲，下个周期重试
+                with self._lock:
+                    for client_id, (count, last_at, ip, last_epoch) in batch.items():
+                        entry = self._pending.get(client_id)
+                        if entry is None:
+                            self._pending[client_id] = [count, last_at, ip, last_epoch]
+                        else:
+                            entry[0] += count
+                            if last_epoch > entry[3]:
+                                entry[1], entry[3] = last_at, last_epoch
+                            entry[2] = ip
+                logger.error(f"❌ 请求计数写回失败: {e}")
+                return 0
+
+            total = sum(entry[0] for entry in batch.values())
+            self.flush_count += 1
+            self.flushed_requests += total
+            self.last_flush_at = time.time()
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            return total
+
+    def stats(self) -> Dict[str, Any]:
+        """待写回的增量等指标"""
+        with self._lock:
+            pending_clients = len(self._pending)
+            pending_requests = sum(entry[0] for entry in self._pending.values())
+        return {
+            'pending_clients': pending_clients,
+            'pending_requests': pending_requests,
+            'flush_interval_seconds': self.flush_interval,
+            'flush_count': self.flush_count,
+            'flushed_requests': self.flushed_requests,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }
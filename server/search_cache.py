@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+平台搜索结果缓存
+价格对比按标题前20字、智能选品按标题去拼多多搜索，同一批商品里、不同客户端之间
+经常搜索相同或几乎相同的关键词。这里按归一化后的关键词缓存搜索结果：
+
+1. 归一化：全半角统一、转小写、去掉空白、标点和营销词（包邮、正品、旗舰店……）
+2. 两级缓存：进程内 LRU -> SQLite 表 search_cache（多进程共享，重启不丢）
+3. 每条记录单独的到期时间；搜索结果为空也缓存（较短的 negative_ttl），搜索异常不缓存
+4. dedupe()：同一请求内归一化后相同的关键词只搜索一次
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# 不影响商品本身的营销词（长词在前，避免先被短词拆开）
+MARKETING_WORDS = sorted((
+    '官方旗舰店', '旗舰店', '官方正品', '官方', '正品', '包邮', '顺丰', '新款', '爆款', '热卖', '热销',
+    '特价', '限时', '秒杀', '促销', '现货', '清仓', '直降', '同款', '网红', '推荐', '优惠', '大促',
+    '满减', '亏本', '冲量', '专柜', '当天发货', '24小时发货',
+), key=len, reverse=True)
+_MARKETING = re.compile('|'.join(map(re.escape, MARKETING_WORDS)))
+_PUNCTUATION = re.compile(r'[\W_]+')
+
+
+def normalize_keyword(keyword: Optional[str]) -> str:
+    """
+    '【包邮】Apple/苹果 iPhone15  手机！' -> 'apple苹果iphone15手机'（只用作缓存键）
+    全是标点/营销词的关键词去掉后为空，退回全半角统一、小写后的原词，避免这类关键词共用一个空键
+    """
+    raw = unicodedata.normalize('NFKC', keyword or '').lower()
+    text = _PUNCTUATION.sub('', _MARKETING.sub('', raw))
+    return text or raw.strip()
+
+
+class SearchCache:
+    """按 (namespace, 归一化关键词) 缓存搜索结果（线程安全）；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, db_path: str, ttl: int = 1800, negative_ttl: int = 300, max_entries: int = 5000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # (namespace, keyword) -> (到期时间, 结果)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.load_errors = 0
+        self.deduped = 0
+
+    @staticmethod
+    def init_table(c) -> None:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS search_cache (
+                namespace TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                results TEXT NOT NULL,
+                expires_at INTEGER NOT NULL,
+                PRIMARY KEY (namespace, keyword)
+            ) WITHOUT ROWID
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_search_cache_expires ON search_cache(expires_at)')
+
+    def _conn(self):
+        """缓存自己的线程内连接，不并入请求线程上未提交的事务"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = db.connect(self.db_path)
+        return conn
+
+    def _remember(self, key: Tuple[str, str], expires_at: int, results: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, namespace: str, keyword: str) -> Optional[List[Dict[str, Any]]]:
+        """按归一化关键词读取，未命中或已过期返回 None（空列表表示缓存的“无结果”）"""
+        key = (namespace, normalize_keyword(keyword))
+        now = int(time.time())
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] > now:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                if not item[1]:
+                    self.negative_hits += 1
+                return item[1]
+
+        row = self._conn().execute('SELECT results, expires_at FROM search_cache '
+                                   'WHERE namespace=? AND keyword=? AND expires_at > ?', key + (now,)).fetchone()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        results = json.loads(row[0])
+        self._remember(key, row[1], results)
+        with self._lock:
+            self.db_hits += 1
+            if not results:
+                self.negative_hits += 1
+        return results
+
+    def put(self, namespace: str, keyword: str, results: List[Dict[str, Any]]) -> None:
+        key = (namespace, normalize_keyword(keyword))
+        expires_at = int(time.time()) + (self.ttl if results else self.negative_ttl)
+        self._remember(key, expires_at, results)
+        try:
+            with db.transaction_on(self._conn()) as c:
+                c.execute('''INSERT INTO search_cache (namespace, keyword, results, expires_at) VALUES (?, ?, ?, ?)
+                             ON CONFLICT (namespace, keyword) DO UPDATE
+                             SET results = excluded.results, expires_at = excluded.expires_at''',
+                          key + (json.dumps(results, ensure_ascii=False), expires_at))
+        except Exception as e:
+            logger.warning(f"⚠️ 搜索缓存写入失败: {e}")
+
+    def fetch(self, namespace: str, keyword: str,
+              loader: Callable[[str], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """先查缓存，未命中时用原始关键词调用 loader 搜索并写入缓存；loader 的异常原样抛出"""
+        results = self.get(namespace, keyword)
+        if results is not None:
+            return results
+        try:
+            results = list(loader(keyword) or [])
+        except Exception:
+            with self._lock:
+                self.load_errors += 1
+            raise
+        self.put(namespace, keyword, results)
+        return results
+
+    def dedupe(self, keywords: Iterable[str]) -> Tuple[List[str], Dict[str, str]]:
+        """
+        同一请求内的关键词去重
+
+        Returns:
+            (每个关键词的归一化结果, 归一化关键词 -> 第一次出现的原始关键词)
+        """
+        keywords = list(keywords)
+        keys = [normalize_keyword(keyword) for keyword in keywords]
+        unique: Dict[str, str] = {}
+        for key, keyword in zip(keys, keywords):
+            unique.setdefault(key, keyword)
+        with self._lock:
+            self.deduped += len(keys) - len(unique)
+        return keys, unique
+
+    def purge_expired(self) -> int:
+        """删除 SQLite 中已过期的记录（定时任务调用），返回删除条数"""
+        now = int(time.time())
+        with self._lock:
+            for key in [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[key]
+        conn = db.connect(self.db_path)
+        try:
+            with db.transaction_on(conn) as c:
+                c.execute('DELETE FROM search_cache WHERE expires_at <= ?', (now,))
+                return c.rowcount
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            'memory_entries': len(self._entries),
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'memory_hit_rate': round(self.memory_hits / lookups, 4) if lookups else 0.0,
+            'load_errors': self.load_errors,
+            'deduped': self.deduped,
+            'ttl_seconds': self.ttl,
+            'negative_ttl_seconds': self.negative_ttl
+        }
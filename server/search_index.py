@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+管理后台全文检索（SQLite FTS5，trigram 分词）
+原来的搜索是 LIKE '%q%'，每次都全表扫描。这里为要搜索的列建外部内容（external content）FTS5 影子索引，
+由触发器与原表保持同步，查询改为 MATCH：
+
+- authorizations_fts：client_name / client_id / ip_address
+- {日志分区}_fts：每个日志分区一张（client_id / ip_address / request_type 或 action / detail_json），
+  随分区创建，随分区 DROP，不需要逐行删除索引
+
+搜索语法（每个空格分隔的词之间为 AND）：
+- abc   子串匹配（trigram，至少3个字符）
+- abc*  前缀匹配（字段以 abc 开头）
+- 不足3个字符的词无法走 trigram 索引，退回 LIKE
+"""
+
+import logging
+from typing import Any, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+MIN_TERM = 3  # trigram 索引可用的最短词长
+
+# 源表 -> 建索引的列
+FTS_COLUMNS = {
+    'authorizations': ('client_name', 'client_id', 'ip_address'),
+    'request_logs': ('client_id', 'ip_address', 'request_type'),
+    'event_logs': ('client_id', 'ip_address', 'action', 'detail_json'),
+}
+
+CLIENT_FTS = 'authorizations_fts'
+
+
+def fts_name(source: str) -> str:
+    return f'{source}_fts'
+
+
+def _update_trigger(c, source: str, columns: Sequence[str]) -> None:
+    """
+    UPDATE 同步触发器：只在被索引的列真正变化时重写索引
+    UPDATE OF 只看 SET 里有没有这一列，请求计数每次写回都会 SET ip_address = CASE ... ELSE ip_address END，
+    没有 WHEN 时每个写回周期都会重写这些客户端的索引行。早期建的触发器没有 WHEN，这里替换掉
+    """
+    fts = fts_name(source)
+    c.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?", (f'{fts}_au',))
+    row = c.fetchone()
+    if row is not None and ' WHEN ' in row[0]:
+        return
+    cols = ', '.join(columns)
+    changed = ' OR '.join(f'old.{col} IS NOT new.{col}' for col in columns)
+    new_values = ', '.join(f'new.{col}' for col in columns)
+    old_values = ', '.join(f'old.{col}' for col in columns)
+    c.execute(f'DROP TRIGGER IF EXISTS {fts}_au')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {source}
+                  WHEN {changed} BEGIN
+                      INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values});
+                      INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new_values});
+                  END''')
+
+
+def _create_index(c, source: str, columns: Sequence[str]) -> bool:
+    """为 source 建 FTS5 外部内容索引和同步触发器；新建时从原表重建索引，返回是否新建"""
+    fts = fts_name(source)
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (fts,))
+    if c.fetchone() is not None:
+        _update_trigger(c, source, columns)
+        return False
+    cols = ', '.join(columns)
+    new_values = ', '.join(f'new.{col}' for col in columns)
+    old_values = ', '.join(f'old.{col}' for col in columns)
+    c.execute(f'''CREATE VIRTUAL TABLE {fts} USING fts5(
+                      {cols}, content='{source}', content_rowid='id', tokenize='trigram')''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN
+                      INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new_values});
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN
+                      INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values});
+                  END''')
+    _update_trigger(c, source, columns)
+    c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+    return True
+
+
+def init_client_index(c) -> None:
+    """客户端搜索索引（在 init_db 中、写事务内调用）"""
+    if _create_index(c, 'authorizations', FTS_COLUMNS['authorizations']):
+        logger.info(f"🔎 创建客户端全文索引 {CLIENT_FTS}")
+
+
+def ensure_log_index(c, table: str, partition: str) -> None:
+    """日志分区的搜索索引（分区创建时调用，需在写事务中）"""
+    _create_index(c, partition, FTS_COLUMNS[table])
+
+
+def drop_log_index(c, partition: str) -> None:
+    """分区删除前调用：分区上的触发器随表删除，索引表需要单独删除"""
+    c.execute(f'DROP TABLE IF EXISTS {fts_name(partition)}')
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def compile_filters(filters: Sequence[Tuple[Sequence[str], str]]) -> Tuple[Optional[str], List[str], List[Any]]:
+    """
+    把搜索条件编译成 FTS5 MATCH 表达式和 LIKE 兜底条件
+
+    Args:
+        filters: [(要搜索的列, 用户输入), ...]，各条件之间为 AND
+
+    Returns:
+        (MATCH 表达式或 None, LIKE 子句列表, LIKE 参数列表)
+    """
+    parts: List[str] = []
+    likes: List[str] = []
+    params: List[Any] = []
+    for columns, text in filters:
+        for term in (text or '').split():
+            prefix = term.endswith('*')
+            term = term.rstrip('*')
+            if not term:
+                continue
+            if len(term) >= MIN_TERM:
+                parts.append(f"{{{' '.join(columns)}}} : {'^' if prefix else ''}{_quote(term)}")
+            else:
+                likes.append('(' + ' OR '.join(f'{col} LIKE ?' for col in columns) + ')')
+                params.extend([f'{term}%' if prefix else f'%{term}%'] * len(columns))
+    return (' AND '.join(parts) or None), likes, params
+
+
+def where_clause(filters: Sequence[Tuple[Sequence[str], str]], fts_table: str) -> Tuple[str, List[Any]]:
+    """
+    生成可直接拼进 WHERE 的条件（源表主键列为 id）
+
+    fts_table 可以写成 '{partition}_fts'，由 pagination.partitioned_page 按分区替换
+    """
+    match, likes, like_params = compile_filters(filters)
+    clauses, params = [], []
+    if match:
+        clauses.append(f'id IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ?)')
+        params.append(match)
+    return ' AND '.join(clauses + likes), params + like_params
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+相同请求合并（single-flight）
+多个客户端经常在几秒内请求同一类目/时间段的智能选品，同一客户端也会重复提交同一榜单参数的抖店爬取，
+每个请求都会完整地爬取和匹配一遍。这里按归一化后的参数合并：
+
+1. 同一个键只有第一个请求真正执行，执行期间到达的相同请求等待并共享它的结果（或异常）
+2. 执行成功后结果再保留 grace 秒，紧随其后的相同请求直接复用
+3. 执行失败不缓存，下一个请求重新执行
+
+注意：结果在多个请求间共享，调用方不能修改返回的对象。
+合并范围是单个进程（gunicorn 每个 worker 各自合并）。
+"""
+
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+def make_key(namespace: str, params: Dict[str, Any]) -> Tuple:
+    """参数字典 -> 合并键：字符串全半角统一并去掉首尾空白，浮点数保留4位，与参数顺序无关"""
+    def normalize(value):
+        if isinstance(value, str):
+            return unicodedata.normalize('NFKC', value).strip()
+        if isinstance(value, float):
+            return round(value, 4)
+        if isinstance(value, (list, tuple)):
+            return tuple(normalize(item) for item in value)
+        return value
+    return (namespace,) + tuple(sorted((name, normalize(value)) for name, value in params.items()))
+
+
+class _Flight:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """按键合并并发的相同调用（线程安全）；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, grace: float = 10.0, max_entries: int = 256):
+        self.grace = grace
+        self.max_entries = max_entries
+        self._flights: Dict[Hashable, _Flight] = {}
+        # 键 -> (到期时间, 结果)，刚完成的结果
+        self._recent: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.grace_hits = 0
+        self.errors = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """执行 func()，或等待同一个键上正在执行的调用并返回它的结果；func 的异常原样抛给所有等待者"""
+        with self._lock:
+            self.calls += 1
+            recent = self._recent.get(key)
+            if recent is not None:
+                if recent[0] > time.monotonic():
+                    self.grace_hits += 1
+                    return recent[1]
+                del self._recent[key]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = func()
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and self.grace > 0:
+                    self._recent[key] = (time.monotonic() + self.grace, flight.value)
+                    self._recent.move_to_end(key)
+                    while len(self._recent) > self.max_entries:
+                        self._recent.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            in_flight = len(self._flights)
+            recent = sum(1 for expires_at, _ in self._recent.values() if expires_at > now)
+        shared = self.coalesced + self.grace_hits
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'grace_hits': self.grace_hits,
+            'shared_rate': round(shared / self.calls, 4) if self.calls else 0.0,
+            'errors': self.errors,
+            'in_flight': in_flight,
+            'recent_entries': recent,
+            'grace_seconds': self.grace
+        }
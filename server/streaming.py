@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+流式响应（NDJSON / Server-Sent Events）
+价格对比、智能选品默认在内存里攒齐全部结果再一次性返回，客户端要一直等到最后。
+按需开启流式：每算出一条结果立即下发，最后一条为汇总记录。
+
+开启方式（任选其一）：
+- 查询参数 ?stream=ndjson 或 ?stream=sse（?stream=1 等同 ndjson）
+- 请求头 Accept: application/x-ndjson 或 Accept: text/event-stream
+
+记录格式：
+- NDJSON：每行一个 JSON 对象 {"type": "result" | "error" | "summary", "data": {...}}
+- SSE：   event: result|error|summary + data: {...}
+"""
+
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from flask import Response, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+NDJSON = 'ndjson'
+SSE = 'sse'
+MIMETYPES = {NDJSON: 'application/x-ndjson', SSE: 'text/event-stream'}
+
+
+def negotiate(request) -> Optional[str]:
+    """根据查询参数 / Accept 头判断是否流式返回，返回 'ndjson' / 'sse' / None"""
+    flag = (request.args.get('stream') or '').lower()
+    if flag in (SSE, 'event-stream'):
+        return SSE
+    if flag in (NDJSON, '1', 'true'):
+        return NDJSON
+    accept = request.headers.get('Accept', '')
+    if MIMETYPES[NDJSON] in accept:
+        return NDJSON
+    if MIMETYPES[SSE] in accept:
+        return SSE
+    return None
+
+
+def encode(fmt: str, record_type: str, data: Dict[str, Any]) -> str:
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    if fmt == SSE:
+        return f'event: {record_type}\ndata: {body}\n\n'
+    return f'{{"type":"{record_type}","data":{body}}}\n'
+
+
+def results(items: Iterable[Dict[str, Any]], **summary: Any) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """结果迭代器 -> 记录流：每条结果一条 result 记录，最后追加 summary（total 为结果条数）"""
+    total = 0
+    for item in items:
+        total += 1
+        yield 'result', item
+    yield 'summary', dict(summary, success=True, total=total)
+
+
+def stream(fmt: str, records: Iterable[Tuple[str, Dict[str, Any]]]) -> Response:
+    """
+    把 (类型, 数据) 记录逐条写出
+    生成器中途抛出异常时补发一条 error 记录和 success=False 的汇总，保证流以 summary 结尾
+    """
+    def generate() -> Iterator[str]:
+        finished = False
+        try:
+            for record_type, data in records:
+                finished = record_type == 'summary'
+                yield encode(fmt, record_type, data)
+        except Exception as e:
+            logger.error(f"❌ 流式响应中断: {e}")
+            yield encode(fmt, 'error', {'error': str(e)})
+            if not finished:
+                yield encode(fmt, 'summary', {'success': False, 'error': str(e)})
+        finally:
+            close = getattr(records, 'close', None)
+            if close is not None:
+                close()  # 客户端断开时让上游生成器执行清理（取消未开始的任务等）
+
+    response = Response(stream_with_context(generate()), mimetype=MIMETYPES[fmt])
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 关闭 nginx 反向代理缓冲
+    return response
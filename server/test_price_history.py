@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+价格历史增长率测试
+采样间隔不规则时，增长率只能用目标时刻附近的采样点计算，不能拿很久以前的点充当“N天前”或“当前”的值。
+
+用法：cd server && python -m pytest -q test_price_history.py
+"""
+
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db
+from price_history import PriceHistory
+
+DAY = 86400
+NOW = 1_800_000_000
+
+
+@pytest.fixture
+def history(tmp_path):
+    path = str(tmp_path / 'history.db')
+    with db.transaction_on(db.connect(path)) as c:
+        PriceHistory.init_tables(c)
+    return PriceHistory(path)
+
+
+def _sample(history, product_id, days_ago, sales):
+    history.record('douyin', [{'product_id': product_id, 'sales': sales}], now=NOW - days_ago * DAY)
+
+
+def test_irregular_samples(history):
+    # a：25 天前和现在各一个点 -> 25 天的变化不能算作 1 天、7 天增长；30 天前之前没有采样点
+    _sample(history, 'a', 25, 100)
+    _sample(history, 'a', 0, 300)
+    # b：8 天前、6.5 天前、1.2 天前、现在
+    for days_ago, sales in ((8, 100), (6.5, 150), (1.2, 180), (0, 200)):
+        _sample(history, 'b', days_ago, sales)
+    # c：最后一次采样在 10 天前 -> 没有“当前值”
+    _sample(history, 'c', 20, 100)
+    _sample(history, 'c', 10, 200)
+
+    growth = history.growth('douyin', ['a', 'b', 'c', 'missing'], now=NOW)
+
+    for days in (1, 7, 30):
+        assert math.isnan(growth[days][0])
+
+    assert growth[1][1] == pytest.approx(200 / 180 - 1)  # 1.2 天前在 1 天的容差（6 小时）内
+    assert growth[7][1] == pytest.approx(200 / 100 - 1)  # 7 天前之前最近的是 8 天前
+    assert math.isnan(growth[30][1])
+
+    for days in (1, 7, 30):
+        assert math.isnan(growth[days][2])
+        assert math.isnan(growth[days][3])
+
+
+def test_stale_past_sample_outside_tolerance(history):
+    # 7 天窗口的容差为 1.75 天：9 天前的点不能当作 7 天前的值
+    _sample(history, 'p', 9, 100)
+    _sample(history, 'p', 0, 150)
+    growth = history.growth('douyin', ['p'], windows=(7,), now=NOW)
+    assert math.isnan(growth[7][0])
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+请求路径 SQL 索引覆盖测试
+在临时目录里启动 app，用 Flask test client 走一遍客户端会调用的接口
+（注册、授权校验、check-auth、埋点上报、后台任务，以及后台批量写回），
+再直接调用搜索缓存 / 商品目录 / 价格历史（假的搜索函数，不联网），
+通过 sqlite3 的 trace 回调收集实际执行的每条 SQL，逐条 EXPLAIN QUERY PLAN，
+出现全表扫描（SCAN 表）即失败。
+
+用法：cd server && python -m pytest -q test_query_plans.py
+"""
+
+import atexit
+import gzip
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 允许的扫描：SQLite 内部表、FTS5 内部读取的影子配置表、FTS5 虚拟表的 MATCH、常量行
+ALLOWED_SCANS = (
+    re.compile(r'^SCAN (sqlite_master|sqlite_schema|sqlite_sequence)\b'),
+    re.compile(r'^SCAN (main\.)?\w+_fts_config\b'),
+    re.compile(r'^SCAN \w+ VIRTUAL TABLE INDEX'),
+    re.compile(r'^SCAN CONSTANT ROW'),
+)
+DML = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b', re.IGNORECASE)
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    """在临时目录中导入 app（数据库用绝对路径），并给之后建立的所有连接挂上 SQL 收集器"""
+    workdir = tmp_path_factory.mktemp('query_plans')
+    old_cwd = os.getcwd()
+    old_db_path = os.environ.get('DB_PATH')
+    os.environ['DB_PATH'] = str(workdir / 'authorization.db')
+    os.chdir(workdir)
+
+    import db
+    statements = []
+    lock = threading.Lock()
+    capturing = threading.Event()
+    original_connect = db.connect
+
+    def traced_connect(db_path):
+        conn = original_connect(db_path)
+
+        def collect(sql):
+            if capturing.is_set() and DML.match(sql):
+                with lock:
+                    statements.append(sql)
+        conn.set_trace_callback(collect)
+        return conn
+
+    db.connect = traced_connect
+    app = None
+    try:
+        import app
+        app.scheduler.pause()
+        yield app, statements, capturing
+    finally:
+        if app is not None:
+            _shutdown(app)
+        db.connect = original_connect
+        os.chdir(old_cwd)
+        if old_db_path is None:
+            os.environ.pop('DB_PATH', None)
+        else:
+            os.environ['DB_PATH'] = old_db_path
+
+
+def _shutdown(app):
+    """停掉 import app 时启动的后台线程并注销退出钩子，避免解释器退出时它们再去访问（已删除的）临时数据库"""
+    app.scheduler.shutdown(wait=False)
+    app.job_manager.stop()
+    app.log_writer.stop()
+    app.request_accounting.flush()
+    app.fanout.shutdown()
+    for hook in (app.scheduler.shutdown, app.request_accounting.flush, app.log_writer.stop, app.fanout.shutdown):
+        atexit.unregister(hook)
+
+
+def _exercise(app):
+    """模拟客户端的请求：注册 -> 试用 -> 审核通过 -> 正常调用 -> 埋点"""
+    client = app.app.test_client()
+
+    # 注册（新硬件 / 已注册硬件）
+    r = client.post('/api/register', json={'hardware_id': 'hw-plan-1'})
+    assert r.status_code == 200, r.get_json()
+    client_id = r.get_json()['client_id']
+    assert client.post('/api/register', json={'hardware_id': 'hw-plan-1'}).status_code == 200
+
+    # 待审核：require_auth 走试用逻辑；check-auth 查有效试用
+    headers = {'X-Client-ID': client_id, 'X-Hardware-ID': 'hw-plan-1'}
+    assert client.get('/api/rules/active', headers=headers).status_code == 200
+    assert client.get('/api/check-auth', headers={'X-Client-ID': client_id}).status_code == 200
+
+    # 审核通过后：按 client_id、hardware_id、IP 兜底三种方式识别
+    with app.db_transaction() as c:
+        c.execute('UPDATE authorizations SET is_active=1 WHERE client_id=?', (client_id,))
+    for h in (headers,
+              {'X-Client-ID': 'unknown-client', 'X-Hardware-ID': 'hw-plan-1'},
+              {'X-Client-ID': 'unknown-client', 'X-Hardware-ID': 'unknown-hw'}):
+        app.auth_cache.invalidate()
+        assert client.get('/api/rules/active', headers=h).status_code in (200, 403)
+    assert client.get('/api/check-auth', headers={'X-Client-ID': client_id}).status_code == 200
+    assert client.get('/api/check-auth', headers={'X-Client-ID': 'unknown-client'}).status_code == 200
+
+    # 埋点（单条 / 批量），然后把后台缓冲写回
+    client.post('/api/event', json={'action': 'login', 'detail': {'k': 1}}, headers=headers)
+    body = gzip.compress(json.dumps({'events': [{'action': 'search', 'detail': {'kw': '耳机'}}]}).encode())
+    client.post('/api/events/batch', data=body, headers=dict(headers, **{
+        'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}))
+    # 后台任务：提交 -> 轮询进度和结果 -> 列表 -> 删除（注册一个不联网的任务类型）
+    def noop(ctx, params):
+        ctx.progress(1, 2)
+        ctx.results([{'n': 1}, {'n': 2}])
+    app.job_manager.register('plan_noop', noop)
+    r = client.post('/api/jobs', json={'kind': 'plan_noop', 'params': {}}, headers=headers)
+    assert r.status_code == 202, r.get_json()
+    job_id = r.get_json()['job']['id']
+    deadline = time.monotonic() + 10
+    while client.get(f'/api/jobs/{job_id}?after=0', headers=headers).get_json()['job']['status'] != 'succeeded':
+        assert time.monotonic() < deadline, '后台任务未完成'
+        time.sleep(0.1)
+    assert client.get('/api/jobs', headers=headers).status_code == 200
+    assert client.delete(f'/api/jobs/{job_id}', headers=headers).status_code == 200
+
+    app.log_writer.stop()
+    app.log_writer.start()
+    app.request_accounting.flush()
+
+
+def _exercise_catalog(app):
+    """拼多多搜索（搜索缓存 -> 商品目录 -> 假的实时搜索）、爬取结果入目录和价格历史、按历史过滤增长率"""
+    products = [{'product_id': f'plan-{i}', 'title': f'无线蓝牙耳机 {i}', 'price': 10 + i, 'sales': '1.2万+'}
+                for i in range(3)]
+    for _ in range(2):
+        assert app._search_pinduoduo_cached('pinduoduo', '无线蓝牙耳机', lambda kw: products)
+    assert app.catalog.fetch('pinduoduo', '无线蓝牙耳机', lambda kw: [])  # 目录命中
+    app.catalog.lookup('pinduoduo', '没搜过的关键词')
+    assert app.catalog.candidates('pinduoduo', '蓝牙耳机')
+    app._record_scrape('douyin', products)
+    app._filter_growth(products, '近7天', 0.2)
+
+
+def _full_scans(conn, sql):
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    details = [row[3] for row in plan]
+    return [d for d in details if d.startswith('SCAN ') and not any(p.match(d) for p in ALLOWED_SCANS)]
+
+
+def test_request_path_has_no_full_scans(server):
+    app, statements, capturing = server
+    capturing.set()
+    try:
+        _exercise(app)
+        _exercise_catalog(app)
+    finally:
+        capturing.clear()
+
+    assert statements, '没有收集到任何 SQL'
+    conn = app.db.connect(app.DB_PATH)
+    try:
+        failures = {}
+        for sql in dict.fromkeys(statements):
+            scans = _full_scans(conn, sql)
+            if scans:
+                failures[' '.join(sql.split())] = scans
+    finally:
+        conn.close()
+    assert not failures, '请求路径存在全表扫描:\n' + '\n'.join(f'  {sql}\n    -> {scans}' for sql, scans in failures.items())
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT * FROM authorizations WHERE hardware_id = 'x' LIMIT 1",
+    "SELECT * FROM authorizations WHERE ip_address = '1.2.3.4' AND is_active = 1 LIMIT 1",
+    "UPDATE authorizations SET ip_address = '1.2.3.4' WHERE hardware_id = 'x'",
+    "SELECT MAX(trial_expires_epoch) FROM client_access WHERE client_id = 'x' AND trial_expires_epoch > 0",
+])
+def test_known_lookups_use_indexes(server, sql):
+    """不依赖接口流程、直接检查的几条热点查询"""
+    app = server[0]
+    conn = app.db.connect(app.DB_PATH)
+    try:
+        assert not _full_scans(conn, sql)
+    finally:
+        conn.close()
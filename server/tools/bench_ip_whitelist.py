@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+IP 白名单匹配基准测试
+对比：前缀树查询 vs 每次请求用 ipaddress 逐条解析匹配
+用法：python tools/bench_ip_whitelist.py [规则数，默认100000]
+"""
+
+import ipaddress
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ip_whitelist import IPWhitelist
+
+
+def random_rules(count, clients):
+    """生成随机规则：IPv4 为主（/8~/32），约 10% 为 IPv6"""
+    rules = []
+    for i in range(count):
+        client_id = f"client_{i % clients}"
+        if random.random() < 0.9:
+            prefix_len = random.choice([8, 16, 20, 24, 24, 24, 28, 32])
+            network = ipaddress.ip_network((random.getrandbits(32), prefix_len), strict=False)
+        else:
+            prefix_len = random.choice([32, 48, 56, 64, 128])
+            network = ipaddress.ip_network((random.getrandbits(128), prefix_len), strict=False)
+        rules.append((client_id, str(network)))
+    return rules
+
+
+def naive_allows(rules, ip):
+    """朴素实现：逐条解析网段并判断"""
+    address = ipaddress.ip_address(ip)
+    for ip_cidr in rules:
+        network = ipaddress.ip_network(ip_cidr, strict=False)
+        if network.version == address.version and address in network:
+            return True
+    return False
+
+
+def bench(label, func, ips):
+    started = time.perf_counter()
+    for ip in ips:
+        func(ip)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<28} {elapsed / len(ips) * 1e6:10.2f} µs/次")
+    return elapsed
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(42)
+    lookups = 20000
+    ips = [str(ipaddress.ip_address(random.getrandbits(32))) for _ in range(lookups)]
+
+    print("=" * 60)
+    print(f"IP 白名单基准测试：{total} 条规则，{lookups} 次查询")
+    print("=" * 60)
+
+    for clients in (1, 1000):
+        rules = random_rules(total, clients)
+        started = time.perf_counter()
+        whitelist = IPWhitelist(rules)
+        build = time.perf_counter() - started
+        print(f"\n{clients} 个客户端（每个约 {total // clients} 条）  编译耗时 {build:.2f}s")
+
+        client_id = 'client_0'
+        bench('前缀树 allows()', lambda ip: whitelist.allows(client_id, ip), ips)
+
+        # 朴素实现太慢，只抽样测量
+        own_rules = [cidr for cid, cidr in rules if cid == client_id]
+        sample = ips[:max(1, min(lookups, 200000 // max(len(own_rules), 1)))]
+        bench('朴素 ipaddress 逐条匹配', lambda ip: naive_allows(own_rules, ip), sample)
+
+        # 正确性抽查
+        for ip in sample[:200]:
+            assert whitelist.allows(client_id, ip) == naive_allows(own_rules, ip)
+
+
+if __name__ == '__main__':
+    main()
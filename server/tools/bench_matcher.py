@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+商品标题匹配基准测试
+对比：ProductMatcher.match_many（一次分词 + 稀疏矩阵乘法）vs 原来的逐对拟合 TfidfVectorizer
+只测文本相似度（商品不带图片链接，不下载图片）
+用法：python tools/bench_matcher.py [候选数，默认1000] [批量源商品数，默认100] [逐对实现实测的源商品数，默认5]
+"""
+
+import os
+import random
+import sys
+import time
+
+import jieba
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_matcher import ProductMatcher
+
+WORDS = ['夏季', '新款', '连衣裙', '女', '2024', '流行', '宽松', '显瘦', '气质', '长裙', '短袖', 'T恤', '纯棉',
+         '男', '休闲', '裤子', '运动', '鞋', '透气', '跑步', '手机壳', '苹果', '华为', '保护套', '防摔',
+         '蓝牙', '耳机', '无线', '降噪', '充电宝', '大容量', '快充', '收纳', '盒', '家用', '厨房', '置物架']
+
+
+def random_titles(count):
+    return [''.join(random.sample(WORDS, random.randint(4, 10))) for _ in range(count)]
+
+
+def legacy_similarity(text1, text2):
+    """原实现：每一对标题单独分词、拟合 TfidfVectorizer"""
+    try:
+        words1 = ' '.join(jieba.cut(text1))
+        words2 = ' '.join(jieba.cut(text2))
+        tfidf = TfidfVectorizer().fit_transform([words1, words2])
+        return float(cosine_similarity(tfidf[0:1], tfidf[1:2])[0][0])
+    except Exception:
+        return 0.0
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started, result
+
+
+def run(matcher, sources, candidates, legacy_sources):
+    """legacy_sources：逐对实现只实测前几个源商品，总耗时按比例推算"""
+    print(f"\n{len(sources)} × {len(candidates)}")
+    measured = sources[:legacy_sources]
+    legacy_time, legacy = timed(lambda: [[legacy_similarity(s, c) for c in candidates] for s in measured])
+    legacy_total = legacy_time * len(sources) / len(measured)
+    batch_time, batch = timed(lambda: matcher.text_similarities(sources, candidates))
+
+    products = [{'title': title} for title in candidates]
+    match_time, _ = timed(lambda: matcher.match_many([{'title': title} for title in sources], products))
+
+    diff = float(np.abs(np.array(legacy) - batch[:len(measured)]).max())
+    suffix = '' if len(measured) == len(sources) else f'（实测 {len(measured)} 个源商品后推算）'
+    print(f"  逐对 TfidfVectorizer            {legacy_total * 1000:10.1f} ms{suffix}")
+    print(f"  text_similarities（批量）       {batch_time * 1000:10.1f} ms")
+    print(f"  match_many（含筛选、排序）       {match_time * 1000:10.1f} ms")
+    print(f"  加速 {legacy_total / batch_time:.0f}×，与逐对结果最大误差 {diff:.2e}")
+
+
+def main():
+    candidates = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    legacy_sources = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    random.seed(42)
+    jieba.initialize()
+    matcher = ProductMatcher()
+    candidate_titles = random_titles(candidates)
+    source_titles = random_titles(batch)
+    run(matcher, source_titles[:1], candidate_titles, 1)
+    run(matcher, source_titles, candidate_titles, legacy_sources)
+
+
+if __name__ == '__main__':
+    main()
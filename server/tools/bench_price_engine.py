@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+价格对比计算基准测试
+对比：NumPy 折扣矩阵 + 数值排序 vs 原来的逐对循环 + 字符串折扣率排序
+用法：python tools/bench_price_engine.py [源商品数，默认10000] [每个商品的候选数，默认20]
+"""
+
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import price_engine
+
+
+def random_products(count, candidates, low):
+    """生成源商品及其候选商品，候选价格为源价格的 low~1.2 倍"""
+    sources, candidate_lists = [], []
+    for i in range(count):
+        price = round(random.uniform(10, 2000), 2)
+        sources.append({'title': f'商品{i}', 'price': price})
+        candidate_lists.append([
+            {'title': f'商品{i}-{j}', 'price': round(price * random.uniform(low, 1.2), 2)}
+            for j in range(candidates)
+        ])
+    return sources, candidate_lists
+
+
+def legacy_compare(sources, candidate_lists, threshold):
+    """原实现：逐对计算、格式化后再解析字符串排序"""
+    results = []
+    for tb_product, pdd_products in zip(sources, candidate_lists):
+        tb_price = float(tb_product.get('price', 0))
+        for pdd_product in pdd_products:
+            pdd_price = float(pdd_product.get('price', 0))
+            if tb_price > 0:
+                discount = (tb_price - pdd_price) / tb_price
+                if discount >= threshold:
+                    results.append({
+                        'taobao_product': tb_product,
+                        'pinduoduo_product': pdd_product,
+                        'discount_rate': f"{discount * 100:.1f}%",
+                        'price_diff': tb_price - pdd_price,
+                        'taobao_price': tb_price,
+                        'pinduoduo_price': pdd_price
+                    })
+    results.sort(key=lambda x: float(x['discount_rate'].rstrip('%')), reverse=True)
+    return results
+
+
+def bench(label, func, repeat=7):
+    """取多次运行的最短耗时；与 timeit 一样计时期间关闭 GC"""
+    best = float('inf')
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - started)
+    finally:
+        gc.enable()
+    print(f"  {label:<32} {best * 1000:10.1f} ms")
+    return best, result
+
+
+def run(count, candidates, low, threshold=0.3):
+    random.seed(42)
+    sources, candidate_lists = random_products(count, candidates, low)
+    print(f"\n源商品 {count} 个 × 候选 {candidates} 个 = {count * candidates} 对，"
+          f"候选价格为源价格的 {low}~1.2 倍，阈值 {threshold:.0%}")
+
+    legacy_time, legacy = bench('逐对循环 + 字符串排序', lambda: legacy_compare(sources, candidate_lists, threshold))
+    vector_time, vector = bench('NumPy 向量化（含构建结果）', lambda: price_engine.compare(sources, candidate_lists, threshold))
+
+    source = price_engine.price_array(sources)
+    matrix = price_engine.candidate_matrix(candidate_lists)
+    bench('  其中：从字典取价格建数组', lambda: (price_engine.price_array(sources), price_engine.candidate_matrix(candidate_lists)))
+    kernel_time, _ = bench('  其中：折扣矩阵 + 掩码 + 排序',
+                           lambda: price_engine.rank(price_engine.discount_matrix(source, matrix), threshold))
+
+    # 结果一致性：同一组配对；排序键相同（原实现按一位小数排序，只在同一折扣率档内顺序可能不同）
+    assert len(legacy) == len(vector)
+    assert {(id(r['taobao_product']), id(r['pinduoduo_product'])) for r in legacy} == \
+           {(id(r['taobao_product']), id(r['pinduoduo_product'])) for r in vector}
+    assert [r['discount_rate'] for r in legacy] == [r['discount_rate'] for r in vector]
+    print(f"命中 {len(vector)} 对（{len(vector) / (count * candidates):.1%}），结果一致")
+    print(f"端到端加速 {legacy_time / vector_time:.1f}×；价格已是数组时（只算折扣和排序）{legacy_time / kernel_time:.0f}×")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    candidates = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    # 常见情况：只有少数候选达到折扣阈值，计算本身占大头
+    run(count, candidates, low=0.65)
+    # 极端情况：约一半配对入选，耗时主要在构建结果字典（两种实现都要做）
+    run(count, candidates, low=0.2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+把已有数据库切换为 auto_vacuum=INCREMENTAL（一次性维护命令，需整库 VACUUM，请先停服再运行）
+新库在 init_db 建表前已直接设置，无需运行本命令
+用法：python tools/enable_incremental_vacuum.py [数据库文件，默认 DB_PATH 或 authorization.db]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('DB_PATH', 'authorization.db')
+    if not os.path.exists(db_path):
+        print(f"数据库不存在: {db_path}")
+        sys.exit(1)
+    before = os.path.getsize(db_path)
+    conn = db.connect(db_path)
+    try:
+        started = time.perf_counter()
+        if not db.enable_incremental_vacuum(conn):
+            print(f"{db_path} 已是 auto_vacuum=INCREMENTAL，无需处理")
+            return
+        print(f"已转换 {db_path}（{before / 1024 / 1024:.1f} MB -> {os.path.getsize(db_path) / 1024 / 1024:.1f} MB，"
+              f"{time.perf_counter() - started:.1f} 秒）")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+进程内共享、启动时预热的商品匹配器
+原来智能选品在每个源商品的循环里 import ai_matcher 并新建 ProductMatcher；每个 worker 第一次调用
+jieba.cut 时才加载词典（约1秒），sklearn / cv2 / imagehash 的导入也很慢，都算在第一个请求上。
+
+这里每个进程只建一个 ProductMatcher，worker 启动时（gunicorn.conf.py 的 post_worker_init 钩子，
+或直接运行 app.py 时）在后台线程里：
+1. 导入 ai_matcher（连带 sklearn、cv2、imagehash）
+2. 从预先生成的缓存文件加载 jieba 词典（JIEBA_CACHE，不存在时生成一次，之后各 worker 直接读取）
+3. 加载电商自定义词典（JIEBA_USER_DICT）
+4. 跑一次文本相似度，把剩余的惰性初始化也做掉
+
+import app 本身不会预热（测试、管理脚本不加载 jieba）；没有经过钩子启动时，第一次 get() 或就绪探针触发预热。
+stats() 同时给就绪探针 /api/ready 使用；用了 gunicorn --preload 时，fork 出的子进程会自己重新预热。
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WarmMatcher:
+    """进程内单例 ProductMatcher（线程安全）；stats() 供 /api/admin/metrics 使用"""
+
+    def __init__(self, cache_file: Optional[str] = None, user_dict: Optional[str] = None, image_store=None):
+        self.cache_file = cache_file
+        self.user_dict = user_dict
+        self.image_store = image_store  # 传给 ProductMatcher 的图片缓存（image_store.ImageStore）
+        self._lock = threading.Lock()
+        self._pid = None
+        self._ready = threading.Event()
+        self._matcher = None
+        self._error: Optional[BaseException] = None
+        self.started_at: Optional[float] = None
+        self.warm_seconds: Optional[float] = None
+        self.user_words = 0
+
+    def start(self) -> None:
+        """在后台线程预热；本进程已预热好或正在预热时直接返回，上次预热失败时重试"""
+        with self._lock:
+            if self._pid == os.getpid() and (self._matcher is not None or not self._ready.is_set()):
+                return
+            # 首次启动、上次失败，或 fork 后的子进程（父进程的预热线程不会被复制过来）
+            self._pid = os.getpid()
+            if self._matcher is not None:
+                return
+            self._ready.clear()
+            self._error = None
+            self.started_at = time.time()
+        threading.Thread(target=self._warm, name='matcher-warmup', daemon=True).start()
+
+    def _warm(self) -> None:
+        started = time.perf_counter()
+        try:
+            import jieba
+            jieba.setLogLevel(logging.WARNING)
+            if self.cache_file:
+                os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+                jieba.dt.cache_file = os.path.abspath(self.cache_file)
+            jieba.initialize()
+            if self.user_dict and os.path.isfile(self.user_dict):
+                jieba.load_userdict(self.user_dict)
+                with open(self.user_dict, encoding='utf-8') as f:
+                    self.user_words = sum(1 for line in f if line.strip())
+
+            from ai_matcher import ProductMatcher
+            matcher = ProductMatcher(image_store=self.image_store)
+            matcher.text_similarities(['预热'], ['预热'])
+            self._matcher = matcher
+            self.warm_seconds = round(time.perf_counter() - started, 3)
+            logger.info(f"✅ 商品匹配器预热完成，用时 {self.warm_seconds} 秒")
+        except Exception as e:
+            self._error = e
+            logger.error(f"❌ 商品匹配器预热失败: {e}")
+        finally:
+            self._ready.set()
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        返回预热好的 ProductMatcher；预热未完成时等待（最多 timeout 秒）
+        预热失败时抛出原来的异常，超时抛出 TimeoutError
+        """
+        self.start()
+        if not self._ready.wait(timeout):
+            raise TimeoutError('商品匹配器仍在预热')
+        matcher, error = self._matcher, self._error  # 先取到局部变量：并发的 start() 重试时会清空 _error
+        if matcher is None:
+            raise error if error is not None else RuntimeError('商品匹配器预热失败')
+        return matcher
+
+    def ready(self) -> bool:
+        return self._matcher is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready(),
+            'warming': not self._ready.is_set(),
+            'error': str(self._error) if self._error is not None else None,
+            'warm_seconds': self.warm_seconds,
+            'started_at': self.started_at,
+            'user_words': self.user_words,
+            'pid': self._pid
+        }